@@ -11,7 +11,8 @@ setup(
     install_requires=[
         "click",
         # "sacred @ git+https://github.com/rajatvd/sacred.git",
-        "sacred",
+        # sorcerun builds on private parts of sacred's Run and observers
+        "sacred>=0.8.4,<0.9",
         "pymongo",
         "pyyaml",
         "scikit-learn",
@@ -26,6 +27,7 @@ setup(
         "pandas",
         "pyfzf",
         "flameprof",
+        "psutil",
     ],
     scripts=["scripts/flamegraph.pl"],
     entry_points="""
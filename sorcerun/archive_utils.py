@@ -0,0 +1,318 @@
+from .globals import (
+    ARCHIVES_DIR,
+    METRICS_LOG_DIR,
+    GRID_OUTPUTS,
+    TEMP_CONFIGS_DIR,
+    MAX_RUN_ID_FILE,
+    COUT_GZ_FILE,
+)
+from .metrics_utils import metric_log_from_bytes, metric_name_of, records_to_series
+from .layout_utils import iter_run_dirs, run_id_of, grid_shard, archived_max_run_id
+from pyrsistent import freeze
+from pathlib import Path
+import incense
+import datetime
+import sqlite3
+import gzip
+import shutil
+import time
+import zlib
+import json
+import io
+import os
+
+# An archive packs the run directories of a grid into one sqlite file in
+# runs/_archives/<grid_id>.sqlite. Configs and statuses are kept in a small
+# table so runs can be filtered without touching their files, and every file
+# of a run is a zlib compressed blob keyed by (run_id, name), so a single run
+# or a single artifact can be read without unpacking anything else.
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id TEXT PRIMARY KEY,
+    status TEXT,
+    config TEXT
+);
+CREATE TABLE IF NOT EXISTS files (
+    run_id TEXT,
+    name TEXT,
+    data BLOB,
+    PRIMARY KEY (run_id, name)
+);
+"""
+
+# files every run has, everything else is an artifact
+RESERVED_FILES = {"run.json", "cout.txt", COUT_GZ_FILE, "metrics.json", "config.json"}
+
+
+def archive_path(runs_dir, grid_id):
+    return os.path.join(runs_dir, ARCHIVES_DIR, f"{grid_id}.sqlite")
+
+
+def iter_archives(runs_dir, grid_id=None):
+    """Yield the archives in *runs_dir*, only the one of *grid_id* if given."""
+    archives_dir = Path(runs_dir) / ARCHIVES_DIR
+    if isinstance(grid_id, str):
+        paths = [Path(archive_path(runs_dir, grid_id))]
+    elif archives_dir.is_dir():
+        paths = sorted(archives_dir.glob("*.sqlite"))
+    else:
+        paths = []
+    for path in paths:
+        if path.exists():
+            yield RunArchive(path)
+
+
+class ArchivedFile:
+    """A file of an archived run, read from the archive when first needed."""
+
+    def __init__(self, archive, run_id, name):
+        self.archive = archive
+        self.run_id = run_id
+        # incense names saved artifacts after the last two parts of this
+        self.name = f"{run_id}/{name}"
+        self._name = name
+        self._buf = None
+
+    def _file(self):
+        if self._buf is None:
+            self._buf = io.BytesIO(self.archive.read_file(self.run_id, self._name))
+        return self._buf
+
+    def read(self, *args):
+        return self._file().read(*args)
+
+    def seek(self, *args):
+        return self._file().seek(*args)
+
+    def tell(self):
+        return self._file().tell()
+
+
+class RunArchive:
+    """Runs of a grid packed into one sqlite file."""
+
+    def __init__(self, path):
+        self.path = str(path)
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.conn = sqlite3.connect(self.path)
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def add_run(self, run_dir, run_id):
+        """Pack *run_dir* into the archive, replacing a run with the same id.
+
+        Nothing is committed until commit() is called.
+        """
+        run_dir = Path(run_dir)
+        run_id = str(run_id)
+        with open(run_dir / "config.json", "r") as f:
+            config = f.read()
+        with open(run_dir / "run.json", "r") as f:
+            status = json.load(f).get("status")
+
+        self.conn.execute("DELETE FROM files WHERE run_id = ?", (run_id,))
+        self.conn.execute(
+            "INSERT OR REPLACE INTO runs VALUES (?, ?, ?)", (run_id, status, config)
+        )
+        for path in sorted(run_dir.rglob("*")):
+            if not path.is_file():
+                continue
+            self.conn.execute(
+                "INSERT INTO files VALUES (?, ?, ?)",
+                (
+                    run_id,
+                    path.relative_to(run_dir).as_posix(),
+                    zlib.compress(path.read_bytes()),
+                ),
+            )
+
+    def commit(self):
+        self.conn.commit()
+
+    def run_ids(self):
+        return [r[0] for r in self.conn.execute("SELECT run_id FROM runs")]
+
+    def configs(self):
+        """{run_id: (config, status)} of all archived runs."""
+        return {
+            run_id: (json.loads(config), status)
+            for run_id, status, config in self.conn.execute(
+                "SELECT run_id, status, config FROM runs"
+            )
+        }
+
+    def file_names(self, run_id):
+        return [
+            r[0]
+            for r in self.conn.execute(
+                "SELECT name FROM files WHERE run_id = ?", (str(run_id),)
+            )
+        ]
+
+    def read_file(self, run_id, name):
+        row = self.conn.execute(
+            "SELECT data FROM files WHERE run_id = ? AND name = ?", (str(run_id), name)
+        ).fetchone()
+        if row is None:
+            raise FileNotFoundError(f"{name} of run {run_id} is not in {self.path}")
+        return zlib.decompress(row[0])
+
+    def _read_json(self, run_id, name, default=None):
+        try:
+            return json.loads(self.read_file(run_id, name))
+        except FileNotFoundError:
+            if default is None:
+                raise
+            return default
+
+    def load_expt(self, run_id):
+        """Load an archived run as an incense FileSystemExperiment, like
+        incense_utils.load_filesystem_expt does for run directories."""
+        FSE = incense.experiment.FileSystemExperiment
+        Artifact = incense.artifact.Artifact
+        run_id = str(run_id)
+
+        run_data = self._read_json(run_id, "run.json")
+        run_data["config"] = self._read_json(run_id, "config.json")
+        run_data["info"] = self._read_json(run_id, "info.json", default={})
+        names = self.file_names(run_id)
+        run_data["captured_out"] = ""
+        if "cout.txt" in names:
+            run_data["captured_out"] = self.read_file(run_id, "cout.txt").decode()
+        elif COUT_GZ_FILE in names:
+            cout = gzip.decompress(self.read_file(run_id, COUT_GZ_FILE))
+            run_data["captured_out"] = cout.decode()
+
+        metrics = {}
+        for name, m in self._read_json(run_id, "metrics.json", default={}).items():
+            metrics[name] = records_to_series(
+                name, {"value": m["values"], "step": m["steps"]}
+            )
+        artifacts = {}
+        for name in names:
+            if name.startswith(METRICS_LOG_DIR + "/"):
+                metric = metric_name_of(name[len(METRICS_LOG_DIR) + 1 :])
+                if metric is not None:
+                    records = metric_log_from_bytes(self.read_file(run_id, name))
+                    metrics[metric] = records_to_series(metric, records)
+            elif "/" not in name and name not in RESERVED_FILES:
+                artifacts[name] = Artifact(name, ArchivedFile(self, run_id, name))
+
+        _id = int(run_id) if run_id.isdigit() else run_id
+        return FSE(_id, freeze(run_data), artifacts, metrics)
+
+
+# runs that may still be written to are never packed
+UNFINISHED_STATUSES = {"RUNNING", "QUEUED"}
+
+
+def _load_json(path):
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def grid_run_dirs(runs_dir, grid_id):
+    """Yield (run_dir, run.json, config.json) of the runs of *grid_id*, the
+    json files are None if missing or unreadable."""
+    for run_dir in iter_run_dirs(runs_dir, shards=[grid_shard(grid_id)]):
+        config = _load_json(run_dir / "config.json")
+        in_shard = run_dir.parent != Path(runs_dir)
+        if in_shard or (config is not None and config.get("grid_id") == grid_id):
+            yield run_dir, _load_json(run_dir / "run.json"), config
+
+
+def _remove_run_dir(run_dir, runs_dir):
+    shutil.rmtree(run_dir)
+    shard_dir = run_dir.parent
+    if shard_dir != Path(runs_dir) and not any(shard_dir.iterdir()):
+        shard_dir.rmdir()
+
+
+def compact_grid(runs_dir, grid_id, keep=False):
+    """Pack the finished runs of *grid_id* into its archive and remove their
+    run directories unless *keep*. Returns the number of packed runs."""
+    packed = []
+    with RunArchive(archive_path(runs_dir, grid_id)) as archive:
+        for run_dir, run, config in grid_run_dirs(runs_dir, grid_id):
+            if run is None or config is None:
+                continue
+            if run.get("status") in UNFINISHED_STATUSES:
+                continue
+            archive.add_run(run_dir, run_id_of(runs_dir, run_dir))
+            packed.append(run_dir)
+        archive.commit()
+
+    # flat run ids are taken from the largest existing directory name
+    flat_ids = [int(d.name) for d in packed if d.name.isdigit()]
+    if flat_ids and max(flat_ids) > archived_max_run_id(runs_dir):
+        with open(os.path.join(runs_dir, ARCHIVES_DIR, MAX_RUN_ID_FILE), "w") as f:
+            f.write(str(max(flat_ids)))
+
+    # only remove anything once the archive is safely written
+    if not keep:
+        for run_dir in packed:
+            _remove_run_dir(run_dir, runs_dir)
+    return len(packed)
+
+
+def _heartbeat_age(run, run_dir):
+    try:
+        heartbeat = datetime.datetime.fromisoformat(run["heartbeat"])
+        return (datetime.datetime.utcnow() - heartbeat).total_seconds()
+    except (KeyError, TypeError, ValueError):
+        return time.time() - os.path.getmtime(run_dir)
+
+
+def prune_grid(file_root, runs_dir, grid_id, stale_hours=24):
+    """Remove what a grid leaves behind: its temp_configs (once no slurm jobs
+    are tracked), and run directories that are broken (no config or run.json)
+    or stuck in RUNNING, with no heartbeat for *stale_hours*. Empty flat run
+    directories of any grid older than that are removed too, they are left
+    by runs killed before writing anything or reserved by older sorcerun
+    versions.
+
+    Returns the removed paths.
+    """
+    removed = []
+    gid_dir = os.path.join(file_root, GRID_OUTPUTS, grid_id)
+    temp_configs_dir = os.path.join(gid_dir, TEMP_CONFIGS_DIR)
+    if os.path.isdir(temp_configs_dir) and not os.path.exists(
+        os.path.join(gid_dir, "slurm_job_ids.txt")
+    ):
+        shutil.rmtree(temp_configs_dir)
+        removed.append(temp_configs_dir)
+
+    for run_dir, run, config in list(grid_run_dirs(runs_dir, grid_id)):
+        broken = run is None or config is None
+        if not broken and run.get("status") != "RUNNING":
+            continue
+        # a run that is just being created has no config yet either
+        if _heartbeat_age(run or {}, run_dir) > stale_hours * 3600:
+            _remove_run_dir(run_dir, runs_dir)
+            removed.append(str(run_dir))
+
+    for entry in os.scandir(runs_dir):
+        if not (entry.name.isdigit() and entry.is_dir()):
+            continue
+        try:
+            if os.listdir(entry.path):
+                continue
+            if time.time() - entry.stat().st_mtime > stale_hours * 3600:
+                os.rmdir(entry.path)
+                removed.append(entry.path)
+        except OSError:
+            # filled or removed by someone else meanwhile
+            continue
+    return removed
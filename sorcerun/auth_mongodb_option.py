@@ -1,7 +1,7 @@
 import json
 from sacred.commandline_options import CommandLineOption
 from sacred.observers import MongoObserver
-from pymongo import MongoClient
+from .mongodb_utils import get_mongo_client
 
 
 class AuthMongoDbOption(CommandLineOption):
@@ -21,8 +21,8 @@ class AuthMongoDbOption(CommandLineOption):
         atlas = auth.get("atlas_connection_string", 0)
         if atlas != 0:
             print(atlas)
-            client = MongoClient(atlas)
+            client = get_mongo_client(atlas)
         else:
-            client = MongoClient(**auth["client_kwargs"])
+            client = get_mongo_client(**auth["client_kwargs"])
         mongo = MongoObserver.create(db_name=auth["db_name"], client=client)
         run.observers.append(mongo)
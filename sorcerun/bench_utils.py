@@ -0,0 +1,725 @@
+from .globals import (
+    AUTH_FILE,
+    RUNS_DIR,
+    BENCH_KEY,
+    BENCH_METRIC_PREFIX,
+    BENCH_WARMUP,
+    BENCH_REPEATS,
+    BENCH_BOOTSTRAP,
+)
+from .sacred_utils import run_sacred_experiment, DummyRun
+from .lite_utils import run_lite_experiment
+from .mongodb_utils import mongo_url_from_auth
+from .incense_utils import (
+    load_filesystem_expts_by_config_keys,
+    squish_dict,
+    exps_to_xarray,
+    xarray_to_csv,
+    csv_to_xarray,
+)
+from .grid_profile_utils import scaling_exponent
+from contextlib import contextmanager, redirect_stdout, redirect_stderr
+from multiprocessing import cpu_count
+from functools import wraps
+from prettytable import PrettyTable
+from pymongo import MongoClient
+from pyrsistent import thaw
+import numpy as np
+import importlib.metadata
+import subprocess
+import platform
+import datetime
+import tempfile
+import logging
+import shutil
+import json
+import time
+import os
+
+# Benchmarks of sorcerun's own overhead (sorcerun bench-overhead), and of
+# adapters (sorcerun bench, at the end of this file).
+#
+# The overhead benchmarks run synthetic adapters that do next to nothing,
+# so almost all the time measured is sorcerun's. Every
+# benchmark returns rows {"benchmark", "case", "params", "seconds", ...}
+# where lower seconds is better, rows of two results files with the same
+# benchmark and case are compared by compare_results.
+BENCHMARKS = ["run_overhead", "grid_throughput", "xarray_scaling", "load_scaling"]
+
+# the synthetic adapter of grid_throughput, loaded from a file like any other
+GRID_ADAPTER = """import time
+
+
+def adapter(config, _run):
+    time.sleep(config["sleep"])
+    for step in range(config["steps"]):
+        _run.log_scalar("loss", 1.0 / (step + 1), step)
+
+
+adapter.experiment_name = "sorcerun_bench"
+adapter.flamegraph = "off"
+"""
+
+
+def noop_adapter(config, _run):
+    t0 = time.perf_counter()
+    for step in range(config["steps"]):
+        _run.log_scalar("loss", 1.0 / (step + 1), step)
+    noop_adapter.seconds.append(time.perf_counter() - t0)
+
+
+noop_adapter.experiment_name = "sorcerun_bench"
+# rendering flamegraphs happens outside the run, its cost is not sorcerun's
+noop_adapter.flamegraph = "off"
+noop_adapter.seconds = []
+
+
+@contextmanager
+def quiet():
+    """Silence sacred's logging and everything printed."""
+    with open(os.devnull, "w") as devnull:
+        with redirect_stdout(devnull), redirect_stderr(devnull):
+            logging.disable(logging.CRITICAL)
+            try:
+                yield
+            finally:
+                logging.disable(logging.NOTSET)
+
+
+def timing_stats(seconds):
+    seconds = np.asarray(seconds)
+    return {
+        "seconds": float(np.median(seconds)),
+        "mean": float(np.mean(seconds)),
+        "min": float(np.min(seconds)),
+        "p90": float(np.quantile(seconds, 0.9)),
+        "repeats": len(seconds),
+    }
+
+
+def mongo_available(auth_path, timeout_ms=2000):
+    """None if the mongo server in *auth_path* answers, else why not."""
+    if not os.path.exists(auth_path):
+        return f"no auth file at {auth_path}"
+    try:
+        with open(auth_path) as f:
+            url = mongo_url_from_auth(json.load(f))
+        client = MongoClient(url, serverSelectionTimeoutMS=timeout_ms)
+        client.server_info()
+        client.close()
+    except Exception as e:
+        return f"server not reachable ({type(e).__name__})"
+    return None
+
+
+def bench_run_overhead(work_dir, repeats=20, steps=10, auth_path=AUTH_FILE):
+    """Seconds per run of run_sacred_experiment (and run_lite_experiment)
+    beyond the adapter's own time, with and without profiling and mongo."""
+    cases = [
+        ("sacred", run_sacred_experiment, False, False),
+        ("sacred+profile", run_sacred_experiment, True, False),
+        ("lite", run_lite_experiment, False, False),
+        ("lite+profile", run_lite_experiment, True, False),
+    ]
+    skipped = mongo_available(auth_path)
+    if skipped is None:
+        cases += [
+            ("sacred+mongo", run_sacred_experiment, False, True),
+            ("sacred+mongo+profile", run_sacred_experiment, True, True),
+        ]
+
+    rows = []
+    for case, runner, profile, mongo in cases:
+        file_root = os.path.join(work_dir, case)
+        overheads = []
+        # the first run pays for imports and connecting to mongo
+        for i in range(repeats + 1):
+            noop_adapter.seconds = []
+            t0 = time.perf_counter()
+            with quiet():
+                runner(
+                    noop_adapter,
+                    {"steps": steps, "i": i, "seed": i},
+                    auth_path,
+                    use_mongo=mongo,
+                    file_storage_root=file_root,
+                    profile=profile,
+                )
+            wall = time.perf_counter() - t0
+            if i > 0:
+                overheads.append(wall - sum(noop_adapter.seconds))
+        rows.append(
+            {
+                "benchmark": "run_overhead",
+                "case": case,
+                "params": {"steps": steps},
+                **timing_stats(overheads),
+            }
+        )
+    if skipped is not None:
+        rows.append(
+            {"benchmark": "run_overhead", "case": "sacred+mongo", "skipped": skipped}
+        )
+    return rows
+
+
+def bench_grid_throughput(
+    work_dir, workers=(1, 2, 4), configs=24, sleep=0.0, steps=10, lite=False
+):
+    """Configs per second of a grid_run of *configs* synthetic configs that
+    sleep *sleep* seconds each, per number of workers."""
+    from .cli import sorcerun_grid_run
+
+    adapter_file = os.path.join(work_dir, "bench_adapter.py")
+    with open(adapter_file, "w") as f:
+        f.write(GRID_ADAPTER)
+    grid_file = os.path.join(work_dir, "bench_grid.py")
+    with open(grid_file, "w") as f:
+        f.write(
+            f"configs = [{{'i': i, 'sleep': {sleep}, 'steps': {steps}, "
+            f"'grid_id': 'bench_grid'}} for i in range({configs})]\n"
+        )
+
+    rows = []
+    used = set()
+    for n in workers:
+        # grid_run never runs more workers than cpus
+        n_workers = min(max(n, 1), cpu_count())
+        if n_workers in used:
+            continue
+        used.add(n_workers)
+        file_root = os.path.join(work_dir, f"grid_{n_workers}")
+        t0 = time.perf_counter()
+        with quiet():
+            sorcerun_grid_run(
+                adapter_file,
+                grid_file,
+                file_root,
+                mongo=False,
+                use_tqdm=False,
+                n_workers=n_workers,
+                lite=lite,
+            )
+        wall = time.perf_counter() - t0
+        rows.append(
+            {
+                "benchmark": "grid_throughput",
+                "case": f"{'lite' if lite else 'sacred'}, workers={n_workers}",
+                "params": {
+                    "configs": configs,
+                    "sleep": sleep,
+                    "steps": steps,
+                    "workers": n_workers,
+                },
+                "seconds": wall,
+                "configs_per_second": configs / wall,
+                # the time a config spends beyond its sleep, per worker
+                "overhead_per_config": (wall * n_workers / configs) - sleep,
+            }
+        )
+    return rows
+
+
+def write_synthetic_runs(runs_dir, grid_id, n_runs, n_metrics, n_steps, start=1):
+    """Write *n_runs* completed runs of *grid_id* to *runs_dir* in the flat
+    layout, as sacred's FileStorageObserver would, with *n_metrics* metrics of
+    *n_steps* steps each. Returns the next free run id."""
+    timestamp = datetime.datetime(2024, 1, 1).isoformat()
+    steps = list(range(n_steps))
+    for _id in range(start, start + n_runs):
+        run_dir = os.path.join(runs_dir, str(_id))
+        os.makedirs(run_dir)
+        files = {
+            "config.json": {"grid_id": grid_id, "x": _id - start, "seed": _id},
+            "run.json": {
+                "status": "COMPLETED",
+                "experiment": {"name": "sorcerun_bench"},
+                "start_time": timestamp,
+                "stop_time": timestamp,
+                "heartbeat": timestamp,
+                "artifacts": [],
+                "resources": [],
+                "result": None,
+            },
+            "info.json": {},
+            "metrics.json": {
+                f"m{m}": {
+                    "steps": steps,
+                    "values": [float(m + s) for s in steps],
+                    "timestamps": [timestamp] * n_steps,
+                }
+                for m in range(n_metrics)
+            },
+        }
+        for name, obj in files.items():
+            with open(os.path.join(run_dir, name), "w") as f:
+                json.dump(obj, f)
+        with open(os.path.join(run_dir, "cout.txt"), "w") as f:
+            f.write("")
+    return start + n_runs
+
+
+def best_of(repeats, func, setup=None):
+    """Median seconds of *repeats* calls of *func*, and its last result. With
+    *setup*, every call is func(setup()) and setup is not timed."""
+    seconds = []
+    for _ in range(repeats):
+        args = () if setup is None else (setup(),)
+        t0 = time.perf_counter()
+        with quiet():
+            result = func(*args)
+        seconds.append(time.perf_counter() - t0)
+    return timing_stats(seconds), result
+
+
+def bench_xarray_scaling(work_dir, base=(16, 4, 50), factors=(1, 4, 16), repeats=3):
+    """Seconds of exps_to_xarray and csv_to_xarray as the runs, metrics and
+    steps of a grid grow by *factors* from *base*, one at a time, and the
+    exponent of each in those sizes. exps_to_xarray gets freshly loaded runs
+    every call, so reading their metrics is timed too."""
+    sizes = [tuple(base)]
+    for axis in range(3):
+        for factor in factors:
+            size = list(base)
+            size[axis] *= factor
+            if tuple(size) not in sizes:
+                sizes.append(tuple(size))
+
+    rows = []
+    for n_runs, n_metrics, n_steps in sizes:
+        runs_dir = os.path.join(work_dir, f"xarray_{n_runs}_{n_metrics}_{n_steps}")
+        write_synthetic_runs(runs_dir, "bench_grid", n_runs, n_metrics, n_steps)
+        params = {"runs": n_runs, "metrics": n_metrics, "steps": n_steps}
+        case = f"{n_runs} runs x {n_metrics} metrics x {n_steps} steps"
+
+        # runs cache their metrics once read, a reused list would time that cache
+        stats, (_, metrics_arr) = best_of(
+            repeats,
+            exps_to_xarray,
+            setup=lambda: load_filesystem_expts_by_config_keys(
+                runs_dir, grid_id="bench_grid"
+            ),
+        )
+        rows.append(
+            {"benchmark": "exps_to_xarray", "case": case, "params": params, **stats}
+        )
+
+        csv_file = os.path.join(runs_dir, "grid.csv")
+        with quiet():
+            xarray_to_csv(metrics_arr, csv_file)
+        stats, _ = best_of(repeats, lambda: csv_to_xarray(csv_file, "metrics"))
+        rows.append(
+            {"benchmark": "csv_to_xarray", "case": case, "params": params, **stats}
+        )
+        shutil.rmtree(runs_dir)
+
+    base = dict(zip(["runs", "metrics", "steps"], base))
+    for benchmark in ["exps_to_xarray", "csv_to_xarray"]:
+        for key in base:
+            points = [
+                (r["params"][key], r["seconds"])
+                for r in rows
+                if r["benchmark"] == benchmark
+                and "params" in r
+                and all(r["params"][k] == v for k, v in base.items() if k != key)
+            ]
+            rows.append(
+                {
+                    "benchmark": benchmark,
+                    "case": f"exponent in {key}",
+                    "exponent": scaling_exponent(*zip(*points)),
+                }
+            )
+    return rows
+
+
+def bench_load_scaling(
+    work_dir, sizes=(100, 400, 1600), grid_runs=20, n_metrics=2, n_steps=10, repeats=3
+):
+    """Seconds of load_filesystem_expts_by_config_keys loading a grid of
+    *grid_runs* runs, and all runs, from runs directories of *sizes* runs."""
+    runs_dir = os.path.join(work_dir, RUNS_DIR)
+    os.makedirs(runs_dir)
+    next_id = write_synthetic_runs(
+        runs_dir, "bench_grid", grid_runs, n_metrics, n_steps
+    )
+    rows = []
+    for size in sorted(sizes):
+        if size > next_id - 1:
+            # the other runs belong to other grids
+            next_id = write_synthetic_runs(
+                runs_dir, "other_grid", size - next_id + 1, n_metrics, n_steps, next_id
+            )
+        params = {"runs_dir_size": size, "grid_runs": grid_runs}
+        for case, kwargs in [("grid", {"grid_id": "bench_grid"}), ("all", {})]:
+            stats, _ = best_of(
+                repeats,
+                lambda: load_filesystem_expts_by_config_keys(runs_dir, **kwargs),
+            )
+            rows.append(
+                {
+                    "benchmark": "load_filesystem_expts",
+                    "case": f"{case}, {size} runs",
+                    "params": params,
+                    **stats,
+                }
+            )
+    for case in ["grid", "all"]:
+        points = [
+            (r["params"]["runs_dir_size"], r["seconds"])
+            for r in rows
+            if "params" in r and r["case"].startswith(f"{case},")
+        ]
+        rows.append(
+            {
+                "benchmark": "load_filesystem_expts",
+                "case": f"{case}, exponent in runs_dir_size",
+                "exponent": scaling_exponent(*zip(*points)),
+            }
+        )
+    return rows
+
+
+def git_output(directory, *args):
+    """Output of git *args* in the repo of *directory*, or None."""
+    try:
+        out = subprocess.run(
+            ["git", *args], cwd=directory, capture_output=True, text=True
+        )
+    except OSError:
+        return None
+    if out.returncode != 0:
+        return None
+    return out.stdout.strip()
+
+
+def environment():
+    """Where the benchmarks ran, to tell results of versions apart."""
+    try:
+        version = importlib.metadata.version("sorcerun")
+    except importlib.metadata.PackageNotFoundError:
+        version = None
+    return {
+        "sorcerun_version": version,
+        "git_commit": git_output(os.path.dirname(__file__), "rev-parse", "HEAD"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": cpu_count(),
+        "time": datetime.datetime.now().isoformat(),
+    }
+
+
+def run_benchmarks(only=None, quick=False, auth_path=AUTH_FILE, workers=(1, 2, 4)):
+    """Run the benchmarks named in *only* (all by default) in a temporary
+    directory. Returns the results, see BENCHMARKS."""
+    only = only or BENCHMARKS
+    unknown = set(only) - set(BENCHMARKS)
+    if unknown:
+        raise ValueError(
+            f"Unknown benchmarks {sorted(unknown)}, choose from {BENCHMARKS}"
+        )
+
+    results = {"environment": environment(), "quick": quick, "rows": []}
+    with tempfile.TemporaryDirectory(prefix="sorcerun_bench_") as work_dir:
+        for name in only:
+            bench_dir = os.path.join(work_dir, name)
+            os.makedirs(bench_dir)
+            print(f"Running {name}")
+            t0 = time.perf_counter()
+            if name == "run_overhead":
+                rows = bench_run_overhead(
+                    bench_dir, repeats=5 if quick else 20, auth_path=auth_path
+                )
+            elif name == "grid_throughput":
+                rows = bench_grid_throughput(
+                    bench_dir, workers=workers, configs=8 if quick else 24
+                )
+            elif name == "xarray_scaling":
+                rows = bench_xarray_scaling(
+                    bench_dir,
+                    factors=(1, 4) if quick else (1, 4, 16),
+                    repeats=1 if quick else 3,
+                )
+            else:
+                rows = bench_load_scaling(
+                    bench_dir,
+                    sizes=(50, 200) if quick else (100, 400, 1600),
+                    repeats=1 if quick else 3,
+                )
+            print(f"  took {time.perf_counter() - t0:.1f}s")
+            results["rows"] += rows
+    return results
+
+
+def results_table(rows):
+    t = PrettyTable(["benchmark", "case", "median (ms)", "min (ms)", "other"])
+    for r in rows:
+        if "skipped" in r:
+            other = f"skipped: {r['skipped']}"
+        elif "exponent" in r:
+            e = r["exponent"]
+            other = "exponent: -" if e is None else f"exponent: {e:.2f}"
+        elif "configs_per_second" in r:
+            other = f"{r['configs_per_second']:.2f} configs/s"
+        else:
+            other = ""
+        median = r.get("seconds")
+        low = r.get("min")
+        t.add_row(
+            [
+                r["benchmark"],
+                r["case"],
+                "" if median is None else round(1e3 * median, 2),
+                "" if low is None else round(1e3 * low, 2),
+                other,
+            ]
+        )
+    t.align = "l"
+    return t
+
+
+def compare_results(rows, baseline_rows, threshold=1.1):
+    """Table of the change of seconds of every benchmark and case in both
+    *rows* and *baseline_rows*, slower by more than *threshold* is flagged.
+    Returns (table, number of regressions)."""
+    baseline = {
+        (r["benchmark"], r["case"]): r["seconds"]
+        for r in baseline_rows
+        if "seconds" in r
+    }
+    t = PrettyTable(["benchmark", "case", "baseline (ms)", "now (ms)", "ratio", ""])
+    regressions = 0
+    for r in rows:
+        key = (r["benchmark"], r["case"])
+        if "seconds" not in r or key not in baseline:
+            continue
+        ratio = r["seconds"] / baseline[key] if baseline[key] > 0 else np.inf
+        slower = ratio > threshold
+        regressions += slower
+        t.add_row(
+            [
+                *key,
+                round(1e3 * baseline[key], 2),
+                round(1e3 * r["seconds"], 2),
+                round(ratio, 2),
+                "SLOWER" if slower else "",
+            ]
+        )
+    t.align = "l"
+    return t, regressions
+
+
+# sorcerun bench runs an adapter *warmup* times and then times *repeats*
+# calls of it, all in one run whose config is the adapter's config with a
+# BENCH_KEY entry naming the adapter file and the commit of its code. The
+# times of the calls are logged as the bench.seconds metric and summarized
+# by bench.median, bench.ci_low, ... at step 0. Runs of the same adapter and
+# config at another commit are the baseline of a comparison.
+
+# config keys that change between commits without changing the benchmark
+VOLATILE_KEYS = ["seed", "commit_hash", "main_tree_hash", "time_str", "dirty"]
+
+
+def code_commit(python_file, config):
+    """(commit, dirty) of the code benchmarked: the config's commit_hash (as
+    recorded by the config templates), else HEAD of the adapter's repo."""
+    directory = os.path.dirname(os.path.abspath(python_file))
+    if config.get("commit_hash"):
+        return config["commit_hash"], bool(config.get("dirty", False))
+    commit = git_output(directory, "rev-parse", "HEAD")
+    status = git_output(directory, "status", "--porcelain", "--untracked-files=no")
+    return commit, bool(status)
+
+
+def resolve_commit(python_file, revision):
+    """The full hash of git *revision* in the adapter's repo, or *revision*
+    itself (e.g. a hash prefix) if git cannot resolve it."""
+    directory = os.path.dirname(os.path.abspath(python_file))
+    commit = git_output(directory, "rev-parse", "--verify", f"{revision}^{{commit}}")
+    return commit or revision
+
+
+def bootstrap(samples, stat, n=BENCH_BOOTSTRAP, rng=None):
+    """*stat* of *n* resamples (with replacement) of *samples*."""
+    rng = rng or np.random.default_rng(0)
+    samples = np.asarray(samples)
+    idx = rng.integers(0, len(samples), size=(n, len(samples)))
+    return stat(samples[idx], axis=1)
+
+
+def interval(resampled, confidence):
+    tail = 100 * (1 - confidence) / 2
+    low, high = np.percentile(resampled, [tail, 100 - tail])
+    return float(low), float(high)
+
+
+def bench_stats(seconds, confidence=0.95):
+    """Summary of the times of a benchmark, with a bootstrap confidence
+    interval of the median."""
+    seconds = np.asarray(seconds, dtype=float)
+    ci_low, ci_high = interval(bootstrap(seconds, np.median), confidence)
+    return {
+        "median": float(np.median(seconds)),
+        "mean": float(np.mean(seconds)),
+        "std": float(np.std(seconds, ddof=1)) if len(seconds) > 1 else 0.0,
+        "min": float(np.min(seconds)),
+        "max": float(np.max(seconds)),
+        "ci_low": ci_low,
+        "ci_high": ci_high,
+    }
+
+
+def speedup(baseline, seconds, confidence=0.95):
+    """(speedup, ci_low, ci_high) of the median time against the *baseline*
+    times, above 1 is faster. The interval bootstraps both sides."""
+    rng = np.random.default_rng(0)
+    ratios = bootstrap(baseline, np.median, rng=rng) / bootstrap(
+        seconds, np.median, rng=rng
+    )
+    return (float(np.median(baseline) / np.median(seconds)),) + interval(
+        ratios, confidence
+    )
+
+
+def verdict(ci_low, ci_high):
+    if ci_low > 1:
+        return "faster"
+    if ci_high < 1:
+        return "slower"
+    return "no significant change"
+
+
+def bench_adapter(
+    adapter_func, warmup=BENCH_WARMUP, repeats=BENCH_REPEATS, with_logging=False
+):
+    """An adapter that benchmarks *adapter_func*. It keeps the attributes of
+    *adapter_func*, so runs are stored and captured the same way. Timed calls
+    log to a DummyRun, so what logging costs is left out, unless
+    *with_logging*, then they log to the run like the first warmup call."""
+
+    @wraps(adapter_func)
+    def bench(config, _run):
+        config = {k: v for k, v in config.items() if k != BENCH_KEY}
+        # only the first warmup call logs to the run, so the adapter's own
+        # metrics are recorded once (not at all without warmup) and every
+        # timed call runs the same way, without paying for logging unless
+        # with_logging
+        for i in range(warmup):
+            adapter_func(config, _run if i == 0 else DummyRun(config, _run._id))
+        seconds = []
+        for i in range(repeats):
+            run = _run if with_logging else DummyRun(config, _run._id)
+            t0 = time.perf_counter()
+            adapter_func(config, run)
+            seconds.append(time.perf_counter() - t0)
+            _run.log_scalar(f"{BENCH_METRIC_PREFIX}seconds", seconds[-1], i)
+        stats = bench_stats(seconds)
+        for k, v in stats.items():
+            _run.log_scalar(f"{BENCH_METRIC_PREFIX}{k}", v, 0)
+        _run.info[BENCH_KEY] = {"seconds": seconds, **stats}
+        return stats
+
+    return bench
+
+
+def bench_config(
+    python_file,
+    config,
+    warmup=BENCH_WARMUP,
+    repeats=BENCH_REPEATS,
+    with_logging=False,
+):
+    """*config* with the BENCH_KEY entry of a benchmark of *python_file*."""
+    if BENCH_KEY in config:
+        raise KeyError(f"Config key {BENCH_KEY} is used by sorcerun bench")
+    commit, dirty = code_commit(python_file, config)
+    return {
+        **config,
+        BENCH_KEY: {
+            "adapter": os.path.basename(python_file),
+            "commit": commit,
+            "dirty": dirty,
+            "warmup": warmup,
+            "repeats": repeats,
+            "with_logging": with_logging,
+        },
+    }
+
+
+def benchmark_key(config):
+    """What makes two benchmark runs comparable: the adapter, whether timed
+    calls logged and the config without the keys that change with every
+    commit."""
+    config = squish_dict(thaw(config))
+    bench = {k: v for k, v in config.items() if k.startswith(f"{BENCH_KEY}.")}
+    config = {
+        k: v for k, v in config.items() if k not in VOLATILE_KEYS and k not in bench
+    }
+    return (
+        bench.get(f"{BENCH_KEY}.adapter"),
+        bool(bench.get(f"{BENCH_KEY}.with_logging", False)),
+        json.dumps(config, sort_keys=True, default=str),
+    )
+
+
+def bench_runs(runs_dir, config, commit=None, exclude=None):
+    """The runs benchmarking the same adapter and config as *config* (a
+    bench_config), at *commit* (or a prefix of it) if given, leaving out the
+    run with id *exclude*."""
+    key = benchmark_key(config)
+    exps = load_filesystem_expts_by_config_keys(
+        runs_dir,
+        statuses=["COMPLETED"],
+        **{f"{BENCH_KEY}.adapter": key[0]},
+    )
+    runs = []
+    for e in exps:
+        if str(e.id) == str(exclude) or benchmark_key(e.config) != key:
+            continue
+        run_commit = thaw(e.config)[BENCH_KEY].get("commit") or ""
+        if commit is None or run_commit.startswith(commit):
+            runs.append(e)
+    return runs
+
+
+def run_seconds(exps):
+    """The timed calls of benchmark runs *exps*, pooled."""
+    seconds = []
+    for e in exps:
+        series = e.metrics.get(f"{BENCH_METRIC_PREFIX}seconds")
+        if series is not None:
+            seconds += [float(v) for v in series.values]
+    return seconds
+
+
+def bench_table(rows, confidence=0.95):
+    """Table of *rows* (label, commit, runs, bench_stats of their times)."""
+    t = PrettyTable(
+        [
+            "",
+            "commit",
+            "runs",
+            "calls",
+            "median (s)",
+            f"{100 * confidence:g}% CI (s)",
+            "mean (s)",
+            "std (s)",
+            "min (s)",
+        ]
+    )
+    for label, commit, runs, calls, stats in rows:
+        t.add_row(
+            [
+                label,
+                (commit or "-")[:8],
+                runs,
+                calls,
+                f"{stats['median']:.4g}",
+                f"[{stats['ci_low']:.4g}, {stats['ci_high']:.4g}]",
+                f"{stats['mean']:.4g}",
+                f"{stats['std']:.4g}",
+                f"{stats['min']:.4g}",
+            ]
+        )
+    t.align = "l"
+    return t
@@ -0,0 +1,145 @@
+from .globals import BLOB_HASH_CHUNK
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import traceback
+import tempfile
+import hashlib
+import shutil
+import stat
+import os
+
+# Artifacts are stored once in <file_storage>/blobs/<2 hex>/<sha256> and
+# hardlinked into the run directories that add them, so runs that save the
+# same file share its data. Where hardlinks are not possible (e.g. the run
+# directory is on another file system) the run gets a symlink to the blob.
+# Blobs are read only, write a new file instead of changing an artifact.
+
+
+def hash_file(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(BLOB_HASH_CHUNK), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class BlobStore:
+    """Content addressed store for artifact files."""
+
+    def __init__(self, root):
+        self.root = root
+        self._lock = threading.Lock()
+        # (path, size, mtime) -> digest, so a file is hashed once per run
+        self._digests = {}
+
+    def path(self, digest):
+        return os.path.join(self.root, digest[:2], digest)
+
+    def digest(self, filename):
+        st = os.stat(filename)
+        key = (os.path.abspath(filename), st.st_size, st.st_mtime_ns)
+        with self._lock:
+            digest = self._digests.get(key)
+        if digest is None:
+            digest = hash_file(filename)
+            with self._lock:
+                self._digests[key] = digest
+        return digest
+
+    def put(self, filename):
+        """Add *filename* to the store unless its content is already there,
+        returns its digest."""
+        digest = self.digest(filename)
+        blob = self.path(digest)
+        if os.path.exists(blob):
+            return digest
+
+        os.makedirs(os.path.dirname(blob), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(blob), prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as dst, open(filename, "rb") as src:
+                shutil.copyfileobj(src, dst, BLOB_HASH_CHUNK)
+            os.chmod(tmp, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+            # another run may have stored the same content meanwhile, the
+            # replace is atomic and both copies are identical
+            os.replace(tmp, blob)
+        except BaseException:
+            os.remove(tmp)
+            raise
+        return digest
+
+    def link(self, digest, dest):
+        """Make *dest* refer to the blob *digest*, replacing *dest*."""
+        if os.path.lexists(dest):
+            os.remove(dest)
+        try:
+            os.link(self.path(digest), dest)
+        except OSError:
+            os.symlink(os.path.abspath(self.path(digest)), dest)
+
+    def save(self, filename, dest):
+        self.link(self.put(filename), dest)
+
+
+# files of the run directory an artifact may not replace
+RESERVED_FILES = ["run.json", "config.json", "cout.txt", "metrics.json"]
+
+
+def use_blob_store(observer, store):
+    """Make a FileStorageObserver (or LiteRunWriter) link artifacts from
+    *store* instead of copying them into the run directory."""
+    save_file = observer.save_file
+
+    def save_file_to_blob_store(filename, target_name=None):
+        target_name = target_name or os.path.basename(filename)
+        dest_file = os.path.join(observer.dir, target_name)
+        if os.path.basename(dest_file) in RESERVED_FILES or os.path.abspath(
+            filename
+        ) == os.path.abspath(dest_file):
+            # let the observer complain about (or skip) these
+            return save_file(filename, target_name)
+        store.save(filename, dest_file)
+
+    observer.save_file = save_file_to_blob_store
+
+
+class ArtifactUploader:
+    """Adds artifacts in a background thread, in the order they were added.
+
+    The file of an artifact must not change until the run ends (or
+    ``_run.wait_artifacts()`` returns), only its content at upload time is
+    stored.
+    """
+
+    def __init__(self, add_artifact, store=None):
+        self.add_artifact = add_artifact
+        self.store = store
+        self._executor = None
+        self._futures = []
+
+    def submit(self, filename, name=None, metadata=None, content_type=None):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=1)
+        filename = os.path.abspath(filename)
+        self._futures.append(
+            self._executor.submit(self._add, filename, name, metadata, content_type)
+        )
+
+    def _add(self, filename, name, metadata, content_type):
+        if self.store is not None:
+            # hash and copy before add_artifact, which only has to link then
+            self.store.put(filename)
+        self.add_artifact(filename, name, metadata, content_type)
+
+    def wait(self):
+        """Wait for all submitted artifacts, warning about failed ones."""
+        futures, self._futures = self._futures, []
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+        for future in futures:
+            try:
+                future.result()
+            except Exception:
+                traceback.print_exc()
+                print("WARNING: Failed to add an artifact in the background")
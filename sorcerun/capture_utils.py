@@ -0,0 +1,176 @@
+from .globals import CAPTURE_LIMIT, CAPTURE_COMPRESS_MIN, COUT_FILE, COUT_GZ_FILE
+from sacred.stdout_capturing import tee_output_fd
+from contextlib import contextmanager, redirect_stdout, redirect_stderr
+import threading
+import gzip
+import sys
+import io
+import os
+
+# How the output of a run is captured (``adapter.capture_mode``):
+#
+#   sys:   tee sys.stdout and sys.stderr, keep all of it (sacred's default)
+#   fd:    tee the stdout and stderr file descriptors with `tee` processes,
+#          also captures output of C extensions and subprocesses
+#   none:  capture nothing, cout.txt stays empty
+#   ring:  tee sys.stdout and sys.stderr, but only keep the first and last
+#          ``adapter.capture_limit`` / 2 characters
+CAPTURE_MODES = ["sys", "fd", "none", "ring"]
+
+# what sacred calls these modes, ring is captured by sorcerun
+SACRED_CAPTURE_MODES = {"sys": "sys", "fd": "fd", "none": "no", "ring": "no"}
+
+
+class _Tee(io.TextIOBase):
+    def __init__(self, *streams):
+        self.streams = streams
+
+    def write(self, s):
+        for stream in self.streams:
+            stream.write(s)
+        return len(s)
+
+    def flush(self):
+        for stream in self.streams:
+            stream.flush()
+
+
+def dropped_marker(dropped):
+    return f"\n[... {dropped} characters dropped ...]\n"
+
+
+def head_tail(text, limit):
+    """The first and last *limit* / 2 characters of *text*."""
+    if len(text) <= limit:
+        return text
+    half = limit // 2
+    return text[:half] + dropped_marker(len(text) - 2 * half) + text[-half:]
+
+
+class HeadTailBuffer:
+    """Text stream that keeps the first and last *limit* / 2 characters."""
+
+    def __init__(self, limit=CAPTURE_LIMIT):
+        self.half = max(int(limit) // 2, 1)
+        self.head = []
+        self.head_len = 0
+        self.tail = []
+        self.tail_len = 0
+        self.dropped = 0
+        self._lock = threading.Lock()
+
+    def write(self, s):
+        with self._lock:
+            if self.head_len < self.half:
+                n = self.half - self.head_len
+                self.head.append(s[:n])
+                self.head_len += len(self.head[-1])
+                s = s[n:]
+            self.tail.append(s)
+            self.tail_len += len(s)
+            # trim once the tail is twice as long as kept, not on every write
+            if self.tail_len > 2 * self.half:
+                self._trim()
+
+    def _trim(self):
+        tail = "".join(self.tail)
+        if len(tail) > self.half:
+            self.dropped += len(tail) - self.half
+            tail = tail[-self.half :]
+        self.tail = [tail]
+        self.tail_len = len(tail)
+
+    def flush(self):
+        pass
+
+    def getvalue(self):
+        with self._lock:
+            self._trim()
+            marker = dropped_marker(self.dropped) if self.dropped else ""
+            return "".join(self.head) + marker + self.tail[0]
+
+
+@contextmanager
+def capture_output(mode="sys", limit=CAPTURE_LIMIT):
+    """Capture stdout and stderr while still printing them.
+
+    Yields a function that returns the output captured so far (and all of it
+    once the context has exited). See CAPTURE_MODES for the modes.
+    """
+    if mode not in CAPTURE_MODES:
+        raise ValueError(f"Unknown capture mode {mode}, choose from {CAPTURE_MODES}")
+
+    if mode == "none":
+        yield lambda: ""
+    elif mode == "fd":
+        chunks = []
+
+        def text():
+            chunks.append(out.get())
+            return "".join(chunks)
+
+        with tee_output_fd() as out:
+            yield text
+    else:
+        buffer = io.StringIO() if mode == "sys" else HeadTailBuffer(limit)
+        tee_out, tee_err = _Tee(sys.stdout, buffer), _Tee(sys.stderr, buffer)
+        with redirect_stdout(tee_out), redirect_stderr(tee_err):
+            yield buffer.getvalue
+
+
+@contextmanager
+def ring_capture_run(run, limit=CAPTURE_LIMIT):
+    """Capture the output of a sacred Run in ring mode. Start the run inside
+    this context, with ``run.capture_mode = "no"``."""
+    with capture_output("ring", limit) as text:
+
+        def _get_captured_output():
+            out = text()
+            if run.captured_out_filter is not None:
+                out = run.captured_out_filter(out)
+            run.captured_out = out
+
+        run._get_captured_output = _get_captured_output
+        for observer in run.observers:
+            if hasattr(observer, "save_cout"):
+                # the captured output is not append only anymore, rewrite it
+                observer.save_cout = _rewrite_cout(observer)
+        yield
+
+
+def _rewrite_cout(observer):
+    def save_cout():
+        with open(os.path.join(observer.dir, COUT_FILE), "w") as f:
+            f.write(observer.cout)
+
+    return save_cout
+
+
+def compress_cout(run_dir, min_size=CAPTURE_COMPRESS_MIN):
+    """Replace cout.txt of *run_dir* by cout.txt.gz if it is large."""
+    path = os.path.join(run_dir, COUT_FILE)
+    if not os.path.exists(path) or os.path.getsize(path) < min_size:
+        return
+    gz_path = os.path.join(run_dir, COUT_GZ_FILE)
+    tmp_path = gz_path + ".tmp"
+    with open(path, "rb") as src, gzip.open(tmp_path, "wb") as dst:
+        while True:
+            chunk = src.read(1 << 20)
+            if not chunk:
+                break
+            dst.write(chunk)
+    os.replace(tmp_path, gz_path)
+    os.remove(path)
+
+
+def read_cout(run_dir):
+    """The captured output of *run_dir*, compressed or not."""
+    path = os.path.join(run_dir, COUT_FILE)
+    if os.path.exists(path):
+        with open(path, "r") as f:
+            return f.read()
+    gz_path = os.path.join(run_dir, COUT_GZ_FILE)
+    if os.path.exists(gz_path):
+        with gzip.open(gz_path, "rt") as f:
+            return f.read()
+    return ""
@@ -5,11 +5,58 @@ import os
 from tqdm import tqdm
 import subprocess
 import json, yaml
+import copy
+import shutil
 from richerator import richerator
 from datetime import datetime
-from contextlib import ExitStack
-from .mongodb_utils import mongodb_server, init_mongodb
-from .sacred_utils import load_python_module, run_sacred_experiment
+from contextlib import ExitStack, nullcontext
+from .mongodb_utils import (
+    mongodb_server,
+    init_mongodb,
+    get_mongo_client,
+    mongo_url_from_auth,
+)
+from .observers import replay_journals
+from .sacred_utils import (
+    load_python_module,
+    run_sacred_experiment,
+    resolve_file_storage_root,
+)
+from .lite_utils import run_lite_experiment
+from .scratch_utils import ScratchStager, recover_scratch
+from .queue_utils import WorkQueue, Heartbeat
+from .summary_utils import (
+    SUMMARY_STATS,
+    summary_file,
+    load_summaries,
+    best_runs,
+    best_table,
+    phase_table,
+)
+from .archive_utils import compact_grid, prune_grid, archive_path, grid_run_dirs
+from .profile_utils import render_flamegraph, flamegraph_command
+from .grid_profile_utils import grid_profile as sorcerun_grid_profile, GRID_PROFILE_DIR
+from .trace_utils import set_tracer, trace_span, write_trace
+from .stats_utils import GridStats, parse_openmetrics, status_lines
+from .bench_utils import (
+    BENCHMARKS,
+    run_benchmarks,
+    results_table,
+    compare_results,
+    bench_adapter,
+    bench_config,
+    bench_stats,
+    bench_runs,
+    bench_table,
+    run_seconds,
+    resolve_commit,
+    speedup,
+    verdict,
+)
+from .memprofile_utils import (
+    grid_memprofile as sorcerun_grid_memprofile,
+    GRID_MEMPROFILE_DIR,
+)
 from .incense_utils import (
     squish_dict,
     unsquish_dict,
@@ -21,12 +68,24 @@ from .globals import (
     TEMP_CONFIGS_DIR,
     FILE_STORAGE_ROOT,
     GRID_OUTPUTS,
+    RUNS_DIR,
+    QUEUE_DIR,
+    MONGO_JOURNAL_DIR,
+    MONGO_FLUSH_INTERVAL,
+    MONGO_MAX_BATCH,
     TEMPLATE_FILES,
+    FLAMEGRAPH_FILE,
+    TRACE_DIR,
+    TRACE_FILE,
+    STATS_FILE,
+    BENCH_OVERHEAD_FILE,
+    BENCH_KEY,
+    BENCH_WARMUP,
+    BENCH_REPEATS,
 )
-from .slurm_utils import Job, poll_jobs
+from .slurm_utils import Job, poll_jobs, submit_slurm_command, submit_after_jobs
 
 from contextlib import redirect_stdout, redirect_stderr
-import platform
 
 
 from itertools import chain
@@ -34,9 +93,10 @@ from prettytable import PrettyTable
 import sys, ipdb, traceback
 
 from multiprocessing import Pool, cpu_count, Queue, Manager
-from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 
 from functools import partial
+
 # %%
 
 
@@ -100,6 +160,33 @@ def template():
     help="Don't use cProfile to profile the adapter function",
     default=False,
 )
+@click.option(
+    "--scratch",
+    is_flag=True,
+    help="Stage run directories on node-local scratch ($TMPDIR) and move them to file_root at the end",
+)
+@click.option(
+    "--lite",
+    is_flag=True,
+    help="Run with a lightweight sorcerun run object instead of a sacred experiment (no mongo)",
+)
+@click.option(
+    "--memprofile",
+    is_flag=True,
+    help="Trace the adapter's allocations with tracemalloc",
+)
+@click.option(
+    "--mongo_flush_interval",
+    default=MONGO_FLUSH_INTERVAL,
+    show_default=True,
+    help="Seconds between writes of buffered metrics to mongo",
+)
+@click.option(
+    "--mongo_max_batch",
+    default=MONGO_MAX_BATCH,
+    show_default=True,
+    help="Write buffered metrics to mongo as soon as this many are pending",
+)
 def run(
     python_file,
     config_file,
@@ -107,6 +194,11 @@ def run(
     auth_path,
     mongo,
     dont_profile,
+    scratch,
+    lite,
+    memprofile,
+    mongo_flush_interval,
+    mongo_max_batch,
 ):
     sorcerun_run(
         python_file,
@@ -115,6 +207,11 @@ def run(
         auth_path=auth_path,
         mongo=mongo,
         dont_profile=dont_profile,
+        scratch=scratch,
+        lite=lite,
+        memprofile=memprofile,
+        mongo_flush_interval=mongo_flush_interval,
+        mongo_max_batch=mongo_max_batch,
     )
 
 
@@ -125,6 +222,11 @@ def sorcerun_run(
     auth_path=AUTH_FILE,
     mongo=False,
     dont_profile=False,
+    scratch=False,
+    lite=False,
+    memprofile=False,
+    mongo_flush_interval=MONGO_FLUSH_INTERVAL,
+    mongo_max_batch=MONGO_MAX_BATCH,
 ):
     # Load the adapter function from the provided Python file
     adapter_module = load_python_module(python_file, force_reload=True)
@@ -133,7 +235,27 @@ def sorcerun_run(
             f"Adapter file at {python_file} does not have an attribute named adapter"
         )
     adapter_func = adapter_module.adapter
+    config = load_config(config_file)
+
+    # Run the Sacred experiment with the provided adapter function and config
+    with scratch_stager(file_root, scratch) as stager:
+        r = experiment_runner(lite)(
+            adapter_func,
+            config,
+            auth_path,
+            use_mongo=mongo,
+            file_storage_root=file_root,
+            profile=not dont_profile,
+            runs_dir=stager and stager.scratch_runs_dir,
+            memprofile=memprofile,
+            mongo_flush_interval=mongo_flush_interval,
+            mongo_max_batch=mongo_max_batch,
+        )
+    return r
+
 
+def load_config(config_file):
+    """Load the config in a JSON, YAML or python (with a `config` dict) file."""
     _, config_ext = os.path.splitext(config_file)
 
     # Check extension of config file and load it accordingly
@@ -154,17 +276,21 @@ def sorcerun_run(
         raise ValueError(
             f"Config file at {config_file} is not a valid JSON, YAML or python file"
         )
+    return config
 
-    # Run the Sacred experiment with the provided adapter function and config
-    r = run_sacred_experiment(
-        adapter_func,
-        config,
-        auth_path,
-        use_mongo=mongo,
-        file_storage_root=file_root,
-        profile=not dont_profile,
-    )
-    return r
+
+def experiment_runner(lite=False):
+    """run_lite_experiment if *lite*, otherwise run_sacred_experiment."""
+    return run_lite_experiment if lite else run_sacred_experiment
+
+
+def scratch_stager(file_root, scratch):
+    """A ScratchStager for the runs dir under *file_root* if *scratch*,
+    otherwise a context manager that yields None."""
+    if not scratch:
+        return nullcontext()
+    runs_dir = os.path.join(resolve_file_storage_root(file_root), RUNS_DIR)
+    return ScratchStager(runs_dir)
 
 
 @sorcerun.command()
@@ -219,6 +345,38 @@ def sorcerun_run(
     is_flag=True,
     help="Suppress output from worker processes",
 )
+@click.option(
+    "--scratch",
+    is_flag=True,
+    help="Stage run directories on node-local scratch ($TMPDIR) and move them to file_root at the end",
+)
+@click.option(
+    "--lite",
+    is_flag=True,
+    help="Run with a lightweight sorcerun run object instead of a sacred experiment (no mongo)",
+)
+@click.option(
+    "--memprofile",
+    is_flag=True,
+    help="Trace the adapter's allocations with tracemalloc",
+)
+@click.option(
+    "--trace",
+    is_flag=True,
+    help="Write a Chrome trace of what every worker did to grid_outputs/<grid_id>",
+)
+@click.option(
+    "--mongo_flush_interval",
+    default=MONGO_FLUSH_INTERVAL,
+    show_default=True,
+    help="Seconds between writes of buffered metrics to mongo",
+)
+@click.option(
+    "--mongo_max_batch",
+    default=MONGO_MAX_BATCH,
+    show_default=True,
+    help="Write buffered metrics to mongo as soon as this many are pending",
+)
 def grid_run(
     python_file,
     grid_config_file,
@@ -229,6 +387,12 @@ def grid_run(
     no_tqdm=False,
     n_workers: int = 1,  # <--- new argument (set to cpu_count() for “max”)
     not_quiet: bool = False,  # <--- new argument to control output
+    scratch: bool = False,
+    lite: bool = False,
+    memprofile: bool = False,
+    trace: bool = False,
+    mongo_flush_interval=MONGO_FLUSH_INTERVAL,
+    mongo_max_batch=MONGO_MAX_BATCH,
 ):
     sorcerun_grid_run(
         python_file,
@@ -240,10 +404,73 @@ def grid_run(
         use_tqdm=not no_tqdm,
         n_workers=n_workers,
         quiet=not not_quiet,
+        scratch=scratch,
+        lite=lite,
+        memprofile=memprofile,
+        trace=trace,
+        mongo_flush_interval=mongo_flush_interval,
+        mongo_max_batch=mongo_max_batch,
     )
 
 
+def load_grid_configs(grid_config_file, force_reload=False):
+    """Load the list of configs in a grid config file.
+
+    A yaml file is expanded into the product of all its list valued
+    (squished) keys, a python file must have a `configs` list. grid_ids are
+    made strings (see normalize_grid_id).
+    """
+    _, config_ext = os.path.splitext(grid_config_file)
+
+    if config_ext == ".yaml":
+        with open(grid_config_file, "r") as file:
+            config = yaml.safe_load(file)
+        config = squish_dict(config)
+        for k, v in config.items():
+            if type(v) != list:
+                config[k] = [v]
+        param_grid = ParameterGrid([config])
+        configs = [unsquish_dict(param) for param in param_grid]
+
+    elif config_ext == ".py":
+        config_module = load_python_module(grid_config_file, force_reload=force_reload)
+        if not hasattr(config_module, "configs"):
+            raise KeyError(
+                f"Config file at {grid_config_file} does not have an attribute named configs"
+            )
+        configs = config_module.configs
+    else:
+        raise ValueError(
+            f"Config file at {grid_config_file} is not a valid YAML or python file"
+        )
+    return [normalize_grid_id(c) for c in configs]
+
+
+def normalize_grid_id(config):
+    """*config* with a string grid_id, which names the grid's directories and
+    shard. A grid_id in a one element tuple or list (e.g. left by a trailing
+    comma) is unpacked, any other grid_id is converted with str."""
+    grid_id = config.get("grid_id")
+    if grid_id is None or isinstance(grid_id, str):
+        return config
+    if isinstance(grid_id, (tuple, list)) and len(grid_id) == 1:
+        grid_id = grid_id[0]
+    return {**config, "grid_id": str(grid_id)}
+
+
 # %%
+_devnull = None
+
+
+def _worker_devnull():
+    # opened once per worker, which runs many configs: sacred's logger keeps
+    # writing to the stream it first saw as stderr
+    global _devnull
+    if _devnull is None:
+        _devnull = open(os.devnull, "w")
+    return _devnull
+
+
 def _run_single_config(
     idx_conf_tuple,
     python_file,
@@ -253,6 +480,12 @@ def _run_single_config(
     pre_grid_hook,
     post_grid_hook,
     quiet=True,
+    runs_dir=None,
+    lite=False,
+    memprofile=False,
+    trace_dir=None,
+    mongo_flush_interval=MONGO_FLUSH_INTERVAL,
+    mongo_max_batch=MONGO_MAX_BATCH,
 ):
     """
     Helper executed in a worker process.
@@ -260,42 +493,66 @@ def _run_single_config(
     have to pickle simple objects (ints / dicts / strings).
     """
     idx, conf = idx_conf_tuple
+    start = time.time()
 
-    if quiet:
-        null_dev = "NUL" if platform.system() == "Windows" else "/dev/null"
-        devnull = open(null_dev, "w")
-        sys.stdout.flush()
-        sys.stderr.flush()
-        redir = (redirect_stdout(devnull), redirect_stderr(devnull))
-    else:
-        redir = (redirect_stdout(sys.stdout), redirect_stderr(sys.stderr))  # no-op!
+    set_tracer(trace_dir)
 
     # local import keeps the worker lightweight
-    with redir[0], redir[1]:
+    with ExitStack() as redir:
+        redir.enter_context(trace_span("task", idx=idx))
+        if quiet:
+            devnull = _worker_devnull()
+            sys.stdout.flush()
+            sys.stderr.flush()
+            redir.enter_context(redirect_stdout(devnull))
+            redir.enter_context(redirect_stderr(devnull))
         try:
-            from .sacred_utils import load_python_module, run_sacred_experiment
+            from .sacred_utils import load_python_module
 
-            adapter_module = load_python_module(python_file, force_reload=True)
+            with trace_span("module load"):
+                adapter_module = load_python_module(python_file, force_reload=True)
             adapter_func = adapter_module.adapter
 
             if pre_grid_hook is not None:
-                pre_grid_hook(conf)
+                with trace_span("pre hook"):
+                    pre_grid_hook(conf)
 
-            run_sacred_experiment(
+            experiment_runner(lite)(
                 adapter_func,
                 conf,
                 auth_path,
                 use_mongo=mongo,
                 file_storage_root=file_root,
+                runs_dir=runs_dir,
+                memprofile=memprofile,
+                mongo_flush_interval=mongo_flush_interval,
+                mongo_max_batch=mongo_max_batch,
             )
 
             if post_grid_hook is not None:
-                post_grid_hook(conf)
+                with trace_span("post hook"):
+                    post_grid_hook(conf)
 
         except Exception:
             raise  # still propagate so the future ends in error
 
-    return idx  # used only for progress-bar accounting
+    # the duration is measured here, the parent only sees when futures finish
+    return idx, time.time() - start
+
+
+def _report_task(stats, idx, fut):
+    """Done callback of the future running config *idx* of a grid."""
+    failed = fut.cancelled() or fut.exception() is not None
+    duration = None if failed else fut.result()[1]
+    stats.task_done(idx, failed=failed, duration=duration)
+
+
+def grid_name(configs, grid_config_file):
+    """The grid_id shared by all *configs*, or the name of the config file."""
+    gid = configs[0].get("grid_id") if configs else None
+    if gid and all(c.get("grid_id") == gid for c in configs):
+        return gid
+    return os.path.splitext(os.path.basename(grid_config_file))[0]
 
 
 # %%
@@ -310,10 +567,18 @@ def sorcerun_grid_run(
     *,
     n_workers: int = 1,  # <--- new argument (set to cpu_count() for “max”)
     quiet: bool = True,  # <--- new argument to control output
+    scratch: bool = False,
+    lite: bool = False,
+    memprofile: bool = False,
+    trace: bool = False,
+    mongo_flush_interval=MONGO_FLUSH_INTERVAL,
+    mongo_max_batch=MONGO_MAX_BATCH,
 ):
     """
     Run all configs in *grid_config_file*.
     If *n_workers>1* we spread the work across that many processes.
+    With *trace*, a Chrome trace of the grid and a summary of how busy the
+    workers were are saved to grid_outputs/<grid_id> (see trace_utils).
     """
     # ------------------------------------------------------------------ setup
     adapter_module = load_python_module(python_file, force_reload=True)
@@ -323,102 +588,142 @@ def sorcerun_grid_run(
     post_grid_hook = getattr(adapter_module, "post_grid_hook", None)
 
     # ----- load configs exactly as before -----------------------------------
-    _, config_ext = os.path.splitext(grid_config_file)
-    if config_ext == ".yaml":
-        with open(grid_config_file, "r") as fh:
-            base_cfg = yaml.safe_load(fh)
-        flat = squish_dict(base_cfg)
-        for k, v in flat.items():
-            if not isinstance(v, list):
-                flat[k] = [v]
-        param_grid = ParameterGrid([flat])
-        configs = [unsquish_dict(p) for p in param_grid]
-    elif config_ext == ".py":
-        cfg_mod = load_python_module(grid_config_file, force_reload=True)
-        if not hasattr(cfg_mod, "configs"):
-            raise KeyError(f"{grid_config_file} needs a `configs` list")
-        configs = cfg_mod.configs
-    else:
-        raise ValueError("grid config must be *.yaml or *.py*")
+    configs = load_grid_configs(grid_config_file, force_reload=True)
 
     total = len(configs)
     click.echo(f"Config grid contains {total} combinations")
 
-    # ---------------------------------------------------------------- worker
-    if n_workers > 1:
-        # canonical worker count
-        n_workers = min(max(n_workers, 1), cpu_count())
-        # ---------- submit every job right away, remember when it started
-
-        total = len(configs)
+    name = grid_name(configs, grid_config_file)
+    grid_out = os.path.join(resolve_file_storage_root(file_root), GRID_OUTPUTS, name)
+    trace_dir = None
+    if trace:
+        trace_dir = os.path.join(grid_out, TRACE_DIR)
+        # spans of an earlier traced run of this grid
+        shutil.rmtree(trace_dir, ignore_errors=True)
+    set_tracer(trace_dir)
+
+    futures = []
+    stats = GridStats(
+        grid_out,
+        name,
+        total,
+        n_workers=n_workers,
+        # only for the running tasks, durations come from the workers
+        poll=lambda: [i for i, fut in enumerate(futures) if fut.running()],
+    )
+    click.echo(f"Live stats in {stats.path}")
 
-        with ProcessPoolExecutor(max_workers=n_workers) as pool:
-            runner = partial(
-                _run_single_config,
-                python_file=python_file,
-                auth_path=auth_path,
-                file_root=file_root,
-                mongo=mongo,
-                pre_grid_hook=pre_grid_hook,
-                post_grid_hook=post_grid_hook,
-                quiet=quiet,  # <--- pass the quiet argument
-            )
-            futures = []
-            for i, conf in tqdm(enumerate(configs)):
-                futures.append(
-                    pool.submit(runner, (i, conf))
-                )  # submit each config as a separate job
-
-            def futures_poller():
-                while True:
-                    running = [idx for idx, fut in enumerate(futures) if fut.running()]
-                    done = [idx for idx, fut in enumerate(futures) if fut.done()]
-                    time.sleep(1)  # avoid busy-waiting
-                    yield (
-                        (running),
-                        (done),
+    try:
+        with scratch_stager(file_root, scratch) as stager, stats:
+            runs_dir = stager and stager.scratch_runs_dir
+
+            # ---------------------------------------------------------------- worker
+            if n_workers > 1:
+                # canonical worker count
+                n_workers = min(max(n_workers, 1), cpu_count())
+                stats.n_workers = n_workers
+                # ---------- submit every job right away, remember when it started
+
+                total = len(configs)
+
+                with ProcessPoolExecutor(max_workers=n_workers) as pool:
+                    runner = partial(
+                        _run_single_config,
+                        python_file=python_file,
+                        auth_path=auth_path,
+                        file_root=file_root,
+                        mongo=mongo,
+                        pre_grid_hook=pre_grid_hook,
+                        post_grid_hook=post_grid_hook,
+                        quiet=quiet,  # <--- pass the quiet argument
+                        runs_dir=runs_dir,
+                        lite=lite,
+                        memprofile=memprofile,
+                        trace_dir=trace_dir,
+                        mongo_flush_interval=mongo_flush_interval,
+                        mongo_max_batch=mongo_max_batch,
                     )
+                    futures = []
+                    for i, conf in tqdm(enumerate(configs)):
+                        with trace_span("submit", idx=i):
+                            futures.append(
+                                pool.submit(runner, (i, conf))
+                            )  # submit each config as a separate job
+                        futures[-1].add_done_callback(partial(_report_task, stats, i))
+
+                    def futures_poller():
+                        while True:
+                            running = [
+                                idx for idx, fut in enumerate(futures) if fut.running()
+                            ]
+                            done = [
+                                idx for idx, fut in enumerate(futures) if fut.done()
+                            ]
+                            time.sleep(1)  # avoid busy-waiting
+                            yield (
+                                (running),
+                                (done),
+                            )
+
+                    print(
+                        f"Submitted {len(futures)} jobs in parallel with {n_workers} workers"
+                    )
+                    time.sleep(1)  # give some time for the first jobs to start
+
+                    t = chain([None], as_completed(futures))
+                    for just_done in richerator(
+                        t,
+                        description="Running grid",
+                        refresh_per_second=2,
+                        # total=len(configs) + 1,
+                    ):
+                        if just_done is not None:
+                            idx, _ = just_done.result()
+                            print(f"Just finished run {idx + 1}")
+
+                        running = [
+                            idx for idx, fut in enumerate(futures) if fut.running()
+                        ]
+                        print(f"Running {len(running)} jobs:")
+                        print("\n".join(f"{i + 1}" for i in running))
+
+            # ---------------------------------------------------------------- serial
+            else:
+                iterable = (
+                    tqdm(enumerate(configs), total=total)
+                    if use_tqdm
+                    else enumerate(configs)
+                )
+                for idx, conf in iterable:
+                    click.echo(f"----- GRID RUN {idx + 1}/{total} -----")
+                    with trace_span("task", idx=idx), stats.task(idx):
+                        if pre_grid_hook is not None:
+                            with trace_span("pre hook"):
+                                pre_grid_hook(conf)
+
+                        experiment_runner(lite)(
+                            adapter_module.adapter,
+                            conf,
+                            auth_path,
+                            use_mongo=mongo,
+                            file_storage_root=file_root,
+                            runs_dir=runs_dir,
+                            memprofile=memprofile,
+                            mongo_flush_interval=mongo_flush_interval,
+                            mongo_max_batch=mongo_max_batch,
+                        )
+
+                        if post_grid_hook is not None:
+                            with trace_span("post hook"):
+                                post_grid_hook(conf)
+    finally:
+        # also when a config failed, that is when the trace is most useful
+        if trace:
+            set_tracer(None)
+            lines = write_trace(trace_dir, grid_out, n_workers, name=name)
+            click.echo("\n".join(lines))
+            click.echo(f"Trace saved to {os.path.join(grid_out, TRACE_FILE)}")
 
-            print(f"Submitted {len(futures)} jobs in parallel with {n_workers} workers")
-            time.sleep(1)  # give some time for the first jobs to start
-
-            t = chain([None], as_completed(futures))
-            for just_done in richerator(
-                t,
-                description="Running grid",
-                refresh_per_second=2,
-                # total=len(configs) + 1,
-            ):
-                if just_done is not None:
-                    idx = just_done.result()
-                    print(f"Just finished run {idx + 1}")
-
-                running = [idx for idx, fut in enumerate(futures) if fut.running()]
-                print(f"Running {len(running)} jobs:")
-                print("\n".join(f"{i + 1}" for i in running))
-
-    # ---------------------------------------------------------------- serial
-    else:
-        iterable = (
-            tqdm(enumerate(configs), total=total) if use_tqdm else enumerate(configs)
-        )
-        for idx, conf in iterable:
-            click.echo(f"----- GRID RUN {idx + 1}/{total} -----")
-            if pre_grid_hook is not None:
-                pre_grid_hook(conf)
-
-            run_sacred_experiment(
-                adapter_module.adapter,
-                conf,
-                auth_path,
-                use_mongo=mongo,
-                file_storage_root=file_root,
-            )
-
-            if post_grid_hook is not None:
-                post_grid_hook(conf)
-
-    # ---------------------------------------------------------------- finish
     if post_process:
         gid = configs[0].get("grid_id")
         if gid and all(c.get("grid_id") == gid for c in configs):
@@ -466,6 +771,31 @@ def sorcerun_grid_run(
     is_flag=True,
     help="Use MongoObserver",
 )
+@click.option(
+    "--bundle_size",
+    "-b",
+    default=1,
+    show_default=True,
+    help="Number of configs to run inside each slurm job",
+)
+@click.option(
+    "--wait/--no_wait",
+    "-w/-W",
+    default=True,
+    show_default=True,
+    help="Block until all jobs finish and post process locally, or return"
+    + " right away and post process in a dependent slurm job",
+)
+@click.option(
+    "--scratch",
+    is_flag=True,
+    help="Stage run directories on node-local scratch ($TMPDIR) and move them to file_root at the end",
+)
+@click.option(
+    "--lite",
+    is_flag=True,
+    help="Run with a lightweight sorcerun run object instead of a sacred experiment (no mongo)",
+)
 def grid_slurm(
     python_file,
     grid_config_file,
@@ -474,6 +804,10 @@ def grid_slurm(
     auth_path,
     post_process=False,
     mongo=False,
+    bundle_size=1,
+    wait=True,
+    scratch=False,
+    lite=False,
 ):
     # Load the adapter function from the provided Python file
     adapter_module = load_python_module(python_file)
@@ -483,29 +817,7 @@ def grid_slurm(
         )
 
     # Check extension of grid config file and load it accordingly
-    _, config_ext = os.path.splitext(grid_config_file)
-
-    if config_ext == ".yaml":
-        with open(grid_config_file, "r") as file:
-            config = yaml.safe_load(file)
-        config = squish_dict(config)
-        for k, v in config.items():
-            if type(v) != list:
-                config[k] = [v]
-        param_grid = ParameterGrid([config])
-        configs = [unsquish_dict(param) for param in param_grid]
-
-    elif config_ext == ".py":
-        config_module = load_python_module(grid_config_file)
-        if not hasattr(config_module, "configs"):
-            raise KeyError(
-                f"Config file at {grid_config_file} does not have an attribute named configs"
-            )
-        configs = config_module.configs
-    else:
-        raise ValueError(
-            f"Config file at {grid_config_file} is not a valid YAML or python file"
-        )
+    configs = load_grid_configs(grid_config_file)
 
     total_num_params = len(configs)
     print(f"Config grid contains {total_num_params} combinations")
@@ -537,15 +849,9 @@ def grid_slurm(
     os.makedirs(temp_configs_dir, exist_ok=True)
 
     jobs = []
-    # Run the Sacred experiment with the provided adapter function and config
+    # Save every config to a temp file first, so that bundles can refer to them
+    temp_config_files = []
     for i, conf in enumerate(configs):
-        print(
-            "-" * 5
-            + "GRID RUN INFO: "
-            + f"Submitting run {i + 1}/{total_num_params}"
-            + "-" * 5
-        )
-
         temp_config_file = os.path.join(temp_configs_dir, f"config_{i}.json")
 
         print(f"Saving the following config to {temp_config_file}")
@@ -554,31 +860,46 @@ def grid_slurm(
         # Save config to a temp file
         with open(temp_config_file, "w") as file:
             json.dump(conf, file)
+        temp_config_files.append(temp_config_file)
 
-        slurm_command = (
-            f"sorcerun run {python_file} {temp_config_file} --file_root {file_root} --auth_path {auth_path}"
-            + ("-m" if mongo else "")
-        )
-
-        slurm.add_cmd(slurm_command)
-        print(f"sbatch content:")
-        print(slurm)
+    if bundle_size > 1:
+        chunks = [
+            temp_config_files[i : i + bundle_size]
+            for i in range(0, total_num_params, bundle_size)
+        ]
+    else:
+        chunks = [[f] for f in temp_config_files]
 
-        cmd = "\n".join(
-            (
-                "sbatch" + " << EOF",
-                slurm.script(shell="/bin/sh", convert=True),
-                "EOF",
-            )
+    # Run the Sacred experiment with the provided adapter function and config
+    for i, chunk in enumerate(chunks):
+        print(
+            "-" * 5
+            + "GRID RUN INFO: "
+            + f"Submitting job {i + 1}/{len(chunks)}"
+            + "-" * 5
         )
-        slurm.run_cmds = slurm.run_cmds[:-1]
 
-        # proc = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE)
-        # run the command and get the output
-        out = subprocess.check_output(cmd, shell=True).decode("utf-8").strip()
+        if bundle_size > 1:
+            bundle_file = os.path.join(temp_configs_dir, f"bundle_{i}.json")
+            with open(bundle_file, "w") as file:
+                json.dump([os.path.abspath(f) for f in chunk], file, indent=2)
+            print(f"Saved bundle of {len(chunk)} configs to {bundle_file}")
+
+            slurm_command = (
+                f"sorcerun run-bundle {python_file} {bundle_file} --file_root {file_root} --auth_path {auth_path}"
+                + (" -m" if mongo else "")
+                + (" --scratch" if scratch else "")
+                + (" --lite" if lite else "")
+            )
+        else:
+            slurm_command = (
+                f"sorcerun run {python_file} {chunk[0]} --file_root {file_root} --auth_path {auth_path}"
+                + (" -m" if mongo else "")
+                + (" --scratch" if scratch else "")
+                + (" --lite" if lite else "")
+            )
 
-        # extract slurm job id from out
-        job_id = int(out.split()[-1])
+        job_id = submit_slurm_command(slurm, slurm_command)
         jobs.append(Job(job_id))
 
         # append the job id to the slurm_jobs.txt file if same_gid
@@ -589,7 +910,7 @@ def grid_slurm(
         print(
             "-" * 5
             + "GRID RUN INFO: "
-            + f"Finished submitting run {i + 1}/{total_num_params}"
+            + f"Finished submitting job {i + 1}/{len(chunks)}"
             + "-" * 5
         )
 
@@ -598,26 +919,51 @@ def grid_slurm(
     if same_gid:
         print(f"Saved {len(jobs)} slurm job ids to {gid_dir}/slurm_job_ids.txt")
 
-    time.sleep(10)
-    poll_jobs(jobs)
+    if wait:
+        name = grid_name(configs, grid_config_file)
+        grid_out = gid_dir or os.path.join(file_root, GRID_OUTPUTS, name)
+        # Slurm only reports job states, not the memory of running jobs
+        stats = GridStats(grid_out, name, len(jobs), n_workers=len(jobs), rss=None)
+        with stats:
+            click.echo(f"Live stats in {stats.path}")
+            time.sleep(10)
+            poll_jobs(jobs, stats=stats)
 
     if post_process:
         # Post process grid and save xarray to netcdf
         # check if each config in configs has the same "grid_id" and assign it to gid
-        if same_gid:
+        if not same_gid:
+            print(
+                f"Configs do not have the same grid_id."
+                + " Skipping processing and saving grid to csv"
+            )
+        elif wait:
             print(f"Processing and saving grid to csv")
             process_and_save_grid_to_csv(gid, file_root=file_root)
             click.echo(f"Removing {job_ids_file}")
             os.remove(job_ids_file)
         else:
+            # let slurm run the post processing once every job has ended
+            post_job_id = submit_after_jobs(
+                slurm,
+                f"sorcerun grid-to-csv {gid} --file_root {file_root}",
+                [j.job_id for j in jobs],
+            )
             print(
-                f"Configs do not have the same grid_id."
-                + " Skipping processing and saving grid to csv"
+                f"Submitted post processing job {post_job_id},"
+                + f" which will run after all {len(jobs)} jobs have ended"
             )
 
 
 @sorcerun.command()
-@click.argument("grid_id", type=str)
+@click.argument(
+    "python_file",
+    type=click.Path(exists=True, dir_okay=False),
+)
+@click.argument(
+    "bundle_file",
+    type=click.Path(exists=True, dir_okay=False),
+)
 @click.option(
     "--file_root",
     "-f",
@@ -625,57 +971,915 @@ def grid_slurm(
     type=click.Path(file_okay=False),
     help="Root directory for file storage",
 )
-def grid_to_netcdf(grid_id, file_root):
-    save_dir = f"{file_root}/{GRID_OUTPUTS}/{grid_id}"
-    # check if there is slurm_job_ids.txt in the grid_id directory
-    job_ids_file = os.path.join(save_dir, "slurm_job_ids.txt")
-    if os.path.exists(job_ids_file):
-        click.echo(f"Slurm job ids found for grid with grid_id {grid_id}.")
-        with open(job_ids_file, "r") as file:
-            job_ids = file.read().strip().splitlines()
-            jobs = [Job(int(job_id)) for job_id in job_ids]
-            poll_jobs(jobs)
-
-        # if we made it here, all jobs must have finished,
-        # so remove slurm_job_ids.txt
-        click.echo(f"Removing {job_ids_file}")
-        os.remove(job_ids_file)
-
-    click.echo(f"Processing and saving grid with grid_id {grid_id} to netcdf")
-    process_and_save_grid_to_netcdf(grid_id, file_root=file_root)
-
-
-@sorcerun.command()
-@click.argument("grid_id", type=str)
 @click.option(
-    "--file_root",
-    "-f",
-    default=FILE_STORAGE_ROOT,
-    type=click.Path(file_okay=False),
-    help="Root directory for file storage",
+    "--auth_path",
+    default=AUTH_FILE,
+    help="Path to sorcerun_auth.json file.",
 )
-def grid_to_csv(grid_id, file_root):
-    save_dir = f"{file_root}/{GRID_OUTPUTS}/{grid_id}"
-    # check if there is slurm_job_ids.txt in the grid_id directory
-    job_ids_file = os.path.join(save_dir, "slurm_job_ids.txt")
-    if os.path.exists(job_ids_file):
-        click.echo(f"Slurm job ids found for grid with grid_id {grid_id}.")
-        with open(job_ids_file, "r") as file:
-            job_ids = file.read().strip().splitlines()
-            jobs = [Job(int(job_id)) for job_id in job_ids]
-            poll_jobs(jobs)
+@click.option(
+    "--mongo",
+    "-m",
+    is_flag=True,
+    help="Use MongoObserver",
+)
+@click.option(
+    "--n-workers",
+    "-n",
+    default=None,
+    type=int,
+    help="Processes to use (defaults to the CPUs allocated to this job)",
+)
+@click.option(
+    "--not_quiet",
+    "-nq",
+    is_flag=True,
+    help="Show output from worker processes",
+)
+@click.option(
+    "--scratch",
+    is_flag=True,
+    help="Stage run directories on node-local scratch ($TMPDIR) and move them to file_root at the end",
+)
+@click.option(
+    "--lite",
+    is_flag=True,
+    help="Run with a lightweight sorcerun run object instead of a sacred experiment (no mongo)",
+)
+def run_bundle(
+    python_file,
+    bundle_file,
+    file_root,
+    auth_path,
+    mongo=False,
+    n_workers=None,
+    not_quiet=False,
+    scratch=False,
+    lite=False,
+):
+    sorcerun_run_bundle(
+        python_file,
+        bundle_file,
+        file_root,
+        auth_path,
+        mongo=mongo,
+        n_workers=n_workers,
+        quiet=not not_quiet,
+        scratch=scratch,
+        lite=lite,
+    )
 
-        # if we made it here, all jobs must have finished,
-        # so remove slurm_job_ids.txt
-        click.echo(f"Removing {job_ids_file}")
-        os.remove(job_ids_file)
 
-    click.echo(f"Processing and saving grid with grid_id {grid_id} to csv")
-    process_and_save_grid_to_csv(grid_id, file_root=file_root)
+def allocated_cpus():
+    """Number of CPUs available to this process (respects slurm allocations)."""
+    slurm_cpus = os.environ.get("SLURM_CPUS_PER_TASK")
+    if slurm_cpus is not None:
+        return int(slurm_cpus)
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return cpu_count()
 
 
-@sorcerun.group()
-def mongo():
+def sorcerun_run_bundle(
+    python_file,
+    bundle_file,
+    file_root=FILE_STORAGE_ROOT,
+    auth_path=AUTH_FILE,
+    mongo=False,
+    *,
+    n_workers=None,
+    quiet=True,
+    scratch=False,
+    lite=False,
+):
+    """
+    Run every config listed in *bundle_file* (a json list of config files).
+
+    Each finished config gets a ``<config_file>.done`` marker, and configs
+    that already have one are skipped, so a partially finished bundle can
+    simply be resubmitted to resume it.
+    """
+    adapter_module = load_python_module(python_file, force_reload=True)
+    if not hasattr(adapter_module, "adapter"):
+        raise KeyError(f"{python_file} needs an `adapter` callable")
+    pre_grid_hook = getattr(adapter_module, "pre_grid_hook", None)
+    post_grid_hook = getattr(adapter_module, "post_grid_hook", None)
+
+    with open(bundle_file, "r") as fh:
+        config_files = json.load(fh)
+
+    pending = [f for f in config_files if not os.path.exists(f + ".done")]
+    click.echo(
+        f"Bundle {bundle_file} contains {len(config_files)} configs, "
+        + f"{len(config_files) - len(pending)} already done"
+    )
+
+    configs = []
+    for f in pending:
+        with open(f, "r") as fh:
+            configs.append(json.load(fh))
+
+    if n_workers is None:
+        n_workers = allocated_cpus()
+    n_workers = max(min(n_workers, len(pending)), 1)
+
+    failed = []
+    done = []
+    with scratch_stager(file_root, scratch) as stager:
+        runner = partial(
+            _run_single_config,
+            python_file=python_file,
+            auth_path=auth_path,
+            file_root=file_root,
+            mongo=mongo,
+            pre_grid_hook=pre_grid_hook,
+            post_grid_hook=post_grid_hook,
+            quiet=quiet,
+            runs_dir=stager and stager.scratch_runs_dir,
+            lite=lite,
+        )
+        # staged runs are only safe once moved off scratch, mark them done then
+        _run_bundle_configs(
+            runner, configs, pending, n_workers, failed, done, defer=bool(stager)
+        )
+    for f in done:
+        with open(f + ".done", "w"):
+            pass
+
+    if failed:
+        raise click.ClickException(
+            f"{len(failed)} configs in bundle {bundle_file} failed:\n"
+            + "\n".join(failed)
+        )
+
+
+def _run_bundle_configs(runner, configs, pending, n_workers, failed, done, defer):
+    def mark(idx, suffix, content=""):
+        if suffix == ".done" and defer:
+            done.append(pending[idx])
+            return
+        with open(pending[idx] + suffix, "w") as fh:
+            fh.write(content)
+
+    if n_workers > 1:
+        click.echo(f"Running {len(pending)} configs with {n_workers} workers")
+        with ProcessPoolExecutor(max_workers=n_workers) as pool:
+            futures = {
+                pool.submit(runner, (i, conf)): i for i, conf in enumerate(configs)
+            }
+            for fut in as_completed(futures):
+                idx = futures[fut]
+                try:
+                    fut.result()
+                    mark(idx, ".done")
+                    click.echo(f"Finished {pending[idx]}")
+                except Exception:
+                    failed.append(pending[idx])
+                    mark(idx, ".failed", traceback.format_exc())
+                    click.echo(f"Failed {pending[idx]}")
+    else:
+        for idx, conf in enumerate(configs):
+            try:
+                runner((idx, conf))
+                mark(idx, ".done")
+                click.echo(f"Finished {pending[idx]}")
+            except Exception:
+                failed.append(pending[idx])
+                mark(idx, ".failed", traceback.format_exc())
+                click.echo(f"Failed {pending[idx]}")
+
+
+@sorcerun.command()
+@click.argument("grid_id", type=str)
+@click.option(
+    "--file_root",
+    "-f",
+    default=FILE_STORAGE_ROOT,
+    type=click.Path(file_okay=False),
+    help="Root directory for file storage",
+)
+def grid_to_netcdf(grid_id, file_root):
+    save_dir = f"{file_root}/{GRID_OUTPUTS}/{grid_id}"
+    # check if there is slurm_job_ids.txt in the grid_id directory
+    job_ids_file = os.path.join(save_dir, "slurm_job_ids.txt")
+    if os.path.exists(job_ids_file):
+        click.echo(f"Slurm job ids found for grid with grid_id {grid_id}.")
+        with open(job_ids_file, "r") as file:
+            job_ids = file.read().strip().splitlines()
+            jobs = [Job(int(job_id)) for job_id in job_ids]
+            unfinished = poll_jobs(jobs)
+
+        # once all jobs have finished, slurm_job_ids.txt is not needed anymore
+        if unfinished:
+            click.echo(f"Keeping {job_ids_file}, some jobs did not finish")
+        else:
+            click.echo(f"Removing {job_ids_file}")
+            os.remove(job_ids_file)
+
+    click.echo(f"Processing and saving grid with grid_id {grid_id} to netcdf")
+    process_and_save_grid_to_netcdf(grid_id, file_root=file_root)
+
+
+@sorcerun.command()
+@click.argument("grid_id", type=str)
+@click.option("--metric", "-m", required=True, help="Metric to rank runs by")
+@click.option(
+    "--stat",
+    "-s",
+    default="last",
+    type=click.Choice(SUMMARY_STATS),
+    help="Summary statistic of the metric to rank by",
+)
+@click.option("--by", default=None, help="Only show the best run per value of this key")
+@click.option("--top", "-k", default=10, help="Number of runs to show")
+@click.option("--maximize", is_flag=True, help="Higher is better")
+@click.option(
+    "--file_root",
+    "-f",
+    default=FILE_STORAGE_ROOT,
+    type=click.Path(file_okay=False),
+    help="Root directory for file storage",
+)
+def best(grid_id, metric, stat, by, top, maximize, file_root):
+    """Show the best runs of a grid from its summary table."""
+    path = summary_file(resolve_file_storage_root(file_root), grid_id)
+    if not os.path.exists(path):
+        raise click.ClickException(f"No summary table for grid {grid_id} at {path}")
+
+    rows = load_summaries(path)
+    top_rows = best_runs(rows, metric, stat=stat, top=top, by=by, maximize=maximize)
+    if len(top_rows) == 0:
+        raise click.ClickException(f"No runs of grid {grid_id} logged {metric}")
+    click.echo(f"{len(rows)} runs in {path}")
+    click.echo(best_table(top_rows, metric, stat=stat, by=by))
+
+
+@sorcerun.command()
+@click.argument("grid_id", type=str)
+@click.option(
+    "--file_root",
+    "-f",
+    default=FILE_STORAGE_ROOT,
+    type=click.Path(file_okay=False),
+    help="Root directory for file storage",
+)
+def status(grid_id, file_root):
+    """Show the live stats of a running (or finished) grid."""
+    path = os.path.join(
+        resolve_file_storage_root(file_root), GRID_OUTPUTS, grid_id, STATS_FILE
+    )
+    if not os.path.exists(path):
+        raise click.ClickException(f"No stats for grid {grid_id} at {path}")
+    with open(path) as f:
+        samples = parse_openmetrics(f.read())
+    click.echo("\n".join(status_lines(samples)))
+
+
+@sorcerun.command()
+@click.argument("grid_id", type=str)
+@click.option("--by", "-b", default=None, help="Show phases per value of this key")
+@click.option(
+    "--file_root",
+    "-f",
+    default=FILE_STORAGE_ROOT,
+    type=click.Path(file_okay=False),
+    help="Root directory for file storage",
+)
+def phases(grid_id, by, file_root):
+    """Show the time runs of a grid spend in their _run.timer phases."""
+    path = summary_file(resolve_file_storage_root(file_root), grid_id)
+    if not os.path.exists(path):
+        raise click.ClickException(f"No summary table for grid {grid_id} at {path}")
+
+    rows = load_summaries(path)
+    table = phase_table(rows, by=by)
+    if len(table.rows) == 0:
+        raise click.ClickException(f"No runs of grid {grid_id} timed phases")
+    click.echo(f"{len(rows)} runs in {path}")
+    click.echo(table)
+
+
+@sorcerun.command()
+@click.option(
+    "--out",
+    "-o",
+    default=BENCH_OVERHEAD_FILE,
+    type=click.Path(dir_okay=False),
+    help="JSON file to write the results to",
+)
+@click.option(
+    "--only",
+    multiple=True,
+    type=click.Choice(BENCHMARKS),
+    help="Only run this benchmark (can be given several times)",
+)
+@click.option("--quick", is_flag=True, help="Fewer repeats and smaller sizes")
+@click.option(
+    "--workers",
+    default="1,2,4",
+    help="Comma separated worker counts for grid_throughput",
+)
+@click.option("--auth_path", default=AUTH_FILE, help="Path to sorcerun_auth.json file.")
+@click.option(
+    "--compare",
+    default=None,
+    type=click.Path(exists=True, dir_okay=False),
+    help="Results file of an earlier version to compare against",
+)
+def bench_overhead(out, only, quick, workers, auth_path, compare):
+    """Benchmark the time sorcerun itself adds to runs, grids and loading
+    results, with synthetic adapters. Mongo cases run only if the server in
+    the auth file answers."""
+    workers = [int(n) for n in workers.split(",")]
+    results = run_benchmarks(
+        only=list(only), quick=quick, auth_path=auth_path, workers=workers
+    )
+    with open(out, "w") as f:
+        json.dump(results, f, indent=2)
+
+    click.echo(results_table(results["rows"]))
+    click.echo(f"Results saved to {out}")
+    if compare is not None:
+        with open(compare) as f:
+            baseline = json.load(f)
+        table, regressions = compare_results(results["rows"], baseline["rows"])
+        env = baseline["environment"]
+        click.echo(
+            f"Compared to {compare} (sorcerun {env['sorcerun_version']},"
+            f" commit {(env['git_commit'] or '-')[:8]}):"
+        )
+        click.echo(table)
+        click.echo(f"{regressions} benchmarks more than 10% slower")
+
+
+@sorcerun.command()
+@click.argument("python_file", type=click.Path(exists=True, dir_okay=False))
+@click.argument("config_file", type=click.Path(exists=True, dir_okay=False))
+@click.option(
+    "--warmup",
+    "-w",
+    default=BENCH_WARMUP,
+    help="Untimed calls before the timed ones, the first one logs to the run",
+)
+@click.option("--repeats", "-n", default=BENCH_REPEATS, help="Timed calls")
+@click.option(
+    "--with_logging",
+    "-l",
+    is_flag=True,
+    help="Timed calls log to the run too. Without it they log to a stand-in"
+    " that drops everything, so log_scalar, log_array and timer are not timed."
+    " Runs with and without it are never compared",
+)
+@click.option(
+    "--baseline",
+    "-b",
+    default=None,
+    help="Git revision (or commit hash prefix) whose benchmark runs to compare against",
+)
+@click.option("--confidence", default=0.95, help="Level of the confidence intervals")
+@click.option(
+    "--fail_on_regression",
+    is_flag=True,
+    help="Exit with an error if significantly slower than the baseline",
+)
+@click.option(
+    "--file_root",
+    "-f",
+    default=FILE_STORAGE_ROOT,
+    type=click.Path(file_okay=False),
+    help="Root directory for file storage",
+)
+@click.option("--auth_path", default=AUTH_FILE, help="Path to sorcerun_auth.json file.")
+@click.option(
+    "--mongo",
+    "-m",
+    is_flag=True,
+    help="Use MongoDB for storage",
+)
+@click.option(
+    "--lite",
+    is_flag=True,
+    help="Run without sacred (file storage only, no mongo)",
+)
+def bench(
+    python_file,
+    config_file,
+    warmup,
+    repeats,
+    with_logging,
+    baseline,
+    confidence,
+    fail_on_regression,
+    file_root,
+    auth_path,
+    mongo,
+    lite,
+):
+    """Time repeated calls of an adapter on a config and compare them against
+    the benchmark runs of a baseline commit."""
+    sorcerun_bench(
+        python_file,
+        config_file,
+        warmup=warmup,
+        repeats=repeats,
+        with_logging=with_logging,
+        baseline=baseline,
+        confidence=confidence,
+        fail_on_regression=fail_on_regression,
+        file_root=file_root,
+        auth_path=auth_path,
+        mongo=mongo,
+        lite=lite,
+    )
+
+
+def sorcerun_bench(
+    python_file,
+    config_file,
+    warmup=BENCH_WARMUP,
+    repeats=BENCH_REPEATS,
+    with_logging=False,
+    baseline=None,
+    confidence=0.95,
+    fail_on_regression=False,
+    file_root=FILE_STORAGE_ROOT,
+    auth_path=AUTH_FILE,
+    mongo=False,
+    lite=False,
+):
+    """Benchmark the adapter in *python_file* in one run (see bench_utils),
+    print its times and, with *baseline*, the speedup over the runs of the
+    same benchmark at that commit. Returns the run."""
+    if repeats < 2:
+        raise click.ClickException("Benchmarks need at least 2 timed calls")
+    adapter_module = load_python_module(python_file, force_reload=True)
+    if not hasattr(adapter_module, "adapter"):
+        raise KeyError(
+            f"Adapter file at {python_file} does not have an attribute named adapter"
+        )
+    config = bench_config(
+        python_file, load_config(config_file), warmup, repeats, with_logging
+    )
+    commit = config[BENCH_KEY]["commit"]
+
+    # profiling would distort the times
+    r = experiment_runner(lite)(
+        bench_adapter(adapter_module.adapter, warmup, repeats, with_logging),
+        config,
+        auth_path,
+        use_mongo=mongo,
+        file_storage_root=file_root,
+        profile=False,
+    )
+    seconds = r.info[BENCH_KEY]["seconds"]
+    rows = [("this run", commit, 1, len(seconds), bench_stats(seconds, confidence))]
+    if config[BENCH_KEY]["dirty"]:
+        click.echo(f"WARNING: {commit} has uncommitted changes")
+
+    if baseline is not None:
+        baseline_commit = resolve_commit(python_file, baseline)
+        runs_dir = os.path.join(resolve_file_storage_root(file_root), RUNS_DIR)
+        runs = bench_runs(runs_dir, config, baseline_commit, exclude=r._id)
+        baseline_seconds = run_seconds(runs)
+        if len(baseline_seconds) < 2:
+            raise click.ClickException(
+                f"No benchmark runs of {python_file} with this config at"
+                f" {baseline} in {runs_dir}, run sorcerun bench at {baseline} first"
+            )
+        rows.append(
+            (
+                "baseline",
+                baseline_commit,
+                len(runs),
+                len(baseline_seconds),
+                bench_stats(baseline_seconds, confidence),
+            )
+        )
+        if any(e.config[BENCH_KEY]["dirty"] for e in runs):
+            click.echo("WARNING: Some baseline runs had uncommitted changes")
+
+    click.echo(f"Benchmark run {r._id}, {warmup} warmup and {repeats} timed calls:")
+    click.echo(bench_table(rows, confidence))
+    if baseline is not None:
+        ratio, low, high = speedup(baseline_seconds, seconds, confidence)
+        result = verdict(low, high)
+        click.echo(
+            f"Speedup over {baseline}: {ratio:.3f}x"
+            f" ({100 * confidence:g}% CI [{low:.3f}, {high:.3f}]), {result}"
+        )
+        if fail_on_regression and result == "slower":
+            raise click.ClickException(f"Slower than {baseline}")
+    return r
+
+
+@sorcerun.command()
+@click.argument("grid_id", type=str)
+@click.option(
+    "--file_root",
+    "-f",
+    default=FILE_STORAGE_ROOT,
+    type=click.Path(file_okay=False),
+    help="Root directory for file storage",
+)
+@click.option("--keep", is_flag=True, help="Keep the run directories after packing")
+@click.option(
+    "--prune",
+    is_flag=True,
+    help="Also remove temp_configs, orphaned or stale runs of the grid and empty run directories",
+)
+@click.option(
+    "--stale_hours",
+    default=24.0,
+    help="Runs without a heartbeat for this long are pruned",
+)
+def compact(grid_id, file_root, keep, prune, stale_hours):
+    """Pack the finished runs of a grid into one sqlite archive."""
+    file_root = resolve_file_storage_root(file_root)
+    runs_dir = os.path.join(file_root, RUNS_DIR)
+    if prune:
+        for path in prune_grid(file_root, runs_dir, grid_id, stale_hours=stale_hours):
+            click.echo(f"Removed {path}")
+
+    n = compact_grid(runs_dir, grid_id, keep=keep)
+    click.echo(
+        f"Packed {n} runs of grid {grid_id} into {archive_path(runs_dir, grid_id)}"
+    )
+
+
+@sorcerun.command()
+@click.argument("grid_id", type=str)
+@click.option(
+    "--file_root",
+    "-f",
+    default=FILE_STORAGE_ROOT,
+    type=click.Path(file_okay=False),
+    help="Root directory for file storage",
+)
+@click.option(
+    "--completed_only",
+    "-c",
+    is_flag=True,
+    help="Don't wait for slurm jobs, only process runs that have completed",
+)
+def grid_to_csv(grid_id, file_root, completed_only=False):
+    save_dir = f"{file_root}/{GRID_OUTPUTS}/{grid_id}"
+    # check if there is slurm_job_ids.txt in the grid_id directory
+    job_ids_file = os.path.join(save_dir, "slurm_job_ids.txt")
+    if os.path.exists(job_ids_file) and not completed_only:
+        click.echo(f"Slurm job ids found for grid with grid_id {grid_id}.")
+        with open(job_ids_file, "r") as file:
+            job_ids = file.read().strip().splitlines()
+            jobs = [Job(int(job_id)) for job_id in job_ids]
+            unfinished = poll_jobs(jobs)
+
+        # once all jobs have finished, slurm_job_ids.txt is not needed anymore
+        if unfinished:
+            click.echo(f"Keeping {job_ids_file}, some jobs did not finish")
+        else:
+            click.echo(f"Removing {job_ids_file}")
+            os.remove(job_ids_file)
+
+    click.echo(f"Processing and saving grid with grid_id {grid_id} to csv")
+    process_and_save_grid_to_csv(
+        grid_id,
+        file_root=file_root,
+        statuses=["COMPLETED"] if completed_only else None,
+    )
+
+
+@sorcerun.command()
+@click.argument(
+    "python_file",
+    type=click.Path(exists=True, dir_okay=False),
+)
+@click.argument(
+    "grid_config_file",
+    type=click.Path(exists=True, dir_okay=False),
+)
+@click.option(
+    "--file_root",
+    "-f",
+    default=FILE_STORAGE_ROOT,
+    type=click.Path(file_okay=False),
+    help="Root directory for file storage",
+)
+@click.option(
+    "--auth_path",
+    default=AUTH_FILE,
+    help="Path to sorcerun_auth.json file.",
+)
+@click.option(
+    "--mongo",
+    "-m",
+    is_flag=True,
+    help="Use MongoObserver",
+)
+@click.option(
+    "--queue_dir",
+    "-q",
+    default=None,
+    type=click.Path(file_okay=False),
+    help="Queue directory (defaults to the grid output dir of the grid_id)",
+)
+@click.option(
+    "--lite",
+    is_flag=True,
+    help="Run with a lightweight sorcerun run object instead of a sacred experiment (no mongo)",
+)
+def grid_enqueue(
+    python_file,
+    grid_config_file,
+    file_root,
+    auth_path,
+    mongo=False,
+    queue_dir=None,
+    lite=False,
+):
+    """Write the configs of a grid to a queue that `sorcerun worker` drains."""
+    configs = load_grid_configs(grid_config_file)
+    click.echo(f"Config grid contains {len(configs)} combinations")
+
+    file_root = resolve_file_storage_root(file_root)
+    if queue_dir is None:
+        gid = configs[0].get("grid_id", None)
+        if gid is None or not all(c.get("grid_id", None) == gid for c in configs):
+            raise click.UsageError(
+                "Configs do not share a grid_id, pass --queue_dir explicitly"
+            )
+        queue_dir = os.path.join(file_root, GRID_OUTPUTS, gid, QUEUE_DIR)
+
+    meta = {
+        "python_file": os.path.abspath(python_file),
+        "file_root": file_root,
+        "auth_path": os.path.abspath(auth_path),
+        "mongo": mongo,
+        "lite": lite,
+    }
+    queue = WorkQueue.create(queue_dir, configs, meta)
+    click.echo(f"Queued {len(configs)} configs in {queue.queue_dir}")
+    click.echo(f"Start workers on any machine with: sorcerun worker {queue.queue_dir}")
+
+
+@sorcerun.command()
+@click.argument("queue_dir", type=click.Path(exists=True, file_okay=False))
+@click.option(
+    "--n-workers",
+    "-n",
+    default=1,
+    show_default=True,
+    help="Processes to use on this machine",
+)
+@click.option(
+    "--heartbeat",
+    default=30.0,
+    show_default=True,
+    help="Seconds between heartbeats on a claimed config",
+)
+@click.option(
+    "--stale_timeout",
+    default=300.0,
+    show_default=True,
+    help="Reclaim configs whose worker has not sent a heartbeat for this many seconds",
+)
+@click.option(
+    "--not_quiet",
+    "-nq",
+    is_flag=True,
+    help="Show output from worker processes",
+)
+@click.option(
+    "--scratch",
+    is_flag=True,
+    help="Stage run directories on node-local scratch ($TMPDIR) and move them to file_root at the end",
+)
+def worker(
+    queue_dir,
+    n_workers=1,
+    heartbeat=30.0,
+    stale_timeout=300.0,
+    not_quiet=False,
+    scratch=False,
+):
+    """Claim and run configs from a queue made by `sorcerun grid_enqueue`."""
+    sorcerun_worker(
+        queue_dir,
+        n_workers=n_workers,
+        heartbeat=heartbeat,
+        stale_timeout=stale_timeout,
+        quiet=not not_quiet,
+        scratch=scratch,
+    )
+
+
+def _drain_queue(queue_dir, heartbeat, stale_timeout, quiet=True, runs_dir=None):
+    """Claim and run configs from the queue until it has no pending configs.
+    Returns the number of configs that were run."""
+    queue = WorkQueue(queue_dir)
+    meta = queue.meta
+    adapter_module = load_python_module(meta["python_file"], force_reload=True)
+    runner = partial(
+        _run_single_config,
+        python_file=meta["python_file"],
+        auth_path=meta["auth_path"],
+        file_root=meta["file_root"],
+        mongo=meta["mongo"],
+        pre_grid_hook=getattr(adapter_module, "pre_grid_hook", None),
+        post_grid_hook=getattr(adapter_module, "post_grid_hook", None),
+        quiet=quiet,
+        runs_dir=runs_dir,
+        lite=meta.get("lite", False),
+    )
+
+    n_run = 0
+    while True:
+        reclaimed = queue.reclaim_stale(stale_timeout)
+        if reclaimed:
+            print(f"Reclaimed {len(reclaimed)} configs from dead workers")
+
+        claim = queue.claim()
+        if claim is None:
+            return n_run
+
+        print(f"Running {claim.name}")
+        with Heartbeat(claim, heartbeat):
+            try:
+                runner((n_run, claim.config))
+                finished = queue.complete(claim)
+            except Exception:
+                traceback.print_exc()
+                finished = queue.fail(claim, traceback.format_exc())
+        if not finished:
+            print(f"WARNING: lost claim on {claim.name}, it will run again")
+        n_run += 1
+
+
+def sorcerun_worker(
+    queue_dir,
+    *,
+    n_workers=1,
+    heartbeat=30.0,
+    stale_timeout=300.0,
+    quiet=True,
+    scratch=False,
+):
+    queue = WorkQueue(queue_dir)
+    with scratch_stager(queue.meta["file_root"], scratch) as stager:
+        drain = partial(
+            _drain_queue,
+            queue_dir,
+            heartbeat,
+            stale_timeout,
+            quiet=quiet,
+            runs_dir=stager and stager.scratch_runs_dir,
+        )
+        if n_workers > 1:
+            with ProcessPoolExecutor(max_workers=n_workers) as pool:
+                futures = [pool.submit(drain) for _ in range(n_workers)]
+                n_run = sum(fut.result() for fut in futures)
+        else:
+            n_run = drain()
+
+    counts = queue.counts()
+    click.echo(f"Ran {n_run} configs on this machine. Queue status:")
+    t = PrettyTable(["State", "Count"])
+    for state, count in counts.items():
+        t.add_row([state, count])
+    t.align = "l"
+    click.echo(t)
+
+
+@sorcerun.command()
+@click.argument("run_dirs", nargs=-1, type=click.Path(exists=True, file_okay=False))
+@click.option("--grid_id", "-g", default=None, help="Render all runs of this grid")
+@click.option(
+    "--file_root",
+    "-f",
+    default=FILE_STORAGE_ROOT,
+    type=click.Path(file_okay=False),
+    help="Root directory for file storage",
+)
+@click.option("--force", is_flag=True, help="Render runs that have a flamegraph too")
+@click.option("--n_workers", "-j", default=cpu_count(), help="Parallel renders")
+def flamegraph(run_dirs, grid_id, file_root, force, n_workers):
+    """Render profile.svg of runs from their profile."""
+    run_dirs = list(run_dirs)
+    if grid_id is not None:
+        runs_dir = os.path.join(resolve_file_storage_root(file_root), RUNS_DIR)
+        run_dirs += [str(d) for d, _, _ in grid_run_dirs(runs_dir, grid_id)]
+    if not force:
+        run_dirs = [
+            d for d in run_dirs if not os.path.exists(os.path.join(d, FLAMEGRAPH_FILE))
+        ]
+    run_dirs = [d for d in run_dirs if flamegraph_command(d) is not None]
+
+    with ThreadPoolExecutor(max_workers=n_workers) as pool:
+        list(tqdm(pool.map(render_flamegraph, run_dirs), total=len(run_dirs)))
+    click.echo(f"Rendered {len(run_dirs)} flamegraphs")
+
+
+@sorcerun.command()
+@click.argument("grid_id", type=str)
+@click.option(
+    "--by",
+    "-b",
+    multiple=True,
+    help="Merge separately per value of this config key (repeatable)",
+)
+@click.option(
+    "--scale",
+    "-s",
+    default=None,
+    help="Config key to fit the scaling exponent of every function against",
+)
+@click.option("--top", "-k", default=20, help="Number of functions to show")
+@click.option(
+    "--sort",
+    default="cumtime",
+    type=click.Choice(["cumtime", "tottime"]),
+    help="Rank functions by total or self time",
+)
+@click.option("--no_flamegraph", is_flag=True, help="Don't render flamegraphs")
+@click.option("--n_workers", "-j", default=cpu_count(), help="Parallel workers")
+@click.option(
+    "--file_root",
+    "-f",
+    default=FILE_STORAGE_ROOT,
+    type=click.Path(file_okay=False),
+    help="Root directory for file storage",
+)
+def grid_profile(grid_id, by, scale, top, sort, no_flamegraph, n_workers, file_root):
+    """Merge the profiles of a grid into flamegraphs and a hotspot table."""
+    file_root = resolve_file_storage_root(file_root)
+    tables = sorcerun_grid_profile(
+        file_root,
+        os.path.join(file_root, RUNS_DIR),
+        grid_id,
+        by=by,
+        scale=scale,
+        top=top,
+        sort=sort,
+        n_workers=n_workers,
+        flamegraphs=not no_flamegraph,
+    )
+    if not tables:
+        raise click.ClickException(f"No profiles found for grid {grid_id}")
+    for name, table in tables.items():
+        click.echo(f"----- {name} -----")
+        click.echo(table)
+    click.echo(f"Saved to {file_root}/{GRID_OUTPUTS}/{grid_id}/{GRID_PROFILE_DIR}")
+
+
+@sorcerun.command()
+@click.argument("grid_id", type=str)
+@click.option(
+    "--by",
+    "-b",
+    multiple=True,
+    help="Summarize separately per value of this config key (repeatable)",
+)
+@click.option(
+    "--scale",
+    "-s",
+    default=None,
+    help="Config key to show and fit the peak memory against",
+)
+@click.option("--top", "-k", default=20, help="Number of allocation sites to show")
+@click.option(
+    "--file_root",
+    "-f",
+    default=FILE_STORAGE_ROOT,
+    type=click.Path(file_okay=False),
+    help="Root directory for file storage",
+)
+def grid_memprofile(grid_id, by, scale, top, file_root):
+    """Show how peak allocations of a grid's --memprofile runs scale."""
+    file_root = resolve_file_storage_root(file_root)
+    tables = sorcerun_grid_memprofile(
+        file_root,
+        os.path.join(file_root, RUNS_DIR),
+        grid_id,
+        by=by,
+        scale=scale,
+        top=top,
+    )
+    if not tables:
+        raise click.ClickException(f"No memory profiles found for grid {grid_id}")
+    for name, (peaks, sites) in tables.items():
+        click.echo(f"----- {name} -----")
+        click.echo(peaks)
+        click.echo(sites)
+    click.echo(f"Saved to {file_root}/{GRID_OUTPUTS}/{grid_id}/{GRID_MEMPROFILE_DIR}")
+
+
+@sorcerun.command(name="recover-scratch")
+@click.argument("scratch_root", required=False, type=click.Path(file_okay=False))
+def recover_scratch_cmd(scratch_root=None):
+    """Move runs left on node-local scratch by killed jobs to their runs dir."""
+    n = recover_scratch(scratch_root)
+    click.echo(f"Recovered {n} runs")
+
+
+@sorcerun.group()
+def mongo():
     pass
 
 
@@ -716,6 +1920,27 @@ def start():
             time.sleep(10)
 
 
+@mongo.command()
+@click.option(
+    "--file_root",
+    "-f",
+    default=FILE_STORAGE_ROOT,
+    type=click.Path(file_okay=False),
+    help="Root directory for file storage",
+)
+@click.option("--auth_path", default=AUTH_FILE, help="Path to sorcerun_auth.json file.")
+def replay(file_root, auth_path):
+    """Write mongo updates that were journaled while mongo was unreachable."""
+    with open(auth_path, "r") as f:
+        auth_data = json.load(f)
+    client = get_mongo_client(mongo_url_from_auth(auth_data))
+    db = client[auth_data["db_name"]]
+
+    journal_dir = os.path.join(resolve_file_storage_root(file_root), MONGO_JOURNAL_DIR)
+    n = replay_journals(journal_dir, db["runs"], db["metrics"])
+    click.echo(f"Replayed {n} journals from {journal_dir}")
+
+
 @sorcerun.command()
 def omniboard():
     """
@@ -12,3 +12,59 @@ TEMPLATE_FILES = [
     "plot.py"
 ]
 TIME_FORMAT = "%Y-%m-%d-%H-%M-%S"
+SACCT_COMMAND = "sacct"
+SACCT_CHUNK_SIZE = 500
+SLURM_DEPENDENCY_CHUNK = 100
+SCRATCH_PREFIX = "sorcerun-scratch-"
+QUEUE_DIR = "queue"
+QUEUE_META_FILE = "queue_meta.json"
+MONGO_JOURNAL_DIR = "mongo_journal"
+MONGO_FLUSH_INTERVAL = 5.0
+MONGO_MAX_BATCH = 1000
+MONGO_JOURNAL_STALE = 600.0
+MONGO_SERVER_TIMEOUT_MS = 10000
+MONGO_RETRY_AFTER = 300.0
+METRICS_LOG_DIR = "metrics"
+METRICS_LOG_SUFFIX = ".bin"
+METRIC_POLICIES = "metric_policies"
+SUMMARY_FILE = "summaries.jsonl"
+RUN_SHARD_PREFIX_LEN = 2
+HASH_SHARD_PREFIX = "h"
+GRID_SHARD_PREFIX = "grid-"
+ARCHIVES_DIR = "_archives"
+MAX_RUN_ID_FILE = "max_run_id"
+RUN_ID_COUNTER_FILE = ".next_run_id"
+RUN_ID_BLOCK = 64
+BLOBS_DIR = "blobs"
+BLOB_HASH_CHUNK = 1 << 20
+COUT_FILE = "cout.txt"
+COUT_GZ_FILE = "cout.txt.gz"
+CAPTURE_LIMIT = 1 << 20
+CAPTURE_COMPRESS_MIN = 1 << 16
+MONGO_COUT_LIMIT = 1 << 20
+PROFILE_FILE = "profile.prof"
+PROFILE_FOLDED_FILE = "profile.folded"
+FLAMEGRAPH_FILE = "profile.svg"
+PROFILE_SAMPLE_RATE = 100
+FLAMEGRAPH_BACKGROUND_MAX = 2
+RESOURCE_SAMPLE_INTERVAL = 0.5
+RESOURCE_METRIC_PREFIX = "resources."
+MEMPROFILE_FILE = "memprofile.json"
+MEMPROFILE_TOP_FILE = "memprofile.txt"
+MEMPROFILE_INTERVAL = 0.1
+MEMPROFILE_FRAMES = 4
+MEMPROFILE_TOP = 20
+TIMER_METRIC_PREFIX = "timer."
+TRACE_DIR = "trace"
+TRACE_FILE = "trace.json"
+TRACE_SUMMARY_FILE = "trace_summary.txt"
+STATS_FILE = "stats.prom"
+STATS_INTERVAL = 5
+STATS_POLL = 0.5
+STATS_RECENT = 100
+BENCH_OVERHEAD_FILE = "bench_overhead.json"
+BENCH_KEY = "bench"
+BENCH_METRIC_PREFIX = "bench."
+BENCH_WARMUP = 1
+BENCH_REPEATS = 10
+BENCH_BOOTSTRAP = 2000
@@ -0,0 +1,282 @@
+from .globals import GRID_OUTPUTS, PROFILE_FILE, PROFILE_FOLDED_FILE
+from .archive_utils import grid_run_dirs, iter_archives
+from .incense_utils import squish_dict
+from .profile_utils import render_flamegraph
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from collections import Counter, defaultdict
+from prettytable import PrettyTable
+import numpy as np
+import tempfile
+import pstats
+import shutil
+import os
+
+# profiles merged by one worker task
+MERGE_CHUNK = 64
+
+GRID_PROFILE_DIR = "profile"
+
+
+def func_label(func):
+    # same format as the frames of profile.folded
+    filename, line, name = func
+    return f"{name} ({os.path.basename(filename)}:{line})"
+
+
+def group_name(key, by):
+    if not by:
+        return "all"
+    name = ",".join(f"{k}={v}" for k, v in zip(by, key))
+    return name.replace(os.sep, "_")
+
+
+def _hashable(v):
+    return tuple(v) if type(v) == list else v
+
+
+def grid_profile_sources(runs_dir, grid_id, by=(), scale=None):
+    """{(group key, scale value): {"prof": [...], "folded": [...]}} of the
+    profiles of a grid's runs, in run directories or archives. A source is a
+    path, or (archive path, run id, file name) for archived runs."""
+    sources = defaultdict(lambda: {"prof": [], "folded": []})
+
+    def add(config, files):
+        config = squish_dict(dict(config))
+        key = tuple(_hashable(config.get(k)) for k in by)
+        value = _hashable(config.get(scale)) if scale is not None else None
+        for kind, source in files:
+            sources[(key, value)][kind].append(source)
+
+    for run_dir, _, config in grid_run_dirs(runs_dir, grid_id):
+        if config is None:
+            continue
+        files = []
+        if os.path.exists(run_dir / PROFILE_FILE):
+            files.append(("prof", str(run_dir / PROFILE_FILE)))
+        elif os.path.exists(run_dir / PROFILE_FOLDED_FILE):
+            files.append(("folded", str(run_dir / PROFILE_FOLDED_FILE)))
+        add(config, files)
+
+    for archive in iter_archives(runs_dir, grid_id):
+        for run_id, (config, _) in archive.configs().items():
+            names = archive.file_names(run_id)
+            for kind, name in [("prof", PROFILE_FILE), ("folded", PROFILE_FOLDED_FILE)]:
+                if name in names:
+                    add(config, [(kind, (archive.path, run_id, name))])
+                    break
+        archive.close()
+    return dict(sources)
+
+
+def _read_source(source):
+    if isinstance(source, str):
+        with open(source, "rb") as f:
+            return f.read()
+    from .archive_utils import RunArchive
+
+    archive_path, run_id, name = source
+    with RunArchive(archive_path) as archive:
+        return archive.read_file(run_id, name)
+
+
+def _merge_chunk(kind, chunk, parts_dir):
+    """Merge a chunk of profiles in a worker. Returns the path of the merged
+    pstats, or the summed folded stack counts."""
+    if kind == "folded":
+        counts = Counter()
+        for source in chunk:
+            for line in _read_source(source).decode().splitlines():
+                stack, _, count = line.rpartition(" ")
+                if stack:
+                    counts[stack] += float(count)
+        return counts
+
+    paths = []
+    with tempfile.TemporaryDirectory(dir=parts_dir) as tmp:
+        for i, source in enumerate(chunk):
+            if isinstance(source, str):
+                paths.append(source)
+            else:
+                paths.append(os.path.join(tmp, f"{i}.prof"))
+                with open(paths[-1], "wb") as f:
+                    f.write(_read_source(source))
+        stats = pstats.Stats(*paths)
+    fd, path = tempfile.mkstemp(dir=parts_dir, suffix=".prof")
+    os.close(fd)
+    stats.dump_stats(path)
+    return path
+
+
+def merge_grid_profiles(sources, out_dir, n_workers=None):
+    """Merge the profiles of *sources* (see grid_profile_sources) in
+    parallel. Returns {(group key, scale value): (runs, pstats or None,
+    folded Counter)}."""
+    parts_dir = os.path.join(out_dir, ".parts")
+    os.makedirs(parts_dir, exist_ok=True)
+    tasks = []
+    for gv, kinds in sources.items():
+        for kind, srcs in kinds.items():
+            for i in range(0, len(srcs), MERGE_CHUNK):
+                tasks.append((gv, kind, srcs[i : i + MERGE_CHUNK]))
+
+    merged = {
+        gv: (len(kinds["prof"]) + len(kinds["folded"]), None, Counter())
+        for gv, kinds in sources.items()
+    }
+    try:
+        with ProcessPoolExecutor(max_workers=n_workers) as pool:
+            futures = [
+                (gv, kind, pool.submit(_merge_chunk, kind, chunk, parts_dir))
+                for gv, kind, chunk in tasks
+            ]
+            for gv, kind, future in futures:
+                runs, stats, folded = merged[gv]
+                part = future.result()
+                if kind == "folded":
+                    folded.update(part)
+                elif stats is None:
+                    stats = pstats.Stats(part)
+                else:
+                    stats.add(part)
+                merged[gv] = (runs, stats, folded)
+    finally:
+        shutil.rmtree(parts_dir, ignore_errors=True)
+    return merged
+
+
+def function_times(stats, folded):
+    """{function: [calls, self time, total time]} of merged profiles. Sampled
+    profiles count samples instead of seconds (and no calls), don't mix them
+    with cProfile runs in one group."""
+    times = defaultdict(lambda: [0, 0.0, 0.0])
+    if stats is not None:
+        for func, (cc, nc, tt, ct, callers) in stats.stats.items():
+            t = times[func_label(func)]
+            t[0] += nc
+            t[1] += tt
+            t[2] += ct
+    for stack, count in folded.items():
+        frames = stack.split(";")
+        times[frames[-1]][1] += count
+        # count recursive frames once per stack
+        for frame in set(frames):
+            times[frame][2] += count
+    return dict(times)
+
+
+def scaling_exponent(values, times):
+    """Slope of log(time) against log(value), or None."""
+    pairs = [
+        (float(v), t)
+        for v, t in zip(values, times)
+        if isinstance(v, (int, float)) and v > 0 and t > 0
+    ]
+    if len(set(v for v, _ in pairs)) < 2:
+        return None
+    x, y = np.log([p[0] for p in pairs]), np.log([p[1] for p in pairs])
+    return float(np.polyfit(x, y, 1)[0])
+
+
+def hotspot_table(merged_by_value, top=20, sort="cumtime", scale=None):
+    """Table of the *top* functions of a group. *merged_by_value* maps the
+    values of the *scale* key to (runs, pstats, folded)."""
+    per_value = {
+        value: (runs, function_times(stats, folded))
+        for value, (runs, stats, folded) in merged_by_value.items()
+    }
+    total = defaultdict(lambda: [0, 0.0, 0.0])
+    for runs, times in per_value.values():
+        for label, t in times.items():
+            for i in range(3):
+                total[label][i] += t[i]
+
+    col = 2 if sort == "cumtime" else 1
+    grand_total = sum(t[1] for t in total.values())
+    labels = sorted(total, key=lambda k: -total[k][col])[:top]
+
+    columns = ["function", "ncalls", "tottime", "cumtime", "% self"]
+    values = sorted(v for v in per_value if isinstance(v, (int, float)))
+    if scale is not None:
+        columns += [f"exponent in {scale}"]
+        if values:
+            columns += [f"cumtime/run @{scale}={values[0]}"]
+            columns += [f"cumtime/run @{scale}={values[-1]}"]
+    t = PrettyTable(columns)
+    for label in labels:
+        ncalls, tottime, cumtime = total[label]
+        row = [
+            label,
+            ncalls,
+            round(tottime, 4),
+            round(cumtime, 4),
+            round(100 * tottime / grand_total, 1) if grand_total else 0,
+        ]
+        if scale is not None:
+            # mean time per run at every value of the scale key
+            per_run = [
+                per_value[v][1].get(label, [0, 0.0, 0.0])[2] / per_value[v][0]
+                for v in values
+            ]
+            exponent = scaling_exponent(values, per_run)
+            row.append(None if exponent is None else round(exponent, 2))
+            if values:
+                row += [round(per_run[0], 4), round(per_run[-1], 4)]
+        t.add_row(row)
+    t.align = "l"
+    return t
+
+
+def grid_profile(
+    file_root,
+    runs_dir,
+    grid_id,
+    by=(),
+    scale=None,
+    top=20,
+    sort="cumtime",
+    n_workers=None,
+    flamegraphs=True,
+):
+    """Merge the profiles of a grid per group of the config keys *by*, save
+    them with a flamegraph and a table of hotspots to
+    grid_outputs/<grid_id>/profile/<group>/. Returns {group name: table}."""
+    out_dir = os.path.join(file_root, GRID_OUTPUTS, grid_id, GRID_PROFILE_DIR)
+    sources = grid_profile_sources(runs_dir, grid_id, by=by, scale=scale)
+    merged = merge_grid_profiles(sources, out_dir, n_workers=n_workers)
+
+    groups = defaultdict(dict)
+    for (key, value), m in merged.items():
+        groups[key][value] = m
+
+    tables = {}
+    group_dirs = []
+    for key, by_value in sorted(groups.items(), key=lambda g: str(g[0])):
+        name = group_name(key, by)
+        group_dir = os.path.join(out_dir, name)
+        os.makedirs(group_dir, exist_ok=True)
+
+        stats, folded = pstats.Stats(), Counter()
+        for runs, s, f in by_value.values():
+            folded.update(f)
+            if s is not None:
+                stats.add(s)
+        # a stale merge of a previous call would be rendered instead
+        for filename in [PROFILE_FILE, PROFILE_FOLDED_FILE]:
+            if os.path.exists(os.path.join(group_dir, filename)):
+                os.remove(os.path.join(group_dir, filename))
+        if stats.stats:
+            stats.dump_stats(os.path.join(group_dir, PROFILE_FILE))
+        elif folded:
+            with open(os.path.join(group_dir, PROFILE_FOLDED_FILE), "w") as f:
+                for stack, count in sorted(folded.items()):
+                    f.write(f"{stack} {count:g}\n")
+        group_dirs.append(group_dir)
+
+        tables[name] = hotspot_table(by_value, top=top, sort=sort, scale=scale)
+        with open(os.path.join(group_dir, "hotspots.txt"), "w") as f:
+            f.write(str(tables[name]) + "\n")
+
+    if flamegraphs:
+        with ThreadPoolExecutor(max_workers=n_workers) as pool:
+            list(pool.map(render_flamegraph, group_dirs))
+    return tables
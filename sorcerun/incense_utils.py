@@ -1,11 +1,16 @@
 from .globals import GRID_OUTPUTS, RUNS_DIR, FILE_STORAGE_ROOT
+from .metrics_utils import metric_logs_to_series
+from .layout_utils import iter_run_dirs, run_id_of, grid_shard, SPECIAL_DIRS
+from .archive_utils import iter_archives
+from .capture_utils import read_cout
+from .globals import COUT_GZ_FILE
 from pyfzf.pyfzf import FzfPrompt
 from collections import defaultdict
 import incense
 import os
 import json
 from functools import partial
-from pyrsistent import thaw
+from pyrsistent import thaw, freeze
 import matplotlib.pyplot as plt
 import numpy as np
 import xarray as xr
@@ -14,7 +19,7 @@ from pathlib import Path
 from prettytable import PrettyTable
 import pandas as pd
 
-FILESTORAGE_SPECIAL_DIRS = ["_sources", "_resources"]
+FILESTORAGE_SPECIAL_DIRS = SPECIAL_DIRS
 
 
 # %%
@@ -27,17 +32,56 @@ def get_incense_loader(authfile="sorcerun_auth.json"):
     return incense.ExperimentLoader(mongo_uri=mongo_uri, db_name=db_name)
 
 
+def load_filesystem_expt(run_dir, runs_dir=None):
+    """Load a run directory as an incense FileSystemExperiment, including
+    metrics appended to binary segments by MetricsLogFileStorageObserver.
+
+    Unlike FileSystemExperiment.from_run_dir, this also loads runs of the
+    sharded layout, whose id is their path relative to *runs_dir*.
+    """
+    run_dir = Path(run_dir)
+    FSE = incense.experiment.FileSystemExperiment
+    load_json = incense.experiment._load_json_from_path
+
+    run_data = load_json(run_dir / "run.json")
+    run_data["config"] = load_json(run_dir / "config.json")
+    run_data["info"] = load_json(run_dir / "info.json")
+    run_data["captured_out"] = read_cout(run_dir)
+    metrics = FSE._load_metrics(run_dir / "metrics.json")
+    metrics.update(metric_logs_to_series(run_dir))
+    artifacts = FSE._load_artifacts(run_dir)
+    artifacts.pop(COUT_GZ_FILE, None)
+
+    _id = run_id_of(runs_dir or run_dir.parent, run_dir)
+    return FSE(_id, freeze(run_data), artifacts, metrics)
+
+
 def load_filesystem_expts_by_config_keys(
     runs_dir=f"{FILE_STORAGE_ROOT}/{RUNS_DIR}",
+    statuses=None,
     **kwargs,
 ):
     runs_dir = Path(runs_dir)
+    # in the sharded layout, runs of a grid are all in the grid's shard
+    grid_id = kwargs.get("grid_id")
+    shards = [grid_shard(grid_id)] if isinstance(grid_id, str) else None
     configs = {
-        run_dir.name: incense.experiment._load_json_from_path(run_dir / "config.json")
-        for run_dir in runs_dir.iterdir()
-        if run_dir.name not in FILESTORAGE_SPECIAL_DIRS
+        os.path.relpath(run_dir, runs_dir): incense.experiment._load_json_from_path(
+            run_dir / "config.json"
+        )
+        for run_dir in iter_run_dirs(runs_dir, shards=shards)
+        # not the empty directories reserved for runs staged on scratch
+        if (run_dir / "config.json").exists()
     }
 
+    # runs packed by sorcerun compact, loaded straight from their archive
+    archived = {}
+    for archive in iter_archives(runs_dir, kwargs.get("grid_id")):
+        for i, (config, status) in archive.configs().items():
+            if i not in configs:
+                configs[i] = config
+                archived[i] = (archive, status)
+
     # kwargs = {"grid_id": "2024-02-27-19-34-08"}
 
     ids = list(
@@ -51,8 +95,24 @@ def load_filesystem_expts_by_config_keys(
         )
     )
 
+    def status_of(i):
+        if i in archived:
+            return archived[i][1]
+        return incense.experiment._load_json_from_path(runs_dir / i / "run.json").get(
+            "status"
+        )
+
+    # only keep runs with one of the given statuses (e.g. ["COMPLETED"])
+    if statuses is not None:
+        ids = [i for i in ids if status_of(i) in statuses]
+
     expts = [
-        incense.experiment.FileSystemExperiment.from_run_dir(runs_dir / i) for i in ids
+        (
+            archived[i][0].load_expt(i)
+            if i in archived
+            else load_filesystem_expt(runs_dir / i, runs_dir)
+        )
+        for i in ids
     ]
 
     return expts
@@ -443,10 +503,11 @@ def csv_to_xarray(csv_filename, value_column):
 
 
 # %%
-def process_and_save_grid_to_csv(gid, file_root=FILE_STORAGE_ROOT):
+def process_and_save_grid_to_csv(gid, file_root=FILE_STORAGE_ROOT, statuses=None):
     grid_exps = load_filesystem_expts_by_config_keys(
         grid_id=gid,
         runs_dir=os.path.join(file_root, RUNS_DIR),
+        statuses=statuses,
     )
 
     print(f"Found {len(grid_exps)} experiments with grid_id {gid}")
@@ -555,9 +616,9 @@ class ExpsSlicer:
         out = self.fzf.prompt(
             self.dictstrs,
             "--multi"
-            + " --preview 'cat "
+            + " --preview 'zcat -f "
             + f"{self.runs_dir}/"
-            + "{1}/cout.txt'"
+            + "{1}/cout.txt*'"
             + f" --print-query"
             + f" --query \\'{key}:"
             + " --bind enter:select-all+accept",
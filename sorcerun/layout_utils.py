@@ -0,0 +1,101 @@
+from .globals import (
+    RUN_SHARD_PREFIX_LEN,
+    HASH_SHARD_PREFIX,
+    GRID_SHARD_PREFIX,
+    ARCHIVES_DIR,
+    MAX_RUN_ID_FILE,
+)
+from pathlib import Path
+import datetime
+import uuid
+import os
+
+# directories the FileStorageObserver (and sorcerun compact) keep next to the
+# run directories
+SPECIAL_DIRS = ["_sources", "_resources", ARCHIVES_DIR]
+
+# Two layouts of the runs directory are supported:
+#
+#   flat:     runs/<int id>/               (sacred's FileStorageObserver)
+#   sharded:  runs/<shard>/<run name>/
+#
+# In the sharded layout the shard is grid-<grid_id> for runs of a grid, or
+# h<short hash> for runs outside of a grid, so a shard name is never all
+# digits like a flat run id. Run names are unique without looking
+# at the directory, so creating a run does not list the runs directory.
+# Run ids are the paths of run directories relative to the runs directory.
+
+
+def new_run_name():
+    """A unique, time sortable run name, e.g. 20240301-120000-1f2e3d4c5b6a."""
+    return f"{datetime.datetime.utcnow():%Y%m%d-%H%M%S}-{uuid.uuid4().hex[:12]}"
+
+
+def grid_shard(grid_id):
+    """The shard of the runs of *grid_id*."""
+    return f"{GRID_SHARD_PREFIX}{grid_id}"
+
+
+def run_shard(config):
+    """The shard of the run's grid, or a random hash prefix outside of grids."""
+    grid_id = config.get("grid_id")
+    if isinstance(grid_id, str):
+        return grid_shard(grid_id)
+    return HASH_SHARD_PREFIX + uuid.uuid4().hex[:RUN_SHARD_PREFIX_LEN]
+
+
+def make_sharded_run_dir(runs_dir, shard, name=None):
+    """Create a run directory in *shard*, returns its run id."""
+    shard_dir = os.path.join(runs_dir, shard)
+    os.makedirs(shard_dir, exist_ok=True)
+    while True:
+        run_name = name or new_run_name()
+        try:
+            os.mkdir(os.path.join(shard_dir, run_name))
+            return f"{shard}/{run_name}"
+        except FileExistsError:
+            if name is not None:
+                raise
+            continue
+
+
+def is_run_dir(path):
+    path = Path(path)
+    if (path / "run.json").exists() or (path / "config.json").exists():
+        return True
+    # a flat run that is just being created, shards always hold run
+    # directories (and their names are never all digits anyway)
+    return path.name.isdigit() and not any(p.is_dir() for p in path.iterdir())
+
+
+def iter_run_dirs(runs_dir, shards=None):
+    """Yield the run directories under *runs_dir* in either layout.
+
+    If *shards* is given, only those shards (and flat runs) are listed.
+    """
+    runs_dir = Path(runs_dir)
+    for entry in runs_dir.iterdir():
+        if entry.name in SPECIAL_DIRS or not entry.is_dir():
+            continue
+        if is_run_dir(entry):
+            yield entry
+        elif shards is None or entry.name in shards:
+            for run_dir in entry.iterdir():
+                if run_dir.is_dir():
+                    yield run_dir
+
+
+def run_id_of(runs_dir, run_dir):
+    """The run id of *run_dir*, an int in the flat layout."""
+    rel = Path(os.path.relpath(run_dir, runs_dir)).as_posix()
+    return int(rel) if rel.isdigit() else rel
+
+
+def archived_max_run_id(runs_dir):
+    """The largest flat run id packed into an archive by sorcerun compact, so
+    that new flat runs never reuse the id of an archived run."""
+    try:
+        with open(os.path.join(runs_dir, ARCHIVES_DIR, MAX_RUN_ID_FILE), "r") as f:
+            return int(f.read().strip() or 0)
+    except (OSError, ValueError):
+        return 0
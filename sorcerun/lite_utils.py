@@ -0,0 +1,241 @@
+from .globals import (
+    AUTH_FILE,
+    RUNS_DIR,
+    FILE_STORAGE_ROOT,
+    MONGO_FLUSH_INTERVAL,
+    MONGO_MAX_BATCH,
+)
+from .sacred_utils import (
+    resolve_file_storage_root,
+    metric_policies_for,
+    artifact_options_for,
+    capture_options_for,
+    append_grid_summary,
+    call_adapter,
+)
+from .metrics_utils import append_metric_log
+from .run_utils import extend_run
+from .scratch_utils import make_flat_run_dir
+from .layout_utils import make_sharded_run_dir, run_shard
+from .capture_utils import capture_output, compress_cout
+from .trace_utils import trace_span, record_span
+from sacred.metrics_logger import MetricsLogger, linearize_metrics
+from sacred.randomness import get_seed, set_global_seed
+from sacred.serializer import flatten
+from sacred.utils import apply_backspaces_and_linefeeds
+import datetime
+import platform
+import traceback
+import time
+import shutil
+import json
+import os
+
+
+class LiteRunWriter:
+    """Keeps the metrics of a LiteRun and writes its run directory."""
+
+    def __init__(self, run_dir, metrics_log=False):
+        self.dir = run_dir
+        self.metrics_log = metrics_log
+        self.metrics = {}
+
+    def log_metrics(self, metrics_by_name, info):
+        for name, m in metrics_by_name.items():
+            if self.metrics_log:
+                append_metric_log(
+                    self.dir, name, m["steps"], m["values"], m["timestamps"]
+                )
+            else:
+                timestamps = [ts.isoformat() for ts in m["timestamps"]]
+                self._add(name, m["steps"], m["values"], timestamps)
+
+    def log_array_metric(self, name, steps, values, timestamps):
+        if self.metrics_log:
+            append_metric_log(self.dir, name, steps, values, timestamps)
+            return
+        timestamps = [
+            datetime.datetime.utcfromtimestamp(ts).isoformat()
+            for ts in timestamps.tolist()
+        ]
+        self._add(name, steps.tolist(), values.tolist(), timestamps)
+
+    def _add(self, name, steps, values, timestamps):
+        m = self.metrics.setdefault(name, {"steps": [], "values": [], "timestamps": []})
+        m["steps"] += steps
+        m["values"] += values
+        m["timestamps"] += timestamps
+
+    def save_json(self, obj, filename):
+        with open(os.path.join(self.dir, filename), "w") as f:
+            json.dump(flatten(obj), f, sort_keys=True, indent=2)
+
+    def save_file(self, filename, target_name=None):
+        target_name = target_name or os.path.basename(filename)
+        shutil.copyfile(filename, os.path.join(self.dir, target_name))
+
+    def save_metrics(self):
+        # with metrics_log the metrics are already in their segments
+        self.save_json({} if self.metrics_log else self.metrics, "metrics.json")
+
+
+class LiteRun:
+    """A sorcerun-native stand-in for sacred's Run.
+
+    Supports what adapters use (log_scalar, log_array, add_artifact, info)
+    and writes the same files as sacred's FileStorageObserver, but only once
+    when the run ends, without heartbeats, observers or config scopes.
+    """
+
+    def __init__(self, _id, config, run_dir, experiment_name, metrics_log=False):
+        self._id = _id
+        self.config = config
+        self.run_dir = run_dir
+        self.experiment_name = experiment_name
+        self.info = {}
+        self.status = "RUNNING"
+        self.result = None
+        self.start_time = datetime.datetime.utcnow()
+        self.stop_time = None
+        self.fail_trace = None
+        self.artifacts = []
+        self._metrics = MetricsLogger()
+        self._heartbeat = None
+        self.writer = LiteRunWriter(run_dir, metrics_log=metrics_log)
+        self.observers = [self.writer]
+
+    def log_scalar(self, metric_name, value, step=None):
+        self._metrics.log_scalar_metric(metric_name, value, step)
+
+    def add_artifact(self, filename, name=None, metadata=None, content_type=None):
+        name = name or os.path.basename(filename)
+        self.writer.save_file(filename, name)
+        self.artifacts.append(name)
+
+    def _safe_call(self, obj, method, **kwargs):
+        try:
+            getattr(obj, method)(**kwargs)
+        except Exception:
+            traceback.print_exc()
+            print(f"WARNING: {method} failed for run {self._id}")
+
+    def _emit_heartbeat(self):
+        metrics_by_name = linearize_metrics(self._metrics.get_last_metrics())
+        for observer in self.observers:
+            self._safe_call(
+                observer, "log_metrics", metrics_by_name=metrics_by_name, info=self.info
+            )
+
+    def to_dict(self):
+        return {
+            "artifacts": self.artifacts,
+            "command": "run_experiment",
+            "experiment": {"name": self.experiment_name},
+            "heartbeat": (self.stop_time or self.start_time).isoformat(),
+            "host": {
+                "hostname": platform.node(),
+                "python_version": platform.python_version(),
+            },
+            "meta": {"lite": True},
+            "resources": [],
+            "result": self.result,
+            "start_time": self.start_time.isoformat(),
+            "status": self.status,
+            "stop_time": self.stop_time and self.stop_time.isoformat(),
+            **({"fail_trace": self.fail_trace} if self.fail_trace else {}),
+        }
+
+    def save(self, captured_out):
+        self._emit_heartbeat()
+        self.writer.save_metrics()
+        self.writer.save_json(self.info, "info.json")
+        self.writer.save_json(self.to_dict(), "run.json")
+        with open(os.path.join(self.run_dir, "cout.txt"), "w") as f:
+            f.write(apply_backspaces_and_linefeeds(captured_out))
+        compress_cout(self.run_dir)
+
+
+def run_lite_experiment(
+    adapter_func,
+    config,
+    auth_path=AUTH_FILE,
+    use_mongo=False,
+    file_storage_root=FILE_STORAGE_ROOT,
+    profile=True,
+    runs_dir=None,
+    memprofile=False,
+    mongo_flush_interval=MONGO_FLUSH_INTERVAL,
+    mongo_max_batch=MONGO_MAX_BATCH,
+    metrics_log=None,
+    sharded=None,
+):
+    """Run *adapter_func* on *config* with a LiteRun instead of sacred.
+
+    Takes the same arguments as run_sacred_experiment and writes the same
+    run directory layout, but skips sacred's per-run bookkeeping. Runs are
+    only written to the file storage, never to mongo, so *auth_path*,
+    *mongo_flush_interval* and *mongo_max_batch* are unused.
+    """
+    setup_start = time.time()
+    file_storage_root = resolve_file_storage_root(file_storage_root)
+    if use_mongo:
+        print("WARNING: Lite runs are not written to mongo")
+
+    if runs_dir is None:
+        runs_dir = os.path.join(file_storage_root, RUNS_DIR)
+    os.makedirs(runs_dir, exist_ok=True)
+    if metrics_log is None:
+        metrics_log = getattr(adapter_func, "metrics_log", False)
+    if sharded is None:
+        sharded = getattr(adapter_func, "sharded_runs", False)
+
+    config = dict(config)
+    config.setdefault("seed", get_seed())
+    set_global_seed(config["seed"])
+
+    if sharded:
+        _id = make_sharded_run_dir(runs_dir, run_shard(config))
+    else:
+        _id = make_flat_run_dir(runs_dir)
+    run_dir = os.path.join(runs_dir, str(_id))
+    experiment_name = getattr(adapter_func, "experiment_name", "sorcerun_experiment")
+    r = LiteRun(_id, config, run_dir, experiment_name, metrics_log=metrics_log)
+    extend_run(
+        r,
+        metric_policies=metric_policies_for(adapter_func, config),
+        **artifact_options_for(adapter_func, file_storage_root),
+    )
+    r.writer.save_json(config, "config.json")
+    r.writer.save_json(r.to_dict(), "run.json")
+
+    record_span("setup", setup_start)
+
+    captured = lambda: ""
+    run_start = time.time()
+    try:
+        with capture_output(*capture_options_for(adapter_func)) as captured:
+            try:
+                r.result = call_adapter(
+                    adapter_func, config, r, run_dir, profile, memprofile
+                )
+            finally:
+                with trace_span("flush"):
+                    r.wait_artifacts()
+                    r.flush_metrics()
+        r.status = "COMPLETED"
+    except KeyboardInterrupt:
+        r.status = "INTERRUPTED"
+        raise
+    except BaseException:
+        r.status = "FAILED"
+        r.fail_trace = traceback.format_exc().splitlines(keepends=True)
+        raise
+    finally:
+        record_span("run", run_start)
+        finalize_start = time.time()
+        r.stop_time = datetime.datetime.utcnow()
+        r.save(captured())
+
+    append_grid_summary(r, config, file_storage_root)
+    record_span("finalize", finalize_start)
+    return r
@@ -11,7 +11,7 @@ commit_hash = get_commit_hash(repo)
 time_str = get_time_str()
 main_tree_hash = (get_tree_hash(repo, "main"),)
 dirty = is_dirty(repo)
-grid_id = (f"{time_str}--{commit_hash}--dirty={dirty}",)
+grid_id = f"{time_str}--{commit_hash}--dirty={dirty}"
 
 ns = [10, 20, 30]
 
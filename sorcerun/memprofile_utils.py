@@ -0,0 +1,283 @@
+from .globals import (
+    GRID_OUTPUTS,
+    MEMPROFILE_FILE,
+    MEMPROFILE_TOP_FILE,
+    MEMPROFILE_INTERVAL,
+    MEMPROFILE_FRAMES,
+    MEMPROFILE_TOP,
+)
+from .archive_utils import grid_run_dirs, iter_archives
+from .grid_profile_utils import group_name, scaling_exponent, _hashable
+from .incense_utils import squish_dict
+from .summary_utils import value_order
+from collections import defaultdict
+from prettytable import PrettyTable
+import numpy as np
+import tracemalloc
+import threading
+import queue
+import linecache
+import time
+import json
+import os
+
+MB = 1024**2
+
+# a new snapshot is taken once traced memory grew by this factor over the
+# largest snapshot so far, so the top sites are those at (close to) the peak
+SNAPSHOT_GROWTH = 1.1
+
+# seconds between checks for a new high of traced memory
+POLL = 0.01
+
+GRID_MEMPROFILE_DIR = "memprofile"
+
+
+def site_name(traceback):
+    # innermost frame first, like the frames of a flamegraph read bottom up
+    return " <- ".join(
+        f"{os.path.basename(f.filename)}:{f.lineno}" for f in reversed(traceback)
+    )
+
+
+def top_sites(snapshot, frames=1, top=MEMPROFILE_TOP):
+    """[{"site", "size_mb", "count", "line"}] of the *top* allocation sites of
+    *snapshot*, the source line is that of the innermost frame."""
+    # leave out the profiler's own allocations, made anywhere below its
+    # frames, and those of the background threads of sorcerun and sacred
+    # (heartbeats, monitors, mongo flushes), which all run below threading.py
+    # and talk through queue.py. An adapter's own threads are left out too.
+    snapshot = snapshot.filter_traces(
+        [
+            tracemalloc.Filter(False, f, all_frames=True)
+            for f in [
+                __file__,
+                tracemalloc.__file__,
+                threading.__file__,
+                queue.__file__,
+            ]
+        ]
+    )
+    stats = snapshot.statistics("lineno" if frames <= 1 else "traceback")
+    sites = []
+    for stat in stats[:top]:
+        frame = stat.traceback[-1]
+        sites.append(
+            {
+                "site": site_name(stat.traceback),
+                "size_mb": stat.size / MB,
+                "count": stat.count,
+                "line": linecache.getline(frame.filename, frame.lineno).strip(),
+            }
+        )
+    return sites
+
+
+class MemoryProfiler:
+    """Traces Python allocations with tracemalloc between start() and stop().
+
+    Every *interval* seconds the traced and peak memory since the last point
+    are added to a timeline. Traced memory is polled every *poll* seconds,
+    and a snapshot of the allocation sites taken when it reaches a new high. Only memory allocated through
+    Python's allocators (which includes numpy arrays) of this process is
+    traced, not that of C libraries using malloc directly or subprocesses.
+    """
+
+    def __init__(
+        self, interval=MEMPROFILE_INTERVAL, frames=MEMPROFILE_FRAMES, poll=POLL
+    ):
+        self.interval = interval
+        self.frames = frames
+        self.poll = min(poll, interval)
+        self.timeline = {"t": [], "current_mb": [], "peak_mb": []}
+        self.peak = 0
+        self.peak_snapshot = None
+        self.peak_snapshot_size = 0
+        self._stop = threading.Event()
+        self._tracing = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._next_point = self.interval
+        self._window_peak = 0
+        # started before tracing, so the sampling thread itself is not traced
+        self._thread = threading.Thread(target=self._sample_loop, daemon=True)
+        self._thread.start()
+        self._was_tracing = tracemalloc.is_tracing()
+        if not self._was_tracing:
+            tracemalloc.start(self.frames)
+        tracemalloc.reset_peak()
+        self.t0 = time.perf_counter()
+        self._tracing.set()
+
+    def _sample_loop(self):
+        self._tracing.wait()
+        while not self._stop.wait(self.poll):
+            self.sample()
+
+    def sample(self, last=False):
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        self.peak = max(self.peak, peak)
+        self._window_peak = max(self._window_peak, peak)
+        if current > SNAPSHOT_GROWTH * self.peak_snapshot_size:
+            self.peak_snapshot = tracemalloc.take_snapshot()
+            self.peak_snapshot_size = current
+
+        t = time.perf_counter() - self.t0
+        if t >= self._next_point or last:
+            self.timeline["t"].append(t)
+            self.timeline["current_mb"].append(current / MB)
+            self.timeline["peak_mb"].append(self._window_peak / MB)
+            self._window_peak = 0
+            self._next_point = t + self.interval
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.sample(last=True)
+        self.end_snapshot = tracemalloc.take_snapshot()
+        if not self._was_tracing:
+            tracemalloc.stop()
+
+    def results(self, top=MEMPROFILE_TOP):
+        peak_snapshot = self.peak_snapshot or self.end_snapshot
+        return {
+            "peak_mb": self.peak / MB,
+            "peak_snapshot_mb": self.peak_snapshot_size / MB,
+            "interval": self.interval,
+            "frames": self.frames,
+            "timeline": self.timeline,
+            "top_at_peak": top_sites(peak_snapshot, self.frames, top),
+            "top_at_end": top_sites(self.end_snapshot, self.frames, top),
+        }
+
+    def save(self, run_dir, top=MEMPROFILE_TOP):
+        results = self.results(top)
+        with open(os.path.join(run_dir, MEMPROFILE_FILE), "w") as f:
+            json.dump(results, f)
+        with open(os.path.join(run_dir, MEMPROFILE_TOP_FILE), "w") as f:
+            f.write(f"peak traced memory: {results['peak_mb']:.2f} MB\n\n")
+            f.write("top allocation sites near the peak:\n")
+            f.write(str(sites_table(results["top_at_peak"])) + "\n\n")
+            f.write("top allocation sites at the end:\n")
+            f.write(str(sites_table(results["top_at_end"])) + "\n")
+        return results
+
+
+def sites_table(sites):
+    t = PrettyTable(["site", "size (MB)", "count", "line"])
+    for s in sites:
+        t.add_row([s["site"], round(s["size_mb"], 3), s["count"], s["line"]])
+    t.align = "l"
+    return t
+
+
+def call_memprofiled(adapter_func, config, run, run_dir, call=None):
+    """Call the adapter (through *call* if given) tracing its allocations,
+    saving them to *run_dir* even if it raises. The peak is also logged as
+    the ``memprofile.peak_mb`` metric."""
+    call = call or adapter_func
+    profiler = MemoryProfiler(
+        getattr(adapter_func, "memprofile_interval", MEMPROFILE_INTERVAL),
+        getattr(adapter_func, "memprofile_frames", MEMPROFILE_FRAMES),
+    )
+    profiler.start()
+    try:
+        return call(config, run)
+    finally:
+        profiler.stop()
+        results = profiler.save(run_dir)
+        run.log_scalar("memprofile.peak_mb", results["peak_mb"], 0)
+
+
+def grid_memprofiles(runs_dir, grid_id):
+    """Yields (config, memprofile results) of a grid's memory profiled runs,
+    in run directories or archives."""
+    for run_dir, _, config in grid_run_dirs(runs_dir, grid_id):
+        path = run_dir / MEMPROFILE_FILE
+        if config is not None and os.path.exists(path):
+            with open(path) as f:
+                yield config, json.load(f)
+
+    for archive in iter_archives(runs_dir, grid_id):
+        for run_id, (config, _) in archive.configs().items():
+            if MEMPROFILE_FILE in archive.file_names(run_id):
+                yield config, json.loads(archive.read_file(run_id, MEMPROFILE_FILE))
+        archive.close()
+
+
+def peaks_table(by_value, scale=None):
+    """Peak traced memory per value of the *scale* key, *by_value* maps values
+    to lists of memprofile results."""
+    t = PrettyTable([scale or "value", "runs", "mean peak (MB)", "max peak (MB)"])
+    for value in sorted(by_value, key=value_order):
+        peaks = [r["peak_mb"] for r in by_value[value]]
+        t.add_row([value, len(peaks), round(np.mean(peaks), 3), round(max(peaks), 3)])
+    t.align = "l"
+    return t
+
+
+def grid_sites_table(by_value, top=MEMPROFILE_TOP, scale=None):
+    """The *top* allocation sites near the peak summed over runs, with how
+    their size scales with the *scale* key."""
+    size = defaultdict(float)
+    count = defaultdict(int)
+    lines = {}
+    per_value = defaultdict(lambda: defaultdict(float))
+    for value, results in by_value.items():
+        for r in results:
+            for s in r["top_at_peak"]:
+                size[s["site"]] += s["size_mb"]
+                count[s["site"]] += s["count"]
+                lines[s["site"]] = s["line"]
+                per_value[value][s["site"]] += s["size_mb"] / len(results)
+
+    values = sorted(v for v in by_value if isinstance(v, (int, float)))
+    columns = ["site", "size (MB)", "count", "line"]
+    if scale is not None:
+        columns += [f"exponent in {scale}"]
+    t = PrettyTable(columns)
+    for site in sorted(size, key=lambda s: -size[s])[:top]:
+        row = [site, round(size[site], 3), count[site], lines[site]]
+        if scale is not None:
+            exponent = scaling_exponent(
+                values, [per_value[v].get(site, 0.0) for v in values]
+            )
+            row.append(None if exponent is None else round(exponent, 2))
+        t.add_row(row)
+    t.align = "l"
+    return t
+
+
+def grid_memprofile(file_root, runs_dir, grid_id, by=(), scale=None, top=20):
+    """Tables of the peak traced memory of a grid's memory profiled runs
+    against the *scale* key, and their top allocation sites, per group of the
+    config keys *by*. Saved to grid_outputs/<grid_id>/memprofile/<group>/.
+    Returns {group name: (peaks table, sites table)}."""
+    groups = defaultdict(lambda: defaultdict(list))
+    for config, results in grid_memprofiles(runs_dir, grid_id):
+        config = squish_dict(dict(config))
+        key = tuple(_hashable(config.get(k)) for k in by)
+        value = _hashable(config.get(scale)) if scale is not None else None
+        groups[key][value].append(results)
+
+    out_dir = os.path.join(file_root, GRID_OUTPUTS, grid_id, GRID_MEMPROFILE_DIR)
+    tables = {}
+    for key, by_value in sorted(groups.items(), key=lambda g: str(g[0])):
+        name = group_name(key, by)
+        peaks = peaks_table(by_value, scale)
+        if scale is not None:
+            values = sorted(v for v in by_value if isinstance(v, (int, float)))
+            means = [np.mean([r["peak_mb"] for r in by_value[v]]) for v in values]
+            exponent = scaling_exponent(values, means)
+            if exponent is not None:
+                peaks.title = f"peak ~ {scale}^{exponent:.2f}"
+        sites = grid_sites_table(by_value, top=top, scale=scale)
+        tables[name] = (peaks, sites)
+
+        group_dir = os.path.join(out_dir, name)
+        os.makedirs(group_dir, exist_ok=True)
+        with open(os.path.join(group_dir, MEMPROFILE_TOP_FILE), "w") as f:
+            f.write(str(peaks) + "\n\n" + str(sites) + "\n")
+    return tables
@@ -0,0 +1,365 @@
+from .globals import METRICS_LOG_DIR, METRICS_LOG_SUFFIX
+from urllib.parse import quote, unquote
+from pathlib import Path
+import datetime
+import numpy as np
+import pandas as pd
+import os
+import fnmatch
+
+# one fixed size record per logged value
+METRIC_RECORD_DTYPE = np.dtype(
+    [("step", "<i8"), ("value", "<f8"), ("timestamp", "<f8")]
+)
+
+
+def metric_log_path(run_dir, name):
+    # metric names can contain anything, quote them to get a file name
+    return os.path.join(
+        run_dir, METRICS_LOG_DIR, quote(name, safe="") + METRICS_LOG_SUFFIX
+    )
+
+
+def to_epoch(ts):
+    if isinstance(ts, datetime.datetime):
+        return ts.replace(tzinfo=ts.tzinfo or datetime.timezone.utc).timestamp()
+    return float(ts)
+
+
+def append_metric_log(run_dir, name, steps, values, timestamps):
+    """Append values of metric *name* to its segment in *run_dir*.
+
+    Values are stored as float64, so only numeric metrics can be logged.
+    Timestamps are datetimes (as sacred gives them) or an array of epoch
+    seconds.
+    """
+    records = np.empty(len(steps), dtype=METRIC_RECORD_DTYPE)
+    records["step"] = steps
+    records["value"] = values
+    if isinstance(timestamps, np.ndarray):
+        records["timestamp"] = timestamps
+    else:
+        records["timestamp"] = [to_epoch(ts) for ts in timestamps]
+
+    path = metric_log_path(run_dir, name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "ab") as f:
+        f.write(records.tobytes())
+
+
+def read_metric_log(path):
+    """Read a metric segment into a structured numpy array with fields
+    step, value and timestamp."""
+    with open(path, "rb") as f:
+        return metric_log_from_bytes(f.read())
+
+
+def metric_log_from_bytes(buf):
+    # drop a partial record left by a process killed mid write
+    n = len(buf) // METRIC_RECORD_DTYPE.itemsize
+    return np.frombuffer(buf, dtype=METRIC_RECORD_DTYPE, count=n)
+
+
+def metric_name_of(filename):
+    """The metric name of a segment file name, or None for other files."""
+    if not filename.endswith(METRICS_LOG_SUFFIX):
+        return None
+    return unquote(filename[: -len(METRICS_LOG_SUFFIX)])
+
+
+def records_to_series(name, records):
+    return pd.Series(
+        data=records["value"],
+        index=pd.Index(records["step"], name="step"),
+        name=name,
+    )
+
+
+def read_metric_logs(run_dir):
+    """Load all metric segments of *run_dir* as a dict of structured arrays."""
+    log_dir = Path(run_dir) / METRICS_LOG_DIR
+    if not log_dir.is_dir():
+        return {}
+    return {
+        metric_name_of(p.name): read_metric_log(p)
+        for p in log_dir.iterdir()
+        if metric_name_of(p.name) is not None
+    }
+
+
+def metric_logs_to_series(run_dir):
+    """Load all metric segments of *run_dir* as pandas Series indexed by step,
+    like incense does for metrics.json."""
+    return {
+        name: records_to_series(name, records)
+        for name, records in read_metric_logs(run_dir).items()
+    }
+
+
+def lttb(x, y, n):
+    """Largest-Triangle-Three-Buckets downsampling of (x, y) to *n* points."""
+    if n >= len(x):
+        return x, y
+    if n < 3:
+        idx = [0, len(x) - 1][:n]
+        return x[idx], y[idx]
+
+    every = (len(x) - 2) / (n - 2)
+    idx = np.empty(n, dtype=np.int64)
+    idx[0] = a = 0
+    for i in range(n - 2):
+        start = int(i * every) + 1
+        end = int((i + 1) * every) + 1
+        next_end = min(int((i + 2) * every) + 1, len(x))
+        avg_x = x[end:next_end].mean()
+        avg_y = y[end:next_end].mean()
+        area = np.abs(
+            (x[a] - avg_x) * (y[start:end] - y[a])
+            - (x[a] - x[start:end]) * (avg_y - y[a])
+        )
+        a = start + int(np.argmax(area))
+        idx[i + 1] = a
+    idx[-1] = len(x) - 1
+    return x[idx], y[idx]
+
+
+class Decimate:
+    """Keep every k-th value."""
+
+    def __init__(self, k):
+        self.k = int(k)
+        self.seen = 0
+
+    def add(self, steps, values):
+        keep = (self.seen + np.arange(len(values))) % self.k == 0
+        self.seen += len(values)
+        return steps[keep], values[keep]
+
+    def finish(self):
+        return None
+
+
+class Reservoir:
+    """Keep a uniform random sample of *n* values, written when the run ends."""
+
+    def __init__(self, n, seed=None):
+        self.n = int(n)
+        self.rng = np.random.default_rng(seed)
+        self.seen = 0
+        self.steps = np.empty(0, dtype=np.int64)
+        self.values = np.empty(0, dtype=np.float64)
+
+    def add(self, steps, values):
+        # fill the reservoir first
+        fill = max(min(self.n - len(self.values), len(values)), 0)
+        self.steps = np.concatenate([self.steps, steps[:fill]])
+        self.values = np.concatenate([self.values, values[:fill]])
+        self.seen += fill
+
+        # then item t replaces a random slot with probability n / (t + 1)
+        steps, values = steps[fill:], values[fill:]
+        if len(values):
+            t = self.seen + np.arange(len(values))
+            j = self.rng.integers(0, t + 1)
+            replace = j < self.n
+            self.steps[j[replace]] = steps[replace]
+            self.values[j[replace]] = values[replace]
+            self.seen += len(values)
+        return steps[:0], values[:0]
+
+    def finish(self):
+        order = np.argsort(self.steps, kind="stable")
+        return self.steps[order], self.values[order]
+
+
+class LTTB:
+    """Downsample to *n* points with LTTB, written when the run ends.
+
+    At most 2n points are buffered, the buffer is downsampled back to n
+    points whenever it fills up.
+    """
+
+    def __init__(self, n):
+        self.n = max(int(n), 2)
+        self.steps = np.empty(0, dtype=np.int64)
+        self.values = np.empty(0, dtype=np.float64)
+
+    def add(self, steps, values):
+        self.steps = np.concatenate([self.steps, steps])
+        self.values = np.concatenate([self.values, values])
+        if len(self.values) >= 2 * self.n:
+            self.steps, self.values = lttb(self.steps, self.values, self.n)
+        return steps[:0], values[:0]
+
+    def finish(self):
+        return lttb(self.steps, self.values, self.n)
+
+
+AGGREGATES = ["min", "max", "mean", "var", "last"]
+
+
+class Aggregates:
+    """Running min, max, mean, variance and last value of a metric."""
+
+    def __init__(self, stats=AGGREGATES):
+        unknown = set(stats) - set(AGGREGATES)
+        if unknown:
+            raise ValueError(f"Unknown aggregates {unknown}, choose from {AGGREGATES}")
+        self.stats = list(stats)
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = np.inf
+        self.max = -np.inf
+        self.last = np.nan
+        self.last_step = 0
+
+    def add(self, steps, values):
+        if len(values) == 0:
+            return
+        # merge the batch into the running moments (Chan et al.)
+        n = len(values)
+        batch_mean = values.mean()
+        delta = batch_mean - self.mean
+        total = self.count + n
+        self.m2 += (
+            (values - batch_mean) ** 2
+        ).sum() + delta**2 * self.count * n / total
+        self.mean += delta * n / total
+        self.count = total
+        self.min = min(self.min, values.min())
+        self.max = max(self.max, values.max())
+        self.last = values[-1]
+        self.last_step = steps[-1]
+
+    def finish(self):
+        if self.count == 0:
+            return {}
+        var = self.m2 / self.count
+        return {s: float(var if s == "var" else getattr(self, s)) for s in self.stats}
+
+
+# number of scalars collected before they go through a policy
+SCALAR_CHUNK = 1024
+
+SAMPLERS = {"every": Decimate, "reservoir": Reservoir, "lttb": LTTB}
+
+
+class MetricPolicy:
+    """What to write for one metric, built from a spec like
+
+        {"every": 10}                         keep every 10th value
+        {"reservoir": 1000, "seed": 0}        uniform sample of 1000 values
+        {"lttb": 1000}                        1000 points chosen by LTTB
+        {"aggregate": ["min", "mean"]}        only <name>.min and <name>.mean
+
+    A sampler can be combined with "aggregate". Aggregates are computed over
+    every logged value and written as ``<name>.<stat>`` at the last step
+    when the run ends. Without a sampler the values themselves are dropped.
+    """
+
+    def __init__(self, spec):
+        spec = dict(spec)
+        aggregate = spec.pop("aggregate", None)
+        seed = spec.pop("seed", None)
+        samplers = [k for k in spec if k in SAMPLERS]
+        unknown = [k for k in spec if k not in SAMPLERS]
+        if unknown or len(samplers) > 1:
+            raise ValueError(
+                f"Invalid metric policy {spec}, use at most one of "
+                + f"{list(SAMPLERS)} and optionally 'aggregate'"
+            )
+
+        self.sampler = None
+        if samplers:
+            k = samplers[0]
+            if k == "reservoir":
+                self.sampler = Reservoir(spec[k], seed=seed)
+            else:
+                self.sampler = SAMPLERS[k](spec[k])
+
+        self.aggregates = None
+        if aggregate is not None:
+            if aggregate is True:
+                aggregate = AGGREGATES
+            self.aggregates = Aggregates(aggregate)
+
+        # scalars are collected in lists and go through the policy in chunks
+        self._steps = []
+        self._values = []
+
+    def add_scalar(self, step, value):
+        """Returns the (steps, values) to write right away, or None."""
+        self._steps.append(step)
+        self._values.append(value)
+        if len(self._steps) >= SCALAR_CHUNK:
+            return self._add_pending()
+        return None
+
+    def _add_pending(self):
+        steps = np.array(self._steps, dtype=np.int64)
+        values = np.array(self._values, dtype=np.float64)
+        self._steps, self._values = [], []
+        return self._add(steps, values)
+
+    def add(self, steps, values):
+        """Returns the (steps, values) to write right away."""
+        if self._steps:
+            # keep the order of scalars logged before these values
+            steps = np.concatenate([np.array(self._steps, dtype=np.int64), steps])
+            values = np.concatenate([np.array(self._values), values])
+            self._steps, self._values = [], []
+        return self._add(steps, values)
+
+    def _add(self, steps, values):
+        if self.aggregates is not None:
+            self.aggregates.add(steps, values)
+        if self.sampler is None:
+            return steps[:0], values[:0]
+        return self.sampler.add(steps, values)
+
+    def finish(self, name):
+        """Returns {metric_name: (steps, values)} to write when the run ends."""
+        out = {}
+        steps, values = self._add_pending()
+        if self.sampler is not None:
+            held = self.sampler.finish()
+            if held is not None:
+                steps = np.concatenate([steps, held[0]])
+                values = np.concatenate([values, held[1]])
+        if len(steps):
+            out[name] = (steps, values)
+        if self.aggregates is not None:
+            step = np.array([self.aggregates.last_step], dtype=np.int64)
+            for stat, value in self.aggregates.finish().items():
+                out[f"{name}.{stat}"] = (step, np.array([value]))
+        return out
+
+
+class MetricPolicies:
+    """Per-metric logging policies, keyed by metric name or fnmatch pattern."""
+
+    def __init__(self, specs=None):
+        self.specs = dict(specs or {})
+        self.policies = {}
+        # validate the specs before the run starts
+        for spec in self.specs.values():
+            MetricPolicy(spec)
+
+    def get(self, name):
+        if name not in self.policies:
+            spec = self.specs.get(name)
+            if spec is None:
+                spec = next(
+                    (s for p, s in self.specs.items() if fnmatch.fnmatchcase(name, p)),
+                    None,
+                )
+            self.policies[name] = None if spec is None else MetricPolicy(spec)
+        return self.policies[name]
+
+    def finish(self):
+        out = {}
+        for name, policy in self.policies.items():
+            if policy is not None:
+                out.update(policy.finish(name))
+        return out
@@ -1,10 +1,22 @@
 import os
+import time
 import yaml, json
 import contextlib
 import subprocess
 import click
 from pymongo import MongoClient
-from .globals import AUTH_FILE, MONGOD_PORT, MONGOD_HOST
+from .globals import (
+    AUTH_FILE,
+    MONGOD_PORT,
+    MONGOD_HOST,
+    MONGO_SERVER_TIMEOUT_MS,
+    MONGO_RETRY_AFTER,
+)
+
+# MongoClients of this process, and when and why creating one failed, see
+# get_mongo_client
+_MONGO_CLIENTS = {}
+_MONGO_FAILURES = {}
 
 
 @contextlib.contextmanager
@@ -139,3 +151,49 @@ def init_mongodb(db_path, db_name, username, password):
 
         with open(AUTH_FILE, "w") as auth_file:
             json.dump(auth_data, auth_file, indent=4)
+
+
+def mongo_url_from_auth(auth_data):
+    atlas = auth_data.get("atlas_connection_string", 0)
+    if atlas != 0:
+        return atlas
+    ck = auth_data["client_kwargs"]
+    return f"mongodb://{ck['username']}:{ck['password']}@{ck['host']}:{ck['port']}"
+
+
+def get_mongo_client(*args, **kwargs):
+    """Get a MongoClient for the given arguments, reusing the one this process
+    already created for them.
+
+    A MongoClient is a connection pool, so a worker running many configs should
+    share one instead of paying connection setup and authentication per run.
+    The server is pinged once, when the client is created. Clients are not
+    shared across a fork, since pymongo clients are not fork safe.
+
+    If the server does not answer within MONGO_SERVER_TIMEOUT_MS (unless
+    serverSelectionTimeoutMS is given), the error is raised again right away
+    for MONGO_RETRY_AFTER seconds, so a worker running many configs against
+    a dead server waits for it once, not once per run.
+    """
+    key = (os.getpid(), json.dumps([args, kwargs], sort_keys=True, default=str))
+    if key in _MONGO_CLIENTS:
+        return _MONGO_CLIENTS[key]
+    failed_at, error = _MONGO_FAILURES.get(key, (None, None))
+    if failed_at is not None and time.monotonic() - failed_at < MONGO_RETRY_AFTER:
+        raise error
+
+    kwargs.setdefault("serverSelectionTimeoutMS", MONGO_SERVER_TIMEOUT_MS)
+    try:
+        client = MongoClient(*args, **kwargs)
+    except Exception as e:
+        _MONGO_FAILURES[key] = (time.monotonic(), e)
+        raise
+    try:
+        client.server_info()
+    except Exception as e:
+        client.close()
+        _MONGO_FAILURES[key] = (time.monotonic(), e)
+        raise
+    _MONGO_FAILURES.pop(key, None)
+    _MONGO_CLIENTS[key] = client
+    return client
@@ -0,0 +1,356 @@
+from .globals import (
+    MONGO_FLUSH_INTERVAL,
+    MONGO_MAX_BATCH,
+    MONGO_COUT_LIMIT,
+    MONGO_JOURNAL_STALE,
+)
+from .metrics_utils import append_metric_log
+from .layout_utils import make_sharded_run_dir
+from .scratch_utils import make_flat_run_dir, final_run_dir
+from .capture_utils import head_tail
+from sacred.observers import MongoObserver, FileStorageObserver
+from bson import ObjectId
+from pymongo import UpdateOne
+from pymongo.errors import ConnectionFailure
+import copy
+import os
+import pickle
+import platform
+import threading
+import time
+import traceback
+
+# journals of observers that still run are named
+# <run id>-<host>-<pid>.journal.open and only replayed by their owner, unless
+# it died, so that metric pushes stay in order. Once the run ended they lose
+# the .open suffix and anyone can replay them.
+JOURNAL_SUFFIX = ".journal"
+OPEN_SUFFIX = ".open"
+REPLAYING = ".replaying-"
+
+
+def _write_journal(path, batches):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        pickle.dump(batches, f)
+    os.replace(tmp_path, path)
+
+
+def write_batches(runs, metrics, batches):
+    """Write journal *batches* to mongo in order.
+
+    Each batch is a tuple (metric_updates, run_id, run_set) where metric_updates
+    is a list of (filter, update) pairs for the metrics collection and run_set
+    (if not None) is a $set document for the run with _id run_id.
+
+    Returns the batches that could not be written because mongo is unreachable.
+    """
+    for i, (metric_updates, run_id, run_set) in enumerate(batches):
+        try:
+            if metric_updates:
+                metrics.bulk_write(
+                    [UpdateOne(f, u, upsert=True) for f, u in metric_updates],
+                    ordered=True,
+                )
+            if run_set is not None:
+                runs.update_one({"_id": run_id}, {"$set": run_set})
+        except ConnectionFailure:
+            return batches[i:]
+    return []
+
+
+def _owner():
+    return f"{platform.node()}-{os.getpid()}"
+
+
+def _is_orphaned(path, owner, stale):
+    """Whether the process *owner* (<host>-<pid>) holding *path* is gone: it
+    is not running if on this host, else it did not write *path* for *stale*
+    seconds."""
+    host, _, pid = owner.rpartition("-")
+    if host == platform.node() and pid.isdigit():
+        try:
+            os.kill(int(pid), 0)
+        except ProcessLookupError:
+            return True
+        except PermissionError:
+            pass
+        return False
+    try:
+        return time.time() - os.path.getmtime(path) > stale
+    except FileNotFoundError:
+        return False
+
+
+def _replayable(name, path, stale):
+    """The closed journal path that *name* is replayed to, if it can be
+    replayed now, else None."""
+    if REPLAYING in name:
+        # a replay that crashed
+        journal, owner = name.rsplit(REPLAYING, 1)
+    elif name.endswith(JOURNAL_SUFFIX + OPEN_SUFFIX):
+        journal = name[: -len(OPEN_SUFFIX)]
+        owner = journal[: -len(JOURNAL_SUFFIX)].partition("-")[2]
+    elif name.endswith(JOURNAL_SUFFIX):
+        return name
+    else:
+        return None
+    if journal.endswith(OPEN_SUFFIX):
+        journal = journal[: -len(OPEN_SUFFIX)]
+    return journal if _is_orphaned(path, owner, stale) else None
+
+
+def replay_journals(journal_dir, runs, metrics, stale=MONGO_JOURNAL_STALE):
+    """Replay the journals that BufferedMongoObservers left in *journal_dir*
+    while mongo was unreachable. Journals of observers that are still running
+    are left to them, as are replays in progress; their owners count as gone
+    once dead, or on other hosts once their file is *stale* seconds old.
+    Returns the number of journals replayed."""
+    if not os.path.isdir(journal_dir):
+        return 0
+    replayed = 0
+    for name in sorted(os.listdir(journal_dir)):
+        path = os.path.join(journal_dir, name)
+        journal = _replayable(name, path, stale)
+        if journal is None:
+            continue
+        journal = os.path.join(journal_dir, journal)
+        # claim the journal so that no one else replays it at the same time
+        claimed = f"{journal}{REPLAYING}{_owner()}"
+        try:
+            os.rename(path, claimed)
+        except FileNotFoundError:
+            continue
+        with open(claimed, "rb") as f:
+            batches = pickle.load(f)
+        remaining = write_batches(runs, metrics, batches)
+        if remaining:
+            _write_journal(journal, remaining)
+            os.remove(claimed)
+            break
+        os.remove(claimed)
+        replayed += 1
+    return replayed
+
+
+class BufferedMongoObserver(MongoObserver):
+    """MongoObserver that writes metrics and run updates from a background thread.
+
+    Metric pushes and run updates are buffered and written with one
+    ``bulk_write`` every *flush_interval* seconds, or as soon as *max_batch*
+    metric updates are pending, so heartbeats never wait on the network.
+    Batches that cannot be written because mongo is unreachable are spilled to
+    a journal file in *journal_dir* and replayed by later flushes, and once
+    the run ended (or its process died) by later runs or ``sorcerun mongo
+    replay`` (see replay_journals). Replaying is at-least-once, so a batch that
+    was partially written before a connection failure can be pushed twice.
+
+    Captured output longer than MONGO_COUT_LIMIT is cut to its head and tail
+    in the run document, which then points to the run directory of
+    *file_observer* for all of it.
+    """
+
+    def __init__(
+        self,
+        *args,
+        journal_dir,
+        flush_interval=MONGO_FLUSH_INTERVAL,
+        max_batch=MONGO_MAX_BATCH,
+        **kwargs,
+    ):
+        kwargs.setdefault("failure_dir", journal_dir)
+        super().__init__(*args, **kwargs)
+        self.journal_dir = journal_dir
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+
+        # reentrant: sacred calls save() from inside the updates guarded by it
+        self._lock = threading.RLock()
+        self._flush_lock = threading.Lock()
+        self._metric_updates = []
+        self._run_dirty = False
+        self._metric_ids = {}
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._journal_path = None
+        self.file_observer = None
+
+    def started_event(self, *args, **kwargs):
+        _id = super().started_event(*args, **kwargs)
+        os.makedirs(self.journal_dir, exist_ok=True)
+        self._journal_path = os.path.join(
+            self.journal_dir, f"{_id}-{_owner()}{JOURNAL_SUFFIX}{OPEN_SUFFIX}"
+        )
+        self._thread = threading.Thread(target=self._flush_loop, daemon=True)
+        self._thread.start()
+        return _id
+
+    def heartbeat_event(self, info, captured_out, beat_time, result):
+        if len(captured_out) > MONGO_COUT_LIMIT:
+            captured_out = head_tail(captured_out, MONGO_COUT_LIMIT)
+            if self.file_observer is not None:
+                # cout.txt (or cout.txt.gz once the run ended) in here
+                self.run_entry["captured_out_dir"] = final_run_dir(
+                    self.file_observer.basedir, self.file_observer.dir
+                )
+        with self._lock:
+            super().heartbeat_event(info, captured_out, beat_time, result)
+
+    def save(self):
+        # called on heartbeats, resources and artifacts, written by the next flush
+        with self._lock:
+            self._run_dirty = True
+
+    def _push_metric(self, name, steps, values, timestamps, info):
+        if name not in self._metric_ids:
+            # choose the id ourselves so we can reference it before it is written
+            self._metric_ids[name] = ObjectId()
+            info.setdefault("metrics", []).append(
+                {"name": name, "id": str(self._metric_ids[name])}
+            )
+        query = {
+            "_id": self._metric_ids[name],
+            "run_id": self.run_entry["_id"],
+            "name": name,
+        }
+        push = {
+            "steps": {"$each": steps},
+            "values": {"$each": values},
+            "timestamps": {"$each": timestamps},
+        }
+        self._metric_updates.append((query, {"$push": push}))
+
+    def log_metrics(self, metrics_by_name, info):
+        if self.metrics is None:
+            return
+        with self._lock:
+            for name, m in metrics_by_name.items():
+                self._push_metric(name, m["steps"], m["values"], m["timestamps"], info)
+            full = len(self._metric_updates) >= self.max_batch
+        if full:
+            self._wakeup.set()
+
+    def _take_batch(self):
+        with self._lock:
+            metric_updates, self._metric_updates = self._metric_updates, []
+            run_set = copy.deepcopy(self.run_entry) if self._run_dirty else None
+            self._run_dirty = False
+        return metric_updates, self.run_entry["_id"], run_set
+
+    def flush(self):
+        with self._flush_lock:
+            batches = []
+            if os.path.exists(self._journal_path):
+                with open(self._journal_path, "rb") as f:
+                    batches = pickle.load(f)
+            batch = self._take_batch()
+            if batch[0] or batch[2] is not None:
+                batches.append(batch)
+            if not batches:
+                return
+
+            try:
+                remaining = write_batches(self.runs, self.metrics, batches)
+            except Exception:
+                traceback.print_exc()
+                print("WARNING: Journaling mongo updates that could not be written")
+                remaining = batches
+
+            if remaining:
+                _write_journal(self._journal_path, remaining)
+            elif os.path.exists(self._journal_path):
+                os.remove(self._journal_path)
+
+    def _flush_loop(self):
+        # journals left by earlier runs, off the path of the run
+        try:
+            replay_journals(self.journal_dir, self.runs, self.metrics)
+        except Exception:
+            traceback.print_exc()
+        while not self._stop.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def final_save(self, attempts):
+        if self._thread is not None:
+            self._stop.set()
+            self._wakeup.set()
+            self._thread.join()
+            self._thread = None
+        self.flush()
+        if os.path.exists(self._journal_path):
+            # mongo is down, journal the final state of the run as well
+            with self._flush_lock:
+                with open(self._journal_path, "rb") as f:
+                    batches = pickle.load(f)
+                batches.append(
+                    ([], self.run_entry["_id"], copy.deepcopy(self.run_entry))
+                )
+                # the run is over, anyone may replay it now
+                closed = self._journal_path[: -len(OPEN_SUFFIX)]
+                _write_journal(closed, batches)
+                os.remove(self._journal_path)
+            print(
+                f"WARNING: mongo is unreachable, pending updates are journaled in "
+                + f"{closed}. Run `sorcerun mongo replay` to write them."
+            )
+            return
+        super().final_save(attempts)
+
+
+class ShardedFileStorageObserver(FileStorageObserver):
+    """FileStorageObserver that puts runs in ``<basedir>/<shard>/<run name>``.
+
+    Run names are unique without listing the directory (see layout_utils),
+    and the run id is the path of the run relative to *basedir*. If another
+    observer (mongo) chose the id, it is used as the run name instead.
+    """
+
+    def __init__(self, basedir, shard, **kwargs):
+        super().__init__(basedir, **kwargs)
+        self.shard = shard
+
+    def _make_run_dir(self, _id):
+        os.makedirs(self.basedir, exist_ok=True)
+        name = None if _id is None else str(_id)
+        run_id = make_sharded_run_dir(self.basedir, self.shard, name=name)
+        self.dir = os.path.join(self.basedir, run_id)
+
+
+class FlatFileStorageObserver(FileStorageObserver):
+    """FileStorageObserver that does not reuse the ids of runs packed into an
+    archive by sorcerun compact, and keeps the id of runs staged on scratch
+    when they are moved (see scratch_utils.make_flat_run_dir)."""
+
+    def _make_run_dir(self, _id):
+        _id = make_flat_run_dir(self.basedir, _id)
+        self.dir = os.path.join(self.basedir, str(_id))
+
+
+class MetricsLogFileStorageObserver(FlatFileStorageObserver):
+    """FileStorageObserver that appends metrics to per-metric binary segments.
+
+    The stock observer rewrites the whole metrics.json on every heartbeat,
+    which is quadratic in the number of logged values. This one appends the
+    new values of each metric to ``metrics/<name>.bin`` in the run directory
+    and leaves metrics.json empty. Use ``metrics_utils.read_metric_logs`` (or
+    the loaders in incense_utils) to read them back.
+    """
+
+    def started_event(self, *args, **kwargs):
+        _id = super().started_event(*args, **kwargs)
+        # keep metrics.json around for readers that expect it
+        self.save_json({}, "metrics.json")
+        return _id
+
+    def log_metrics(self, metrics_by_name, info):
+        for name, m in metrics_by_name.items():
+            append_metric_log(self.dir, name, m["steps"], m["values"], m["timestamps"])
+
+
+class ShardedMetricsLogFileStorageObserver(
+    ShardedFileStorageObserver, MetricsLogFileStorageObserver
+):
+    pass
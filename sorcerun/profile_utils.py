@@ -0,0 +1,210 @@
+from .globals import (
+    PROFILE_FILE,
+    PROFILE_FOLDED_FILE,
+    FLAMEGRAPH_FILE,
+    PROFILE_SAMPLE_RATE,
+    FLAMEGRAPH_BACKGROUND_MAX,
+)
+import threading
+import traceback
+import subprocess
+import cProfile
+import hashlib
+import json
+import sys
+import os
+
+# Profilers to choose from with ``adapter.profiler``:
+#
+#   cprofile:  deterministic cProfile of the adapter, saved to profile.prof
+#   sample:    statistical profile, the adapter's stack is sampled
+#              ``adapter.profile_rate`` times per second and saved as folded
+#              stacks (the input format of flamegraph.pl) to profile.folded
+#   off:       no profile
+PROFILERS = ["cprofile", "sample", "off"]
+
+# When to render profile.svg (``adapter.flamegraph``):
+#
+#   background:  in a detached process once the adapter returned, at most
+#                FLAMEGRAPH_BACKGROUND_MAX at a time per process
+#   sync:        before the run ends
+#   off:         only with `sorcerun flamegraph <run_dir>` (or `-g <grid_id>`)
+#
+# The default is background for single runs and off for runs of a grid,
+# whose renders would compete with the grid.
+FLAMEGRAPH_MODES = ["background", "sync", "off"]
+
+# background renders started by this process that may still be running
+_renders = []
+
+
+class CProfiler:
+    def __init__(self):
+        self.profile = cProfile.Profile()
+
+    def start(self):
+        self.profile.enable()
+
+    def stop(self):
+        self.profile.disable()
+
+    def save(self, run_dir):
+        self.profile.dump_stats(os.path.join(run_dir, PROFILE_FILE))
+
+
+def frame_name(code):
+    # flamegraph.pl splits stacks on ";"
+    name = (
+        f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+    )
+    return name.replace(";", ":")
+
+
+class SamplingProfiler:
+    """Samples the stack of the thread that started it *rate* times a second,
+    from the function that called start() down.
+
+    Costs one stack walk per sample in a background thread, instead of a hook
+    on every call like cProfile.
+    """
+
+    def __init__(self, rate=PROFILE_SAMPLE_RATE):
+        self.interval = 1 / float(rate)
+        self.counts = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread_id = threading.get_ident()
+        # stacks are recorded from below the caller of start
+        self._root = sys._getframe(1)
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._sample_loop, daemon=True)
+        self._thread.start()
+
+    def _sample_loop(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._thread_id)
+            stack = []
+            while frame is not None and frame is not self._root:
+                stack.append(frame_name(frame.f_code))
+                frame = frame.f_back
+            if stack:
+                key = ";".join(reversed(stack))
+                self.counts[key] = self.counts.get(key, 0) + 1
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def save(self, run_dir):
+        with open(os.path.join(run_dir, PROFILE_FOLDED_FILE), "w") as f:
+            for stack, count in sorted(self.counts.items()):
+                f.write(f"{stack} {count}\n")
+
+
+def should_profile(config, fraction):
+    """Whether a run of *config* is profiled when only a *fraction* of runs
+    are. Decided by a hash of the config without its seed, which sacred and
+    lite runs draw at random, so reruns agree."""
+    if fraction >= 1:
+        return True
+    config = {k: v for k, v in config.items() if k != "seed"}
+    key = json.dumps(config, sort_keys=True, default=str).encode()
+    h = int.from_bytes(hashlib.sha256(key).digest()[:8], "big")
+    return h / 2**64 < fraction
+
+
+def make_profiler(adapter_func, config):
+    """The profiler chosen by the ``profiler``, ``profile_rate`` and
+    ``profile_fraction`` attributes of *adapter_func*, or None."""
+    profiler = getattr(adapter_func, "profiler", "cprofile")
+    if profiler not in PROFILERS:
+        raise ValueError(f"Unknown profiler {profiler}, choose from {PROFILERS}")
+    if profiler == "off":
+        return None
+    if not should_profile(config, getattr(adapter_func, "profile_fraction", 1.0)):
+        return None
+    if profiler == "sample":
+        return SamplingProfiler(
+            getattr(adapter_func, "profile_rate", PROFILE_SAMPLE_RATE)
+        )
+    return CProfiler()
+
+
+def flamegraph_command(run_dir):
+    """Shell command rendering the profile in *run_dir* to profile.svg, or
+    None if there is no profile."""
+    svg = os.path.join(run_dir, FLAMEGRAPH_FILE)
+    prof = os.path.join(run_dir, PROFILE_FILE)
+    folded = os.path.join(run_dir, PROFILE_FOLDED_FILE)
+    if os.path.exists(prof):
+        return f"flameprof --format=log '{prof}' | flamegraph.pl > '{svg}'"
+    if os.path.exists(folded):
+        return f"flamegraph.pl '{folded}' > '{svg}'"
+    return None
+
+
+def render_flamegraph(run_dir, background=False):
+    """Render the profile in *run_dir* with flameprof and flamegraph.pl. In
+    the *background*, the render outlives the run and is not waited for,
+    unless FLAMEGRAPH_BACKGROUND_MAX earlier renders are still running."""
+    command = flamegraph_command(run_dir)
+    if command is None:
+        return
+    try:
+        if background:
+            # reap finished renders, wait for the oldest one when at the limit
+            _renders[:] = [p for p in _renders if p.poll() is None]
+            while len(_renders) >= FLAMEGRAPH_BACKGROUND_MAX:
+                _renders.pop(0).wait()
+            _renders.append(
+                subprocess.Popen(
+                    command,
+                    shell=True,
+                    start_new_session=True,
+                    stdin=subprocess.DEVNULL,
+                    stdout=subprocess.DEVNULL,
+                    stderr=subprocess.DEVNULL,
+                )
+            )
+        else:
+            subprocess.run(command, shell=True)
+    except Exception:
+        traceback.print_exc()
+        print(
+            f"WARNING: Failed to generate flamegraph with above exception."
+            + " Not generating flamegraph"
+        )
+
+
+def call_profiled(adapter_func, config, run, run_dir, call=None, render=True):
+    """Call the adapter (through *call* if given) under the profiler it asks
+    for, saving the profile to *run_dir* even if the adapter raises. Unless
+    *render* is False, the flamegraph is then rendered as the adapter asks
+    (see render_adapter_flamegraph)."""
+    call = call or adapter_func
+    profiler = make_profiler(adapter_func, config)
+    if profiler is None:
+        return call(config, run)
+
+    profiler.start()
+    try:
+        return call(config, run)
+    finally:
+        profiler.stop()
+        profiler.save(run_dir)
+        if render:
+            render_adapter_flamegraph(adapter_func, config, run_dir)
+
+
+def render_adapter_flamegraph(adapter_func, config, run_dir):
+    """Render the profile in *run_dir*, if any, as the ``flamegraph``
+    attribute of *adapter_func* asks (see FLAMEGRAPH_MODES)."""
+    default = "off" if config.get("grid_id") is not None else "background"
+    flamegraph = getattr(adapter_func, "flamegraph", default)
+    if flamegraph not in FLAMEGRAPH_MODES:
+        print(f"WARNING: Unknown flamegraph mode {flamegraph}, using {default}")
+        flamegraph = default
+    if flamegraph != "off":
+        render_flamegraph(run_dir, background=flamegraph == "background")
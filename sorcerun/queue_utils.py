@@ -0,0 +1,202 @@
+from .globals import QUEUE_META_FILE
+import os
+import json
+import time
+import platform
+import threading
+
+PENDING = "pending"
+CLAIMED = "claimed"
+DONE = "done"
+FAILED = "failed"
+STATES = [PENDING, CLAIMED, DONE, FAILED]
+
+# separates the task name from the worker id in claimed file names
+CLAIM_SEP = "@"
+
+
+def worker_id():
+    return f"{platform.node()}-{os.getpid()}"
+
+
+def _is_task(name):
+    """Whether *name* in a state directory is a task, not a failure trace."""
+    return name.split(CLAIM_SEP)[0].endswith(".json")
+
+
+def _write_atomic(path, obj, tmp_dir=None):
+    # written next to the state directories, never into pending/ where a
+    # worker could claim the half written file
+    tmp_dir = tmp_dir or os.path.dirname(path)
+    tmp_path = os.path.join(tmp_dir, f"{os.path.basename(path)}.{worker_id()}.tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(obj, f)
+    os.rename(tmp_path, path)
+
+
+class Claim:
+    def __init__(self, queue, name, path):
+        self.queue = queue
+        self.name = name
+        self.path = path
+
+    @property
+    def config(self):
+        with open(self.path, "r") as f:
+            return json.load(f)
+
+    def __repr__(self):
+        return f"Claim({self.name})"
+
+
+class WorkQueue:
+    """A queue of configs stored as files in a directory.
+
+    Only needs a filesystem shared by all workers (e.g. NFS home directories).
+    Every config is a json file that moves between the ``pending``, ``claimed``,
+    ``done`` and ``failed`` subdirectories with ``os.rename``, which is atomic,
+    so exactly one worker wins each claim. Workers touch their claimed file
+    periodically, and claims whose file has not been touched for a while are
+    assumed to belong to a dead worker and are moved back to ``pending``.
+
+    Tasks run at least once, not exactly once: a worker that stalls past the
+    timeout keeps running its task while another worker runs it again. Only
+    the worker that still holds the claim file records the outcome, the
+    other one's complete or fail returns False.
+    """
+
+    def __init__(self, queue_dir):
+        self.queue_dir = os.path.abspath(queue_dir)
+        self.dirs = {state: os.path.join(self.queue_dir, state) for state in STATES}
+
+    @classmethod
+    def create(cls, queue_dir, configs, meta):
+        queue = cls(queue_dir)
+        for d in queue.dirs.values():
+            os.makedirs(d, exist_ok=True)
+        _write_atomic(os.path.join(queue.queue_dir, QUEUE_META_FILE), meta)
+
+        # continue numbering if the queue already has tasks
+        start = sum(queue.counts().values())
+        for i, conf in enumerate(configs):
+            _write_atomic(
+                os.path.join(queue.dirs[PENDING], f"{start + i:08d}.json"),
+                conf,
+                tmp_dir=queue.queue_dir,
+            )
+        return queue
+
+    @property
+    def meta(self):
+        with open(os.path.join(self.queue_dir, QUEUE_META_FILE), "r") as f:
+            return json.load(f)
+
+    def counts(self):
+        return {
+            state: sum(_is_task(name) for name in os.listdir(d))
+            for state, d in self.dirs.items()
+        }
+
+    def now(self):
+        """Current time according to the filesystem, so that heartbeats
+        written by machines with skewed clocks can be compared."""
+        clock_file = os.path.join(self.queue_dir, ".clock")
+        with open(clock_file, "a"):
+            os.utime(clock_file, None)
+        return os.stat(clock_file).st_mtime
+
+    def claim(self, worker=None):
+        """Atomically claim a pending task, returns a Claim or None if the
+        queue has no pending tasks."""
+        worker = worker or worker_id()
+        for name in sorted(os.listdir(self.dirs[PENDING])):
+            if not _is_task(name):
+                continue
+            src = os.path.join(self.dirs[PENDING], name)
+            dst = os.path.join(self.dirs[CLAIMED], f"{name}{CLAIM_SEP}{worker}")
+            try:
+                os.rename(src, dst)
+            except FileNotFoundError:
+                # someone else got it first
+                continue
+            os.utime(dst, None)
+            return Claim(self, name, dst)
+        return None
+
+    def heartbeat(self, claim):
+        """Returns False if the claim was taken away from us."""
+        try:
+            os.utime(claim.path, None)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def _finish(self, claim, state):
+        """Move *claim* to *state* if it is still ours. The claim file's name
+        holds the worker id, so the rename succeeds only while no one has
+        reclaimed it, and it races atomically with reclaim_stale."""
+        dst = os.path.join(self.dirs[state], claim.name)
+        try:
+            os.rename(claim.path, dst)
+        except FileNotFoundError:
+            # reclaimed, it is pending again or another worker runs it now
+            return None
+        return dst
+
+    def complete(self, claim):
+        """Returns False if the claim was taken away from us."""
+        return self._finish(claim, DONE) is not None
+
+    def fail(self, claim, trace=""):
+        """Returns False if the claim was taken away from us."""
+        dst = self._finish(claim, FAILED)
+        if dst is None:
+            return False
+        with open(dst + ".err", "w") as f:
+            f.write(trace)
+        return True
+
+    def reclaim_stale(self, timeout):
+        """Move claims that have not had a heartbeat for *timeout* seconds back
+        to pending. Returns the names of the reclaimed tasks."""
+        now = self.now()
+        reclaimed = []
+        for claimed_name in os.listdir(self.dirs[CLAIMED]):
+            path = os.path.join(self.dirs[CLAIMED], claimed_name)
+            try:
+                stale = now - os.stat(path).st_mtime > timeout
+            except FileNotFoundError:
+                continue
+            if not stale:
+                continue
+            name = claimed_name.split(CLAIM_SEP)[0]
+            try:
+                os.rename(path, os.path.join(self.dirs[PENDING], name))
+                reclaimed.append(name)
+            except FileNotFoundError:
+                pass
+        return reclaimed
+
+
+class Heartbeat:
+    """Context manager that keeps touching a claim from a background thread."""
+
+    def __init__(self, claim, interval):
+        self.claim = claim
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._beat, daemon=True)
+
+    def _beat(self):
+        while not self._stop.wait(self.interval):
+            if not self.claim.queue.heartbeat(self.claim):
+                print(f"WARNING: lost claim on {self.claim.name}, it was reclaimed")
+                return
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self._stop.set()
+        self._thread.join()
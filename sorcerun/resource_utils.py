@@ -0,0 +1,137 @@
+from .globals import RESOURCE_SAMPLE_INTERVAL, RESOURCE_METRIC_PREFIX
+from contextlib import contextmanager
+import threading
+import time
+import psutil
+
+MB = 1024**2
+
+
+def _io_bytes(proc):
+    try:
+        io = proc.io_counters()
+        return io.read_bytes, io.write_bytes
+    except (psutil.Error, AttributeError, NotImplementedError):
+        # not available on every platform (e.g. macOS)
+        return 0, 0
+
+
+class ResourceMonitor:
+    """Wall time, CPU time, peak RSS and I/O of this process and the children
+    it starts between start() and stop().
+
+    Peak RSS (summed over the process and its children) and the I/O and CPU
+    time of children that have not been waited for are sampled every
+    *interval* seconds, so short lived peaks and children can be missed.
+    Peak RSS is that of the whole process, including the interpreter and
+    everything imported before the adapter ran (a couple hundred MB with
+    sacred and numpy), not only what the adapter allocated.
+    """
+
+    def __init__(self, interval=RESOURCE_SAMPLE_INTERVAL):
+        self.interval = interval
+        self.proc = psutil.Process()
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        self.t0 = time.perf_counter()
+        self.cpu0 = self.proc.cpu_times()
+        self.io0 = _io_bytes(self.proc)
+        self.peak_rss = 0
+        self.max_children = 0
+        # last seen (cpu seconds, read bytes, write bytes) of every child
+        self.children = {}
+        # e.g. flamegraph renders of an earlier run in the same grid worker
+        try:
+            self.ignored = {c.pid for c in self.proc.children(recursive=True)}
+        except psutil.Error:
+            self.ignored = set()
+        self.sample()
+        self._thread = threading.Thread(target=self._sample_loop, daemon=True)
+        self._thread.start()
+
+    def _sample_loop(self):
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    def sample(self):
+        try:
+            rss = self.proc.memory_info().rss
+            children = self.proc.children(recursive=True)
+        except psutil.Error:
+            return
+        alive = {}
+        for child in children:
+            if child.pid in self.ignored:
+                continue
+            try:
+                with child.oneshot():
+                    rss += child.memory_info().rss
+                    cpu = child.cpu_times()
+                    alive[child.pid] = (cpu.user + cpu.system,) + _io_bytes(child)
+            except psutil.Error:
+                continue
+        with self._lock:
+            self.peak_rss = max(self.peak_rss, rss)
+            self.max_children = max(self.max_children, len(alive))
+            self.children.update(alive)
+            self.alive = set(alive)
+
+    def stop(self):
+        """Stop sampling, returns the resources used since start()."""
+        self._stop.set()
+        self._thread.join()
+        self.sample()
+
+        wall = time.perf_counter() - self.t0
+        cpu = self.proc.cpu_times()
+        user = cpu.user - self.cpu0.user
+        system = cpu.system - self.cpu0.system
+        # children that have been waited for are in children_user/system,
+        # the ones still running only in our samples
+        waited = (cpu.children_user - self.cpu0.children_user) + (
+            cpu.children_system - self.cpu0.children_system
+        )
+        with self._lock:
+            running = sum(self.children[pid][0] for pid in self.alive)
+            child_read = sum(c[1] for c in self.children.values())
+            child_write = sum(c[2] for c in self.children.values())
+        read, write = _io_bytes(self.proc)
+
+        cpu_time = user + system + waited + running
+        return {
+            "wall_s": wall,
+            "cpu_user_s": user,
+            "cpu_system_s": system,
+            "cpu_children_s": waited + running,
+            "cpu_s": cpu_time,
+            "cpu_util": cpu_time / wall if wall > 0 else 0.0,
+            "peak_rss_mb": self.peak_rss / MB,
+            "read_mb": (read - self.io0[0] + child_read) / MB,
+            "write_mb": (write - self.io0[1] + child_write) / MB,
+            "max_children": self.max_children,
+        }
+
+
+@contextmanager
+def record_resources(run, adapter_func=None):
+    """Record the resources used inside this context to ``run.info
+    ["resources"]`` and as ``resources.<name>`` metrics at step 0, unless
+    *adapter_func* has ``record_resources = False``."""
+    if not getattr(adapter_func, "record_resources", True):
+        yield
+        return
+
+    monitor = ResourceMonitor(
+        getattr(adapter_func, "resource_interval", RESOURCE_SAMPLE_INTERVAL)
+    )
+    monitor.start()
+    try:
+        yield
+    finally:
+        resources = monitor.stop()
+        run.info["resources"] = resources
+        for name, value in resources.items():
+            run.log_scalar(RESOURCE_METRIC_PREFIX + name, value, 0)
@@ -0,0 +1,234 @@
+from .metrics_utils import to_epoch, MetricPolicies
+from .summary_utils import MetricSummaries
+from .blob_utils import ArtifactUploader, use_blob_store
+from .globals import TIMER_METRIC_PREFIX
+from sacred.metrics_logger import linearize_metrics
+from contextlib import contextmanager
+import datetime
+import threading
+import time
+import numpy as np
+
+
+class ArrayMetrics:
+    """Whole arrays logged with ``_run.log_array``, written at the next heartbeat.
+
+    Observers that implement ``log_array_metric(name, steps, values,
+    timestamps)`` get numpy arrays (timestamps in epoch seconds), all others
+    get ordinary metrics through ``log_metrics``.
+    """
+
+    def __init__(self, run):
+        self.run = run
+        self._lock = threading.Lock()
+        self._pending = []
+
+    def steps_for(self, name, n, steps=None):
+        """Steps for *n* new values of metric *name*, continuing the step
+        counter of the metric (shared with ``_run.log_scalar``) by default."""
+        counter = self.run._metrics._metric_step_counter
+        if steps is None:
+            start = counter.get(name, -1) + 1
+            steps = np.arange(start, start + n, dtype=np.int64)
+        else:
+            steps = np.array(steps, dtype=np.int64).ravel()
+            if len(steps) != n:
+                raise ValueError(f"log_array got {n} values but {len(steps)} steps")
+        if n:
+            counter[name] = int(steps[-1])
+        return steps
+
+    def log_array(self, name, values, steps=None):
+        """Log all *values* of metric *name* at once."""
+        values = np.array(values, dtype=np.float64).ravel()
+        steps = self.steps_for(name, len(values), steps)
+        if len(values) == 0:
+            return
+        with self._lock:
+            self._pending.append((name, steps, values, datetime.datetime.utcnow()))
+
+    def emit(self):
+        with self._lock:
+            pending, self._pending = self._pending, []
+        by_name = {}
+        for name, steps, values, ts in pending:
+            by_name.setdefault(name, []).append((steps, values, ts))
+
+        for name, chunks in by_name.items():
+            steps = np.concatenate([c[0] for c in chunks])
+            values = np.concatenate([c[1] for c in chunks])
+            self.run.metric_summaries.update(name, steps, values)
+            for observer in self.run.observers:
+                if hasattr(observer, "log_array_metric"):
+                    timestamps = np.concatenate(
+                        [np.full(len(s), to_epoch(ts)) for s, _, ts in chunks]
+                    )
+                    self.run._safe_call(
+                        observer,
+                        "log_array_metric",
+                        name=name,
+                        steps=steps,
+                        values=values,
+                        timestamps=timestamps,
+                    )
+                else:
+                    metric = {
+                        "steps": steps.tolist(),
+                        "values": values.tolist(),
+                        "timestamps": [ts for s, _, ts in chunks for _ in s],
+                        "name": name,
+                    }
+                    self.run._safe_call(
+                        observer,
+                        "log_metrics",
+                        metrics_by_name={name: metric},
+                        info=self.run.info,
+                    )
+
+
+class PhaseTimers:
+    """Total time and number of calls of every phase timed with
+    ``with _run.timer("phase"):``, kept in memory until the run ends."""
+
+    def __init__(self):
+        self.totals = {}
+        self.calls = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def timer(self, phase):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            dt = time.perf_counter() - t0
+            with self._lock:
+                self.totals[phase] = self.totals.get(phase, 0.0) + dt
+                self.calls[phase] = self.calls.get(phase, 0) + 1
+
+    def log(self, run, wall=None):
+        """Log ``timer.<phase>`` (seconds), ``timer.<phase>.calls`` and, given
+        the *wall* time of the adapter, ``timer.<phase>.share`` at step 0."""
+        with self._lock:
+            totals, calls = dict(self.totals), dict(self.calls)
+        for phase, total in totals.items():
+            name = TIMER_METRIC_PREFIX + phase
+            run.log_scalar(name, total, 0)
+            run.log_scalar(name + ".calls", calls[phase], 0)
+            if wall:
+                run.log_scalar(name + ".share", total / wall, 0)
+
+
+def _apply_metric_policies(run):
+    # wrap log_scalar and log_array so that nothing reaches the metrics queue
+    # or the observers before it went through the policy of its metric
+    log_scalar, log_array = run.log_scalar, run.log_array
+    counter = run._metrics._metric_step_counter
+
+    def log_scalar_with_policy(metric_name, value, step=None):
+        policy = run.metric_policies.get(metric_name)
+        if policy is None:
+            return log_scalar(metric_name, value, step)
+        if step is None:
+            step = counter.get(metric_name, -1) + 1
+        kept = policy.add_scalar(step, float(value))
+        if kept is not None:
+            log_array(metric_name, kept[1], kept[0])
+        counter[metric_name] = step
+
+    def log_array_with_policy(name, values, steps=None):
+        policy = run.metric_policies.get(name)
+        if policy is None:
+            return log_array(name, values, steps)
+        values = np.array(values, dtype=np.float64).ravel()
+        steps = run.array_metrics.steps_for(name, len(values), steps)
+        last = counter.get(name)
+        kept_steps, kept_values = policy.add(steps, values)
+        log_array(name, kept_values, kept_steps)
+        if last is not None:
+            counter[name] = last
+
+    run.log_scalar = log_scalar_with_policy
+    run.log_array = log_array_with_policy
+
+
+def extend_run(run, metric_policies=None, blob_store=None, async_artifacts=False):
+    """Add the sorcerun extensions to a sacred Run before it is started.
+
+    *metric_policies* maps metric names (or fnmatch patterns) to logging
+    policies, see metrics_utils.MetricPolicy. With a *blob_store*, the file
+    observers link artifacts from it instead of copying them. With
+    *async_artifacts*, ``_run.add_artifact`` returns right away and the
+    artifact is added in the background (per call with ``background=``).
+    ``with _run.timer("phase"):`` times phases of the adapter (see
+    PhaseTimers).
+    """
+    run.array_metrics = ArrayMetrics(run)
+    run.phase_timers = PhaseTimers()
+    run.timer = run.phase_timers.timer
+    run.log_array = run.array_metrics.log_array
+    run.metric_summaries = MetricSummaries()
+    run.metric_policies = MetricPolicies(metric_policies)
+    if run.metric_policies.specs:
+        _apply_metric_policies(run)
+
+    # summarize the scalars as they leave the queue in the heartbeat thread
+    get_last_metrics = run._metrics.get_last_metrics
+
+    def get_last_metrics_and_summarize():
+        entries = get_last_metrics()
+        for name, m in linearize_metrics(entries).items():
+            run.metric_summaries.update(name, m["steps"], m["values"])
+        return entries
+
+    run._metrics.get_last_metrics = get_last_metrics_and_summarize
+
+    # observers are not thread safe, never write from two threads at once
+    heartbeat_lock = threading.Lock()
+    emit_heartbeat = run._emit_heartbeat
+
+    def _emit_heartbeat():
+        with heartbeat_lock:
+            # arrays go out before the scalars and the heartbeat of the same beat
+            run.array_metrics.emit()
+            emit_heartbeat()
+
+    def flush_metrics():
+        # write what the policies held back, the pending arrays and the
+        # queued scalars with a heartbeat from the main thread, sacred only
+        # gives its final heartbeat a couple of seconds before it emits
+        # completed and observers drop metrics that arrive later
+        for name, (steps, values) in run.metric_policies.finish().items():
+            run.array_metrics.log_array(name, values, steps)
+        _emit_heartbeat()
+
+    run._emit_heartbeat = _emit_heartbeat
+    run.flush_metrics = flush_metrics
+
+    if blob_store is not None:
+        for observer in run.observers:
+            if hasattr(observer, "save_file"):
+                use_blob_store(observer, blob_store)
+
+    add_artifact = run.add_artifact
+
+    def add_artifact_locked(filename, name=None, metadata=None, content_type=None):
+        # the observers save run.json here, as they do in the heartbeat
+        with heartbeat_lock:
+            add_artifact(filename, name, metadata, content_type)
+
+    run.artifact_uploader = ArtifactUploader(add_artifact_locked, store=blob_store)
+
+    def add_artifact_maybe_in_background(
+        filename, name=None, metadata=None, content_type=None, background=None
+    ):
+        if background is None:
+            background = async_artifacts
+        if background:
+            run.artifact_uploader.submit(filename, name, metadata, content_type)
+        else:
+            add_artifact(filename, name, metadata, content_type)
+
+    run.add_artifact = add_artifact_maybe_in_background
+    run.wait_artifacts = run.artifact_uploader.wait
+    return run
@@ -1,20 +1,56 @@
-from .globals import AUTH_FILE, RUNS_DIR, FILE_STORAGE_ROOT
+from .globals import (
+    AUTH_FILE,
+    RUNS_DIR,
+    FILE_STORAGE_ROOT,
+    MONGO_JOURNAL_DIR,
+    MONGO_FLUSH_INTERVAL,
+    MONGO_MAX_BATCH,
+    METRIC_POLICIES,
+    BLOBS_DIR,
+    CAPTURE_LIMIT,
+)
 from .git_utils import get_repo
+from .mongodb_utils import get_mongo_client, mongo_url_from_auth
 
 from sacred import Experiment, SETTINGS
-import pymongo
+from sacred.observers import FileStorageObserver
+import sacred
 import traceback
-from sacred.observers import MongoObserver, FileStorageObserver
+from .run_utils import extend_run
+from .summary_utils import append_summary, make_summary_row, summary_file
+from .observers import (
+    BufferedMongoObserver,
+    FlatFileStorageObserver,
+    MetricsLogFileStorageObserver,
+    ShardedFileStorageObserver,
+    ShardedMetricsLogFileStorageObserver,
+)
+from .layout_utils import run_shard
+from .blob_utils import BlobStore
+from .capture_utils import (
+    CAPTURE_MODES,
+    SACRED_CAPTURE_MODES,
+    ring_capture_run,
+    compress_cout,
+)
+from .profile_utils import call_profiled, render_adapter_flamegraph
+from .resource_utils import record_resources
+from .memprofile_utils import call_memprofiled
+from .trace_utils import trace_span, record_span
+from contextlib import nullcontext
 from sacred.utils import apply_backspaces_and_linefeeds
 import importlib
+import time
 import json
 import sys
 import os
-import cProfile
-import subprocess
 
 SETTINGS.CAPTURE_MODE = "sys"
 
+# private sacred attributes sorcerun relies on, checked by create_run
+SACRED_RUN_INTERNALS = ["_emit_heartbeat", "_safe_call", "_metrics"]
+SACRED_OBSERVER_INTERNALS = ["_make_run_dir"]
+
 
 def load_python_module(python_file, force_reload=False):
     file_dir = os.path.dirname(os.path.abspath(python_file))
@@ -29,14 +65,7 @@ def load_python_module(python_file, force_reload=False):
     return module
 
 
-def run_sacred_experiment(
-    adapter_func,
-    config,
-    auth_path=AUTH_FILE,
-    use_mongo=True,
-    file_storage_root=FILE_STORAGE_ROOT,
-    profile=True,
-):
+def resolve_file_storage_root(file_storage_root):
     # if file_storage_root is not an absolute path, prefix the current git repo root
     if not os.path.isabs(file_storage_root):
         repo = get_repo()
@@ -47,6 +76,36 @@ def run_sacred_experiment(
             file_storage_root = os.path.join(os.getcwd(), file_storage_root)
         else:
             file_storage_root = os.path.join(repo.working_dir, file_storage_root)
+    return file_storage_root
+
+
+def run_sacred_experiment(
+    adapter_func,
+    config,
+    auth_path=AUTH_FILE,
+    use_mongo=True,
+    file_storage_root=FILE_STORAGE_ROOT,
+    profile=True,
+    runs_dir=None,
+    memprofile=False,
+    mongo_flush_interval=MONGO_FLUSH_INTERVAL,
+    mongo_max_batch=MONGO_MAX_BATCH,
+    metrics_log=None,
+    sharded=None,
+):
+    """Run *adapter_func* on *config* as a sacred experiment, stored in
+    ``<file_storage_root>/runs`` (or *runs_dir*) and, with *use_mongo*, in
+    mongo. Returns the sacred Run.
+
+    The other arguments and the adapter attributes that change how runs are
+    stored, profiled and captured are documented where they are used:
+    observers (mongo flushing), metrics_utils (*metrics_log*, metric
+    policies), layout_utils (*sharded*), blob_utils (artifacts),
+    capture_utils, profile_utils (*profile*), memprofile_utils (*memprofile*)
+    and resource_utils.
+    """
+    setup_start = time.time()
+    file_storage_root = resolve_file_storage_root(file_storage_root)
 
     experiment_name = getattr(adapter_func, "experiment_name", "sorcerun_experiment")
     ex = Experiment(experiment_name, save_git_info=False)
@@ -58,21 +117,15 @@ def run_sacred_experiment(
             with open(auth_path, "r") as f:
                 auth_data = json.load(f)
 
-            atlas = auth_data.get("atlas_connection_string", 0)
-            url = (
-                (
-                    atlas
-                    if atlas != 0
-                    else f"mongodb://{auth_data['client_kwargs']['username']}:{auth_data['client_kwargs']['password']}@{auth_data['client_kwargs']['host']}:{auth_data['client_kwargs']['port']}"
-                ),
-            )
+            url = mongo_url_from_auth(auth_data)
             try:
-                client = pymongo.MongoClient(url)
-                client.server_info()
-                observer = MongoObserver(
-                    # url=url,
+                client = get_mongo_client(url)
+                observer = BufferedMongoObserver(
                     client=client,
                     db_name=auth_data["db_name"],
+                    journal_dir=os.path.join(file_storage_root, MONGO_JOURNAL_DIR),
+                    flush_interval=mongo_flush_interval,
+                    max_batch=mongo_max_batch,
                 )
 
                 ex.observers.append(observer)
@@ -88,49 +141,198 @@ def run_sacred_experiment(
     else:
         print("WARNING: Not using mongo observer (use_mongo=False was passed)")
 
-    runs_dir = os.path.join(file_storage_root, RUNS_DIR)
+    if runs_dir is None:
+        runs_dir = os.path.join(file_storage_root, RUNS_DIR)
     os.makedirs(runs_dir, exist_ok=True)
-    ex.observers.append(FileStorageObserver.create(runs_dir))
+    if metrics_log is None:
+        metrics_log = getattr(adapter_func, "metrics_log", False)
+    if sharded is None:
+        sharded = getattr(adapter_func, "sharded_runs", False)
+    if sharded:
+        file_observer = (
+            ShardedMetricsLogFileStorageObserver
+            if metrics_log
+            else ShardedFileStorageObserver
+        )(runs_dir, shard=run_shard(config))
+    else:
+        file_observer = (
+            MetricsLogFileStorageObserver if metrics_log else FlatFileStorageObserver
+        )(runs_dir)
+    for observer in ex.observers:
+        if isinstance(observer, BufferedMongoObserver):
+            # large output is left to the run directory
+            observer.file_observer = file_observer
+    ex.observers.append(file_observer)
     ex.add_config(config)
 
     @ex.main
     def run_experiment(_config, _run):
         _run.info["info"] = "info-entry"
-        if profile:
-            with cProfile.Profile() as pr:
-                result = adapter_func(_config, _run)
-                pr.dump_stats(f"{runs_dir}/{_run._id}/profile.prof")
-
-            # generate flamegraph using flameprof and flamegraph.pl
-            try:
-                subprocess.run(
-                    f"flameprof --format=log {runs_dir}/{_run._id}/profile.prof "
-                    + f"| flamegraph.pl > {runs_dir}/{_run._id}/profile.svg",
-                    shell=True,
-                )
-            except Exception as e:
-                traceback.print_exc()
-                print(
-                    f"WARNING: Failed to generate flamegraph with above exception."
-                    + " Not generating flamegraph"
-                )
-        else:
-            result = adapter_func(_config, _run)
+        try:
+            result = call_adapter(
+                adapter_func, _config, _run, file_observer.dir, profile, memprofile
+            )
+        finally:
+            with trace_span("flush"):
+                _run.wait_artifacts()
+                _run.flush_metrics()
         return result
 
-    r = ex.run()
+    r = create_run(ex)
+    extend_run(
+        r,
+        metric_policies=metric_policies_for(adapter_func, config),
+        **artifact_options_for(adapter_func, file_storage_root),
+    )
+    capture_mode, capture_limit = capture_options_for(adapter_func)
+    r.capture_mode = SACRED_CAPTURE_MODES[capture_mode]
+    capture = nullcontext()
+    if capture_mode == "ring":
+        capture = ring_capture_run(r, capture_limit)
+    record_span("setup", setup_start)
+    try:
+        with capture, trace_span("run"):
+            r()
+    finally:
+        finalize_start = time.time()
+        if file_observer.dir is not None:
+            compress_cout(file_observer.dir)
+
+    append_grid_summary(r, config, file_storage_root)
+    record_span("finalize", finalize_start)
+    return r
+
+
+def create_run(ex):
+    """Create the sacred Run of *ex* without starting it, after checking that
+    sacred has the private attributes sorcerun builds on (see setup.py for
+    the supported versions)."""
+    missing = [a for a in ["_create_run"] if not hasattr(ex, a)]
+    missing += [
+        f"FileStorageObserver.{a}"
+        for a in SACRED_OBSERVER_INTERNALS
+        if not hasattr(FileStorageObserver, a)
+    ]
+    r = None if missing else ex._create_run()
+    if r is not None:
+        missing += [f"Run.{a}" for a in SACRED_RUN_INTERNALS if not hasattr(r, a)]
+        if not hasattr(getattr(r, "_metrics", None), "_metric_step_counter"):
+            missing.append("MetricsLogger._metric_step_counter")
+    if missing:
+        raise RuntimeError(
+            f"sorcerun does not support sacred {sacred.__version__}, it lacks "
+            + ", ".join(missing)
+            + ". Install a sacred version supported by sorcerun (see setup.py)."
+        )
     return r
 
 
+def metric_policies_for(adapter_func, config):
+    # logging policies from the adapter, overridden per metric by the config
+    metric_policies = dict(getattr(adapter_func, METRIC_POLICIES, {}))
+    metric_policies.update(config.get(METRIC_POLICIES, {}))
+    return metric_policies
+
+
+def artifact_options_for(adapter_func, file_storage_root):
+    # adapter.blob_artifacts stores artifacts once in file_storage/blobs,
+    # adapter.async_artifacts adds them in the background
+    blob_store = None
+    if getattr(adapter_func, "blob_artifacts", False):
+        blob_store = BlobStore(os.path.join(file_storage_root, BLOBS_DIR))
+    return {
+        "blob_store": blob_store,
+        "async_artifacts": getattr(adapter_func, "async_artifacts", False),
+    }
+
+
+def capture_options_for(adapter_func):
+    # adapter.capture_mode is one of CAPTURE_MODES, adapter.capture_limit
+    # the number of characters kept in ring mode
+    capture_mode = getattr(adapter_func, "capture_mode", "sys")
+    if capture_mode not in CAPTURE_MODES:
+        raise ValueError(
+            f"Unknown capture_mode {capture_mode}, choose from {CAPTURE_MODES}"
+        )
+    return capture_mode, getattr(adapter_func, "capture_limit", CAPTURE_LIMIT)
+
+
+def append_grid_summary(run, config, file_storage_root):
+    grid_id = config.get("grid_id")
+    if isinstance(grid_id, str):
+        append_summary(
+            summary_file(file_storage_root, grid_id), make_summary_row(run, config)
+        )
+    elif grid_id is not None:
+        # grid configs are normalized by load_grid_configs, not these
+        print(
+            f"WARNING: grid_id {grid_id!r} is not a string, run {run._id} is not"
+            + " added to a grid summary table"
+        )
+
+
+def call_adapter(adapter_func, config, run, run_dir, profile, memprofile=False):
+    """Call the adapter, profiling the call into *run_dir* if *profile* and
+    the adapter's profiler settings ask for it (see profile_utils), tracing
+    its allocations if *memprofile* (see memprofile_utils) and recording the
+    resources it uses (see resource_utils). The phase timers of the run are
+    logged when the adapter returns (see run_utils.PhaseTimers)."""
+
+    def call(config, run):
+        t0 = time.perf_counter()
+        try:
+            if memprofile:
+                return call_memprofiled(adapter_func, config, run, run_dir)
+            return adapter_func(config, run)
+        finally:
+            run.phase_timers.log(run, time.perf_counter() - t0)
+
+    with trace_span("adapter"):
+        try:
+            # the monitor's sampling stays out of the profile, and rendering
+            # the flamegraph out of the recorded resources
+            with record_resources(run, adapter_func):
+                if not profile:
+                    return call(config, run)
+                return call_profiled(
+                    adapter_func, config, run, run_dir, call=call, render=False
+                )
+        finally:
+            if profile:
+                render_adapter_flamegraph(adapter_func, config, run_dir)
+
+
 class DummyRun:
-    def __init__(self):
-        pass
+    """Stands in for a sacred Run, dropping everything logged to it."""
+
+    def __init__(self, config=None, _id=None):
+        self.config = {} if config is None else config
+        self._id = _id
+        self.info = {}
+        self.meta_info = {}
 
     def to_dict(self):
         pass
 
+    def open_resource(self, filename, mode="r"):
+        return open(filename, mode)
+
+    def add_resource(self, filename):
+        pass
+
     def log_scalar(self, key, value, step=0):
         pass
 
-    def add_artifact(self, filename, name):
+    def log_array(self, name, values, steps=None):
+        pass
+
+    def add_artifact(
+        self, filename, name=None, metadata=None, content_type=None, background=None
+    ):
         pass
+
+    def wait_artifacts(self):
+        pass
+
+    def timer(self, phase):
+        return nullcontext()
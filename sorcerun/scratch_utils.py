@@ -0,0 +1,282 @@
+from .globals import RUNS_DIR, SCRATCH_PREFIX, RUN_ID_COUNTER_FILE, RUN_ID_BLOCK
+from .layout_utils import SPECIAL_DIRS, is_run_dir, archived_max_run_id
+from contextlib import contextmanager
+import os
+import json
+import fcntl
+import shutil
+import signal
+import atexit
+import tempfile
+import platform
+
+MANIFEST_FILE = "sorcerun_manifest.json"
+STAGED_IDS_FILE = "run_ids.json"
+
+
+def _max_run_id(runs_dir):
+    ids = [int(d) for d in os.listdir(runs_dir) if d.isdigit()]
+    return max(ids + [archived_max_run_id(runs_dir)])
+
+
+def staged_target(runs_dir):
+    """The runs directory that the runs staged in *runs_dir* by a
+    ScratchStager will be moved to, or None if *runs_dir* is not staged."""
+    manifest = os.path.join(os.path.dirname(os.path.abspath(runs_dir)), MANIFEST_FILE)
+    try:
+        with open(manifest, "r") as f:
+            return json.load(f)["runs_dir"]
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def final_run_dir(runs_dir, run_dir):
+    """Where *run_dir* in *runs_dir* ends up, once moved off scratch if it
+    is staged there."""
+    target = staged_target(runs_dir)
+    if target is None:
+        return run_dir
+    return os.path.join(target, os.path.relpath(run_dir, runs_dir))
+
+
+@contextmanager
+def _locked_counter(path):
+    """Lock the json counter file at *path* and yield its content as a dict,
+    which is written back when the context exits."""
+    with open(path, "a+") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            f.seek(0)
+            try:
+                counter = json.loads(f.read())
+            except ValueError:
+                counter = {}
+            yield counter
+            f.seek(0)
+            f.truncate()
+            json.dump(counter, f)
+            f.flush()
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def reserve_run_ids(runs_dir, n=1):
+    """Reserve *n* consecutive flat run ids in *runs_dir* and return the
+    first. Reserved ids are never handed out again, whether or not a run
+    directory is made for them."""
+    os.makedirs(runs_dir, exist_ok=True)
+    with _locked_counter(os.path.join(runs_dir, RUN_ID_COUNTER_FILE)) as counter:
+        # runs made without the counter (or before it existed) are skipped
+        first = max(counter.get("next", 1), _max_run_id(runs_dir) + 1)
+        counter["next"] = first + n
+    return first
+
+
+def make_flat_run_dir(runs_dir, _id=None):
+    """Create a flat run directory in *runs_dir* with the next free id, or
+    *_id* if given, and return the id.
+
+    If *runs_dir* is staged on scratch, the id is taken from a block of
+    RUN_ID_BLOCK ids that the stager reserved in the runs directory the run
+    will be moved to, so the run keeps its id (and everything that refers to
+    it stays valid) while the shared runs directory is only touched once per
+    block.
+    """
+    os.makedirs(runs_dir, exist_ok=True)
+    given = _id is not None
+    target = staged_target(runs_dir)
+    if not given:
+        if target is None:
+            _id = reserve_run_ids(runs_dir)
+        else:
+            stage_dir = os.path.dirname(os.path.abspath(runs_dir))
+            ids_file = os.path.join(stage_dir, STAGED_IDS_FILE)
+            with _locked_counter(ids_file) as block:
+                if block.get("next", 0) >= block.get("end", 0):
+                    block["next"] = reserve_run_ids(target, RUN_ID_BLOCK)
+                    block["end"] = block["next"] + RUN_ID_BLOCK
+                _id = block["next"]
+                block["next"] += 1
+    while True:
+        try:
+            os.mkdir(os.path.join(runs_dir, str(_id)))
+            return _id
+        except FileExistsError:
+            # a run made without the counter since we reserved
+            if given or target is not None:
+                raise
+            _id = reserve_run_ids(runs_dir)
+
+
+def _mark_interrupted(run_dir):
+    run_json = os.path.join(run_dir, "run.json")
+    try:
+        with open(run_json, "r") as f:
+            run_entry = json.load(f)
+    except (IOError, ValueError):
+        return
+    if run_entry.get("status") in ("RUNNING", "QUEUED"):
+        run_entry["status"] = "INTERRUPTED"
+        with open(run_json, "w") as f:
+            json.dump(run_entry, f, sort_keys=True, indent=2)
+
+
+def move_staged_runs(src_runs_dir, dst_runs_dir, interrupted=False):
+    """Move every run directory in *src_runs_dir* into *dst_runs_dir*.
+
+    Runs keep their ids: sharded run names are unique, and flat ids are
+    reserved in *dst_runs_dir* by make_flat_run_dir. Flat runs whose id is
+    taken there anyway (e.g. staged by an older sorcerun) get fresh ids. The
+    shared ``_sources``/``_resources`` files are copied over if they are not
+    there yet. If *interrupted* is True, runs that
+    were still running are marked as INTERRUPTED.
+
+    Returns the list of (old_id, new_id) pairs that were moved.
+    """
+    if not os.path.isdir(src_runs_dir):
+        return []
+    os.makedirs(dst_runs_dir, exist_ok=True)
+
+    for special in SPECIAL_DIRS:
+        src = os.path.join(src_runs_dir, special)
+        if not os.path.isdir(src):
+            continue
+        dst = os.path.join(dst_runs_dir, special)
+        os.makedirs(dst, exist_ok=True)
+        for name in os.listdir(src):
+            if not os.path.exists(os.path.join(dst, name)):
+                shutil.copy2(os.path.join(src, name), os.path.join(dst, name))
+
+    names = sorted(
+        (n for n in os.listdir(src_runs_dir) if n not in SPECIAL_DIRS),
+        key=lambda n: (not n.isdigit(), int(n) if n.isdigit() else n),
+    )
+    moved = []
+
+    # shards of the sharded layout, run names are unique so keep them
+    shards = [n for n in names if not is_run_dir(os.path.join(src_runs_dir, n))]
+    names = [n for n in names if n not in shards]
+    for shard in shards:
+        os.makedirs(os.path.join(dst_runs_dir, shard), exist_ok=True)
+        for name in os.listdir(os.path.join(src_runs_dir, shard)):
+            run_id = f"{shard}/{name}"
+            src = os.path.join(src_runs_dir, run_id)
+            if interrupted:
+                _mark_interrupted(src)
+            shutil.move(src, os.path.join(dst_runs_dir, run_id))
+            moved.append((run_id, run_id))
+        shutil.rmtree(os.path.join(src_runs_dir, shard))
+
+    for name in names:
+        src = os.path.join(src_runs_dir, name)
+        if interrupted:
+            _mark_interrupted(src)
+
+        dst = os.path.join(dst_runs_dir, name)
+        try:
+            os.mkdir(dst)
+        except FileExistsError:
+            # empty directories are reservations of older sorcerun versions
+            if os.listdir(dst):
+                dst = os.path.join(dst_runs_dir, str(reserve_run_ids(dst_runs_dir)))
+                os.mkdir(dst)
+
+        for child in os.listdir(src):
+            shutil.move(os.path.join(src, child), os.path.join(dst, child))
+        shutil.rmtree(src)
+        moved.append((name, os.path.basename(dst)))
+    return moved
+
+
+class ScratchStager:
+    """Stage run directories on node-local scratch and move them to *runs_dir*.
+
+    Observers write to ``scratch_runs_dir`` while runs execute, which keeps the
+    heartbeat rewrites of run.json/metrics.json off the shared filesystem. The
+    staged runs are moved to *runs_dir* in one go when the context exits, when
+    the process gets SIGTERM (as slurm sends before killing a job), or at
+    interpreter exit. Anything left behind after a hard kill can be moved with
+    ``recover_scratch``.
+    """
+
+    def __init__(self, runs_dir, scratch_root=None):
+        self.runs_dir = os.path.abspath(runs_dir)
+        if scratch_root is None:
+            scratch_root = os.environ.get("TMPDIR") or tempfile.gettempdir()
+        os.makedirs(scratch_root, exist_ok=True)
+        self.stage_dir = tempfile.mkdtemp(prefix=SCRATCH_PREFIX, dir=scratch_root)
+        self.scratch_runs_dir = os.path.join(self.stage_dir, RUNS_DIR)
+        os.makedirs(self.scratch_runs_dir)
+
+        # remember where these runs belong, for recover_scratch
+        self.pid = os.getpid()
+        with open(os.path.join(self.stage_dir, MANIFEST_FILE), "w") as f:
+            json.dump(
+                {"runs_dir": self.runs_dir, "host": platform.node(), "pid": self.pid},
+                f,
+            )
+        self._old_sigterm = None
+
+    def flush(self, interrupted=False):
+        # forked workers inherit our handlers, only the owner moves runs
+        if os.getpid() != self.pid or not os.path.isdir(self.stage_dir):
+            return
+        moved = move_staged_runs(
+            self.scratch_runs_dir, self.runs_dir, interrupted=interrupted
+        )
+        if moved:
+            print(f"Moved {len(moved)} runs from {self.stage_dir} to {self.runs_dir}")
+        shutil.rmtree(self.stage_dir, ignore_errors=True)
+
+    def _on_sigterm(self, signum, frame):
+        self.flush(interrupted=True)
+        signal.signal(signal.SIGTERM, self._old_sigterm or signal.SIG_DFL)
+        os.kill(os.getpid(), signum)
+
+    def __enter__(self):
+        self._old_sigterm = signal.signal(signal.SIGTERM, self._on_sigterm)
+        atexit.register(self.flush, interrupted=True)
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        signal.signal(signal.SIGTERM, self._old_sigterm or signal.SIG_DFL)
+        atexit.unregister(self.flush)
+        self.flush(interrupted=exc_type is not None)
+
+
+def _is_alive(manifest):
+    if manifest.get("host") != platform.node():
+        return False
+    try:
+        os.kill(manifest["pid"], 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def recover_scratch(scratch_root=None):
+    """Move runs left in staging directories under *scratch_root* (e.g. by a
+    job that was killed with SIGKILL) to the runs directory they belong to."""
+    if scratch_root is None:
+        scratch_root = os.environ.get("TMPDIR") or tempfile.gettempdir()
+    recovered = 0
+    for name in os.listdir(scratch_root):
+        stage_dir = os.path.join(scratch_root, name)
+        manifest = os.path.join(stage_dir, MANIFEST_FILE)
+        if not name.startswith(SCRATCH_PREFIX) or not os.path.exists(manifest):
+            continue
+        with open(manifest, "r") as f:
+            manifest = json.load(f)
+        if _is_alive(manifest):
+            print(f"Skipping {stage_dir}, its process {manifest['pid']} is alive")
+            continue
+        runs_dir = manifest["runs_dir"]
+        moved = move_staged_runs(
+            os.path.join(stage_dir, RUNS_DIR), runs_dir, interrupted=True
+        )
+        print(f"Recovered {len(moved)} runs from {stage_dir} to {runs_dir}")
+        recovered += len(moved)
+        shutil.rmtree(stage_dir, ignore_errors=True)
+    return recovered
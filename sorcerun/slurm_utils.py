@@ -1,8 +1,26 @@
+import os
+import copy
 import subprocess
 from collections import OrderedDict
 from prettytable import PrettyTable
 import time
 from tqdm import tqdm
+from .globals import SACCT_COMMAND, SACCT_CHUNK_SIZE, SLURM_DEPENDENCY_CHUNK
+from .stats_utils import parse_elapsed
+
+# states after which a job will never change state again
+TERMINAL_STATES = {
+    "COMPLETED",
+    "FAILED",
+    "CANCELLED",
+    "TIMEOUT",
+    "OUT_OF_MEMORY",
+    "NODE_FAIL",
+    "PREEMPTED",
+    "BOOT_FAIL",
+    "DEADLINE",
+    "REVOKED",
+}
 
 
 class Job:
@@ -13,6 +31,8 @@ class Job:
         self.job_id = job_id
         self.job_state = None
         self.duration = None
+        # per task (state, elapsed) if this is an array job
+        self.tasks = {}
 
     def __str__(self):
         return f"Job {self.job_id} is {self.job_state} for {self.duration}"
@@ -20,19 +40,151 @@ class Job:
     def __repr__(self):
         return str(self)
 
+    @property
+    def finished(self):
+        return self.job_state in TERMINAL_STATES
+
     def update(self):
-        # Get the job state
-        cmd = f"sacct -j {self.job_id} -o state,elapsed --noheader"
-        print(cmd)
-        out = subprocess.check_output(cmd, shell=True).decode("utf-8").strip()
-        self.job_state, self.duration = out.split()
+        update_jobs([self])
+
 
+def submit_slurm_command(slurm, command):
+    """Submit *command* with the sbatch arguments of *slurm* and return the job id.
 
-def update_jobs(jobs):
-    cmd = f"sacct -j {','.join([str(j.job_id) for j in jobs])} -o state,elapsed --noheader"
+    The command is only added to *slurm* for the duration of the submission,
+    so the same Slurm object can be reused for many jobs.
+    """
+    slurm.add_cmd(command)
+    print(f"sbatch content:")
+    print(slurm)
+
+    cmd = "\n".join(
+        (
+            "sbatch" + " << EOF",
+            slurm.script(shell="/bin/sh", convert=True),
+            "EOF",
+        )
+    )
+    slurm.run_cmds = slurm.run_cmds[:-1]
+
+    # run the command and get the output
     out = subprocess.check_output(cmd, shell=True).decode("utf-8").strip()
-    for job, line in zip(jobs, out.split("\n")):
-        job.job_state, job.duration = line.split()
+
+    # extract slurm job id from out
+    return int(out.split()[-1])
+
+
+def submit_after_jobs(slurm, command, job_ids, chunk=SLURM_DEPENDENCY_CHUNK):
+    """Submit *command* with the sbatch arguments of *slurm* to run once all
+    *job_ids* have ended, and return its job id.
+
+    sbatch limits the length of --dependency, so more than *chunk* job ids
+    are waited for by barrier jobs (running ``true``) of *chunk* ids each,
+    and the command waits for the barriers.
+    """
+    job_ids = [str(j) for j in job_ids]
+    while len(job_ids) > chunk:
+        job_ids = [
+            _submit_after(slurm, "true", job_ids[i : i + chunk])
+            for i in range(0, len(job_ids), chunk)
+        ]
+    return _submit_after(slurm, command, job_ids)
+
+
+def _submit_after(slurm, command, job_ids):
+    slurm = copy.deepcopy(slurm)
+    slurm.add_arguments(dependency="afterany:" + ":".join(map(str, job_ids)))
+    return submit_slurm_command(slurm, command)
+
+
+def sacct_command():
+    """The sacct executable to query, overridable with $SORCERUN_SACCT (e.g. a fake
+    sacct script for testing)."""
+    return os.environ.get("SORCERUN_SACCT", SACCT_COMMAND)
+
+
+def query_sacct(job_ids):
+    """Query sacct for *job_ids* and return a dict {job_id: (state, elapsed)}.
+
+    Job steps (``123.batch``, ``123.extern``, ...) are dropped, and states like
+    ``CANCELLED by 1000`` are normalized to ``CANCELLED``. Array tasks are
+    keyed by their own id, e.g. ``123_4`` or ``123_[5-9]`` while pending.
+    """
+    cmd = [
+        sacct_command(),
+        "-j",
+        ",".join(str(j) for j in job_ids),
+        "-o",
+        "JobID,State,Elapsed",
+        "--noheader",
+        "--parsable2",
+        "-X",
+    ]
+    out = subprocess.check_output(cmd).decode("utf-8")
+    states = {}
+    for line in out.splitlines():
+        parts = line.strip().split("|")
+        if len(parts) < 3 or "." in parts[0]:
+            continue
+        job_id, state, elapsed = parts[:3]
+        states[job_id] = (state.split()[0] if state else "UNKNOWN", elapsed)
+    return states
+
+
+def elapsed_seconds(elapsed):
+    """Seconds of a sacct Elapsed string, 0 if it cannot be parsed."""
+    try:
+        return parse_elapsed(elapsed) if elapsed else 0.0
+    except ValueError:
+        return 0.0
+
+
+def aggregate_array_state(tasks):
+    """Collapse the (state, elapsed) of array tasks into a single (state, elapsed)."""
+    task_states = [state for state, _ in tasks.values()]
+    # as strings "23:59:59" > "1-00:00:00"
+    elapsed = max((e for _, e in tasks.values()), key=elapsed_seconds)
+    unfinished = [s for s in task_states if s not in TERMINAL_STATES]
+    if unfinished:
+        state = "RUNNING" if "RUNNING" in unfinished else unfinished[0]
+    elif all(s == "COMPLETED" for s in task_states):
+        state = "COMPLETED"
+    else:
+        state = next(s for s in task_states if s != "COMPLETED")
+    return state, elapsed
+
+
+def update_jobs(jobs, chunk_size=SACCT_CHUNK_SIZE):
+    """Update the states of unfinished *jobs* in place.
+
+    sacct is called once per chunk of *chunk_size* job ids, so the command line
+    stays bounded, and jobs in a terminal state are not queried again. A job id
+    that is an array job collects the states of all its tasks.
+
+    Returns the number of jobs whose state changed.
+    """
+    unfinished = [j for j in jobs if not j.finished]
+    changed = 0
+    for i in range(0, len(unfinished), chunk_size):
+        chunk = unfinished[i : i + chunk_size]
+        states = query_sacct([j.job_id for j in chunk])
+
+        # group array tasks by their parent job id
+        by_parent = {}
+        for job_id, state in states.items():
+            if "_" in job_id:
+                by_parent.setdefault(job_id.split("_")[0], {})[job_id] = state
+
+        for job in chunk:
+            key = str(job.job_id)
+            old = job.job_state
+            if key in states:
+                job.job_state, job.duration = states[key]
+            elif key in by_parent:
+                job.tasks = by_parent[key]
+                job.job_state, job.duration = aggregate_array_state(job.tasks)
+            changed += job.job_state != old
+    return changed
 
 
 def aggregate_states(jobs):
@@ -48,12 +200,32 @@ def aggregate_states(jobs):
     return states
 
 
-def poll_jobs(jobs, poll_interval=10):
+def poll_jobs(
+    jobs,
+    poll_interval=10,
+    max_poll_interval=300,
+    backoff=1.5,
+    chunk_size=SACCT_CHUNK_SIZE,
+    stats=None,
+    max_unknown_polls=20,
+    timeout=None,
+):
+    """Block until every job in *jobs* has reached a terminal state.
+
+    The poll interval starts at *poll_interval* and grows by a factor of
+    *backoff* (up to *max_poll_interval*) every time a poll sees no state
+    change, and is reset as soon as something changes. Job states are passed
+    on to the GridStats *stats* after every poll.
+
+    Jobs that sacct has not reported in *max_unknown_polls* polls in a row
+    are given up on once no other job is unfinished, and polling stops after
+    *timeout* seconds if given. Returns the jobs that did not finish.
+    """
     total = len(jobs)
-    print(f"Polling {total} jobs every {poll_interval} seconds\n")
+    print(f"Polling {total} jobs starting every {poll_interval} seconds\n")
 
     bar_format = "{desc} -- {percentage:3.0f}%|{bar}| {n_fmt}/{total_fmt}"
-    update_jobs(jobs)
+    update_jobs(jobs, chunk_size=chunk_size)
     time_str = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
     launched = tqdm(
         total=total,
@@ -67,32 +239,58 @@ def poll_jobs(jobs, poll_interval=10):
         position=1,
         bar_format=bar_format,
     )
-    states = aggregate_states(jobs)
-    first_iter = True
-    while states.get("PENDING", 0) + states.get("RUNNING", 0) > 0 or first_iter:
-        first_iter = False
-        t = PrettyTable(["Job State", "Count"])
-        time_str = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
-        for state, count in states.items():
-            t.add_row([state, count])
-            launched.n = states.get("RUNNING", 0) + states.get("COMPLETED", 0)
-            launched.desc = f"Launched  @ {time_str}"
-            launched.refresh()
-            completed.n = states.get("COMPLETED", 0)
-            completed.desc = f"Completed @ {time_str}"
-            completed.refresh()
-        t.align = "l"
-        # print("-" * 40)
-        # print(f"Job states at {time_str}")
-        # print(t)
-        # print("-" * 40)
-
-        time.sleep(poll_interval)
-
-        update_jobs(jobs)
+    interval = poll_interval
+    start = time.time()
+    unknown_polls = {}
+    while True:
+        if stats is not None:
+            stats.set_jobs(jobs)
+            stats.write()
         states = aggregate_states(jobs)
+        n_finished = sum(job.finished for job in jobs)
+        time_str = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
+        launched.n = states.get("RUNNING", 0) + n_finished
+        launched.desc = f"Launched  @ {time_str}"
+        launched.refresh()
+        completed.n = states.get("COMPLETED", 0)
+        completed.desc = f"Completed @ {time_str}"
+        completed.refresh()
+
+        unfinished = [job for job in jobs if not job.finished]
+        if all(unknown_polls.get(j.job_id, 0) >= max_unknown_polls for j in unfinished):
+            break
+        if timeout is not None and time.time() - start > timeout:
+            break
+
+        time.sleep(interval)
+
+        changed = update_jobs(jobs, chunk_size=chunk_size)
+        for job in jobs:
+            unknown = job.job_state is None
+            unknown_polls[job.job_id] = (
+                unknown_polls.get(job.job_id, 0) + 1 if unknown else 0
+            )
+        interval = (
+            poll_interval if changed else min(interval * backoff, max_poll_interval)
+        )
 
     launched.close()
     completed.close()
 
-    print("All jobs have finished")
+    t = PrettyTable(["Job State", "Count"])
+    for state, count in aggregate_states(jobs).items():
+        t.add_row([state, count])
+    t.align = "l"
+    print(t)
+
+    if unfinished:
+        missing = [j for j in unfinished if j.job_state is None]
+        if missing:
+            print(
+                f"WARNING: {len(missing)} jobs never showed up in sacct: "
+                + " ".join(str(j.job_id) for j in missing)
+            )
+        print(f"WARNING: Stopped polling with {len(unfinished)} unfinished jobs")
+    else:
+        print("All jobs have finished")
+    return unfinished
@@ -0,0 +1,354 @@
+from .globals import STATS_FILE, STATS_INTERVAL, STATS_POLL, STATS_RECENT
+from contextlib import contextmanager
+from collections import deque
+import numpy as np
+import threading
+import datetime
+import psutil
+import time
+import os
+
+# Live stats of a running grid in the OpenMetrics text format, rewritten every
+# STATS_INTERVAL seconds to grid_outputs/<grid_id>/stats.prom. Tasks are
+# configs for grid_run and Slurm jobs for grid_slurm --wait.
+PREFIX = "sorcerun_grid_"
+
+QUANTILES = [0.5, 0.9, 0.99]
+
+
+def worker_rss():
+    """{pid: rss in bytes} of the worker processes of this process (with
+    their children), or of this process if it has none."""
+    me = psutil.Process()
+    rss = {}
+    try:
+        workers = me.children()
+    except psutil.Error:
+        workers = []
+    for worker in workers or [me]:
+        try:
+            procs = [worker] + (worker.children(recursive=True) if workers else [])
+            rss[worker.pid] = sum(p.memory_info().rss for p in procs)
+        except psutil.Error:
+            continue
+    return rss
+
+
+def _number(value):
+    value = float(value)
+    return "NaN" if np.isnan(value) else repr(value)
+
+
+def parse_elapsed(elapsed):
+    """Seconds of a Slurm elapsed time like ``1-02:03:04`` or ``03:04.5``."""
+    days = 0
+    if "-" in elapsed:
+        d, elapsed = elapsed.split("-", 1)
+        days = int(d)
+    seconds = 0.0
+    for part in elapsed.split(":"):
+        seconds = 60 * seconds + float(part)
+    return 86400 * days + seconds
+
+
+class GridStats:
+    """Counts, throughput, ETA, worker memory and recent task durations of a
+    running grid, written to *out_dir*/stats.prom.
+
+    Report tasks with task_started and task_done, or set the running tasks
+    with a *poll* function that returns their ids, which is called every
+    STATS_POLL seconds.
+    """
+
+    def __init__(
+        self,
+        out_dir,
+        grid,
+        total,
+        n_workers=1,
+        interval=STATS_INTERVAL,
+        poll=None,
+        rss=worker_rss,
+    ):
+        self.path = os.path.join(out_dir, STATS_FILE)
+        os.makedirs(out_dir, exist_ok=True)
+        self.grid = grid
+        self.total = total
+        self.n_workers = n_workers
+        self.interval = interval
+        self.poll = poll
+        self.rss = rss
+        self.start_time = time.time()
+        self.completed = 0
+        self.failed = 0
+        self.started = {}
+        self.durations = deque(maxlen=STATS_RECENT)
+        self.finish_times = deque(maxlen=STATS_RECENT)
+        self.done = False
+        # a poll may still see a task running that was just reported done
+        self._finished = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def task_started(self, task):
+        self.set_running([task])
+
+    def task_done(self, task, failed=False, duration=None):
+        now = time.time()
+        with self._lock:
+            self._finished.add(task)
+            start = self.started.pop(task, None)
+            if duration is None and start is not None:
+                duration = now - start
+            if failed:
+                self.failed += 1
+            else:
+                self.completed += 1
+            if duration is not None:
+                self.durations.append(duration)
+            self.finish_times.append(now)
+
+    @contextmanager
+    def task(self, task):
+        """Report the task run inside this context."""
+        self.task_started(task)
+        try:
+            yield
+        except BaseException:
+            self.task_done(task, failed=True)
+            raise
+        self.task_done(task)
+
+    def set_jobs(self, jobs):
+        """Take the running and finished tasks from Slurm *jobs*."""
+        for job in jobs:
+            if job.finished and job.job_id not in self._finished:
+                try:
+                    duration = parse_elapsed(job.duration) if job.duration else None
+                except ValueError:
+                    duration = None
+                failed = job.job_state != "COMPLETED"
+                self.task_done(job.job_id, failed=failed, duration=duration)
+            elif job.job_state == "RUNNING":
+                self.task_started(job.job_id)
+
+    def set_running(self, tasks):
+        now = time.time()
+        with self._lock:
+            for task in tasks:
+                if task not in self._finished:
+                    self.started.setdefault(task, now)
+
+    def start(self):
+        self.write()
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+        return self
+
+    def _loop(self):
+        last_write = time.time()
+        step = min(STATS_POLL, self.interval) if self.poll else self.interval
+        while not self._stop.wait(step):
+            if self.poll is not None:
+                self.set_running(self.poll())
+            if time.time() - last_write >= self.interval:
+                self.write()
+                last_write = time.time()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.done = True
+        self.write()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def throughput(self):
+        """Tasks per second over the recent tasks, or since the start."""
+        with self._lock:
+            finish_times = list(self.finish_times)
+            finished = self.completed + self.failed
+        if len(finish_times) >= 2 and finish_times[-1] > finish_times[0]:
+            # the tasks that finished after the first one in the window
+            return (len(finish_times) - 1) / (finish_times[-1] - finish_times[0])
+        elapsed = time.time() - self.start_time
+        return finished / elapsed if elapsed > 0 else 0.0
+
+    def render(self):
+        now = time.time()
+        throughput = self.throughput()
+        rss = self.rss() if self.rss is not None and not self.done else {}
+        with self._lock:
+            running = 0 if self.done else len(self.started)
+            completed, failed = self.completed, self.failed
+            durations = list(self.durations)
+        pending = max(self.total - completed - failed - running, 0)
+        remaining = self.total - completed - failed
+        eta = remaining / throughput if throughput > 0 else float("nan")
+        labels = f'grid="{self.grid}"'
+
+        lines = []
+
+        def metric(name, kind, help, samples, unit=None):
+            lines.append(f"# TYPE {PREFIX}{name} {kind}")
+            if unit is not None:
+                lines.append(f"# UNIT {PREFIX}{name} {unit}")
+            lines.append(f"# HELP {PREFIX}{name} {help}")
+            for suffix, extra, value in samples:
+                all_labels = labels + "".join(f',{k}="{v}"' for k, v in extra)
+                lines.append(f"{PREFIX}{name}{suffix}{{{all_labels}}} {_number(value)}")
+
+        metric(
+            "tasks",
+            "gauge",
+            "Tasks of the grid by state.",
+            [
+                ("", [("state", state)], n)
+                for state, n in [
+                    ("completed", completed),
+                    ("failed", failed),
+                    ("running", running),
+                    ("pending", pending),
+                ]
+            ],
+        )
+        metric("size", "gauge", "Tasks in the grid.", [("", [], self.total)])
+        metric("workers", "gauge", "Workers of the grid.", [("", [], self.n_workers)])
+        metric(
+            "throughput_per_second",
+            "gauge",
+            "Tasks finished per second recently.",
+            [("", [], throughput)],
+        )
+        metric(
+            "eta_seconds",
+            "gauge",
+            "Estimated time until all tasks finished.",
+            [("", [], 0.0 if self.done else eta)],
+            unit="seconds",
+        )
+        metric(
+            "elapsed_seconds",
+            "gauge",
+            "Time since the grid started.",
+            [("", [], now - self.start_time)],
+            unit="seconds",
+        )
+        metric(
+            "worker_rss_bytes",
+            "gauge",
+            "Resident memory of every worker and its children.",
+            [("", [("worker", pid)], r) for pid, r in sorted(rss.items())],
+            unit="bytes",
+        )
+        quantiles = np.quantile(durations, QUANTILES) if durations else [np.nan] * 3
+        metric(
+            "task_duration_seconds",
+            "summary",
+            f"Durations of the last {STATS_RECENT} finished tasks.",
+            [("", [("quantile", q)], v) for q, v in zip(QUANTILES, quantiles)]
+            + [("_sum", [], float(np.sum(durations))), ("_count", [], len(durations))],
+            unit="seconds",
+        )
+        metric(
+            "last_task_duration_seconds",
+            "gauge",
+            "Duration of the last finished task.",
+            [("", [], durations[-1])] if durations else [],
+            unit="seconds",
+        )
+        metric(
+            "updated_seconds",
+            "gauge",
+            "Unix time of this update.",
+            [("", [], now)],
+            unit="seconds",
+        )
+        metric("done", "gauge", "1 once the grid finished.", [("", [], int(self.done))])
+        lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+    def write(self):
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            f.write(self.render())
+        # scrapers never see a half written file
+        os.replace(tmp, self.path)
+
+
+def parse_openmetrics(text):
+    """[(name, {label: value}, value)] of the samples in OpenMetrics *text*."""
+    samples = []
+    for line in text.splitlines():
+        if not line or line.startswith("#"):
+            continue
+        head, _, value = line.rpartition(" ")
+        name, _, labels = head.partition("{")
+        parsed = {}
+        for pair in labels.rstrip("}").split(","):
+            if "=" in pair:
+                k, v = pair.split("=", 1)
+                parsed[k] = v.strip('"')
+        samples.append((name, parsed, float(value)))
+    return samples
+
+
+def _duration(seconds):
+    if np.isnan(seconds):
+        return "-"
+    return str(datetime.timedelta(seconds=round(seconds)))
+
+
+def status_lines(samples, now=None, stale_after=3 * STATS_INTERVAL):
+    """Lines of text showing the stats of a grid, *samples* as returned by
+    parse_openmetrics."""
+    now = time.time() if now is None else now
+    values = {}
+    tasks = {}
+    rss = {}
+    quantiles = {}
+    for name, labels, value in samples:
+        name = name[len(PREFIX) :]
+        if name == "tasks":
+            tasks[labels["state"]] = int(value)
+        elif name == "worker_rss_bytes":
+            rss[labels["worker"]] = value
+        elif name == "task_duration_seconds":
+            quantiles[float(labels["quantile"])] = value
+        else:
+            values[name] = value
+
+    size = int(values.get("size", sum(tasks.values())))
+    finished = tasks.get("completed", 0) + tasks.get("failed", 0)
+    age = now - values.get("updated_seconds", now)
+    state = "finished" if values.get("done") else "running"
+    if state == "running" and age > stale_after:
+        state = "not updated, it may have died"
+    lines = [
+        f"{finished}/{size} tasks finished ({state}, updated {_duration(age)} ago)",
+        "  ".join(
+            f"{k}: {tasks.get(k, 0)}"
+            for k in ["completed", "failed", "running", "pending"]
+        ),
+        f"throughput: {values.get('throughput_per_second', 0):.3g} tasks/s"
+        f"  elapsed: {_duration(values.get('elapsed_seconds', np.nan))}"
+        f"  ETA: {_duration(values.get('eta_seconds', np.nan))}",
+    ]
+    count = int(values.get("task_duration_seconds_count", 0))
+    if count:
+        lines.append(
+            f"last {count} task durations: "
+            + "  ".join(f"p{100 * q:g} {v:.3g}s" for q, v in sorted(quantiles.items()))
+            + f"  last {values.get('last_task_duration_seconds', np.nan):.3g}s"
+        )
+    if rss:
+        lines.append(f"worker RSS (MB) of {len(rss)} workers:")
+        for worker, r in sorted(rss.items()):
+            lines.append(f"  {worker}: {r / 1024**2:.1f}")
+    return lines
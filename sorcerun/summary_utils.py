@@ -0,0 +1,201 @@
+from .globals import GRID_OUTPUTS, SUMMARY_FILE, TIMER_METRIC_PREFIX
+from .incense_utils import squish_dict, find_differing_keys
+from prettytable import PrettyTable
+import numpy as np
+import copy
+import fcntl
+import json
+import os
+
+SUMMARY_STATS = ["first", "last", "min", "argmin", "max", "argmax", "mean", "count"]
+
+
+class MetricSummaries:
+    """Running first, last, min, argmin, max, argmax, mean and count of every
+    metric."""
+
+    def __init__(self):
+        self.summaries = {}
+
+    def update(self, name, steps, values):
+        try:
+            values = np.asarray(values, dtype=np.float64)
+        except (TypeError, ValueError):
+            # only numeric metrics are summarized
+            return
+        if len(values) == 0:
+            return
+        steps = np.asarray(steps)
+        s = self.summaries.get(name)
+        i_min, i_max = int(np.argmin(values)), int(np.argmax(values))
+        if s is None:
+            s = self.summaries[name] = {
+                "first": float(values[0]),
+                "min": np.inf,
+                "max": -np.inf,
+                "count": 0,
+                "sum": 0.0,
+            }
+        if values[i_min] < s["min"]:
+            s["min"], s["argmin"] = float(values[i_min]), int(steps[i_min])
+        if values[i_max] > s["max"]:
+            s["max"], s["argmax"] = float(values[i_max]), int(steps[i_max])
+        s["last"] = float(values[-1])
+        s["count"] += len(values)
+        s["sum"] += float(values.sum())
+
+    def to_dict(self):
+        return {
+            name: {
+                "first": s["first"],
+                "last": s["last"],
+                "min": s["min"],
+                "argmin": s.get("argmin"),
+                "max": s["max"],
+                "argmax": s.get("argmax"),
+                "mean": s["sum"] / s["count"],
+                "count": s["count"],
+            }
+            for name, s in self.summaries.items()
+        }
+
+
+def summary_file(file_root, grid_id):
+    return os.path.join(file_root, GRID_OUTPUTS, grid_id, SUMMARY_FILE)
+
+
+def append_summary(path, row):
+    """Append one run to a summary table, safe with concurrent writers."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    line = json.dumps(row) + "\n"
+    with open(path, "a+b") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            # end a line cut short by a killed writer, so this row is kept
+            if f.seek(0, os.SEEK_END) > 0:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    line = "\n" + line
+            f.write(line.encode())
+            f.flush()
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def load_summaries(path):
+    rows = []
+    with open(path, "r") as f:
+        for line in f:
+            try:
+                rows.append(json.loads(line))
+            except ValueError:
+                # a line cut short by a killed writer
+                continue
+    return rows
+
+
+def best_runs(rows, metric, stat="last", top=10, by=None, maximize=False):
+    """The *top* runs ordered by *stat* of *metric*. With *by*, only the best
+    run for every value of the config key *by* is kept."""
+    scored = []
+    for row in rows:
+        value = row["metrics"].get(metric, {}).get(stat)
+        if value is None or np.isnan(value):
+            continue
+        scored.append((-value if maximize else value, row))
+    scored.sort(key=lambda x: x[0])
+
+    if by is not None:
+        best_by = {}
+        for score, row in scored:
+            key = row["config"].get(by)
+            key = tuple(key) if type(key) == list else key
+            best_by.setdefault(key, (score, row))
+        scored = sorted(best_by.values(), key=lambda x: x[0])
+
+    return [row for _, row in scored[:top]]
+
+
+def make_summary_row(run, config):
+    return {
+        # ints, strings (sharded layout) or ObjectIds (mongo) depending on the run
+        "run_id": None if run._id is None else str(run._id),
+        "status": run.status,
+        "config": squish_dict(copy.deepcopy(dict(config))),
+        "metrics": run.metric_summaries.to_dict(),
+    }
+
+
+def best_table(rows, metric, stat="last", by=None, exclude_keys=["seed"]):
+    # show the config keys that differ between the listed runs
+    keys = find_differing_keys([r["config"] for r in rows])
+    keys = [k for k in keys if k not in exclude_keys and k != by]
+    if by is not None:
+        keys = [by] + keys
+
+    columns = ["run_id", f"{metric}.{stat}"]
+    if stat in ("min", "max"):
+        columns.append("step")
+    t = PrettyTable(columns + keys)
+    for row in rows:
+        m = row["metrics"][metric]
+        r = [row["run_id"], m[stat]]
+        if stat in ("min", "max"):
+            r.append(m.get(f"arg{stat}"))
+        t.add_row(r + [row["config"].get(k) for k in keys])
+    t.align = "l"
+    return t
+
+
+def _phase_of(metric):
+    if not metric.startswith(TIMER_METRIC_PREFIX):
+        return None
+    phase = metric[len(TIMER_METRIC_PREFIX) :]
+    if phase.endswith(".calls") or phase.endswith(".share"):
+        return None
+    return phase
+
+
+def value_order(v):
+    # numbers in order, then everything else by name
+    number = isinstance(v, (int, float)) and not isinstance(v, bool)
+    return (0, v, "") if number else (1, 0, str(v))
+
+
+def phase_table(rows, by=None):
+    """Mean seconds and share of the adapter's time of every timed phase,
+    per value of the config key *by*."""
+    groups = {}
+    phases = set()
+    for row in rows:
+        key = row["config"].get(by) if by is not None else None
+        key = tuple(key) if type(key) == list else key
+        times = {}
+        for metric, s in row["metrics"].items():
+            phase = _phase_of(metric)
+            if phase is not None:
+                times[phase] = (s["last"], row["metrics"].get(metric + ".share"))
+        if times:
+            phases.update(times)
+            groups.setdefault(key, []).append(times)
+
+    phases = sorted(phases)
+    t = PrettyTable([by or "grid", "runs"] + phases)
+    for key in sorted(groups, key=value_order):
+        runs = groups[key]
+        r = [key if by is not None else "all", len(runs)]
+        for phase in phases:
+            # runs that never entered a phase spent no time in it
+            secs = np.mean([times.get(phase, (0.0, None))[0] for times in runs])
+            shares = [
+                times[phase][1]["last"]
+                for times in runs
+                if phase in times and times[phase][1] is not None
+            ]
+            cell = f"{secs:.3g}s"
+            if shares:
+                cell += f" ({100 * np.sum(shares) / len(runs):.0f}%)"
+            r.append(cell)
+        t.add_row(r)
+    t.align = "l"
+    return t
@@ -0,0 +1,210 @@
+from .globals import TRACE_FILE, TRACE_SUMMARY_FILE
+from contextlib import contextmanager
+from collections import defaultdict
+import numpy as np
+import threading
+import shutil
+import time
+import json
+import os
+
+# Spans of a traced grid_run, nested in every worker's lane:
+#
+#   task            one config in a worker
+#     module load   reloading the adapter module
+#     pre hook      pre_grid_hook
+#     setup         creating the experiment, observers and run
+#     run           the sacred (or lite) run
+#       adapter     the adapter call, with profiling if enabled
+#       flush       waiting for artifacts and writing held back metrics
+#     finalize      last heartbeat, compressing cout, the summary row
+#     post hook     post_grid_hook
+#
+# Every process appends its spans to <trace dir>/<pid>.jsonl as they end,
+# write_trace merges them into a Chrome trace (open it in
+# https://ui.perfetto.dev or chrome://tracing) with one lane per process.
+TASK_SPANS = ["module load", "pre hook", "setup", "run", "finalize", "post hook"]
+
+_tracer = None
+
+
+class Tracer:
+    def __init__(self, trace_dir):
+        self.trace_dir = trace_dir
+        self.pid = os.getpid()
+        os.makedirs(trace_dir, exist_ok=True)
+        self._file = open(os.path.join(trace_dir, f"{self.pid}.jsonl"), "a")
+        self._lock = threading.Lock()
+
+    def record(self, name, start, end, args=None):
+        line = json.dumps(
+            {"name": name, "start": start, "end": end, "pid": self.pid, "args": args}
+        )
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+
+
+def set_tracer(trace_dir):
+    """Record the spans of this process to *trace_dir*, or stop recording if
+    it is None."""
+    global _tracer
+    if trace_dir is None:
+        _tracer = None
+    elif (
+        _tracer is None
+        or _tracer.trace_dir != trace_dir
+        # a forked worker inherits the tracer of its parent
+        or _tracer.pid != os.getpid()
+    ):
+        _tracer = Tracer(trace_dir)
+
+
+def record_span(name, start, end=None, **args):
+    """Record a span that started at *start* (a time.time()) and ends now."""
+    if _tracer is not None:
+        _tracer.record(name, start, time.time() if end is None else end, args)
+
+
+@contextmanager
+def trace_span(name, **args):
+    if _tracer is None:
+        yield
+        return
+    start = time.time()
+    try:
+        yield
+    finally:
+        record_span(name, start, **args)
+
+
+def read_spans(trace_dir):
+    spans = []
+    for filename in os.listdir(trace_dir):
+        if not filename.endswith(".jsonl"):
+            continue
+        with open(os.path.join(trace_dir, filename)) as f:
+            for line in f:
+                try:
+                    spans.append(json.loads(line))
+                except ValueError:
+                    # cut short by a killed worker
+                    continue
+    return spans
+
+
+def lanes_of(spans, main_pid):
+    """{pid: lane}, the main process first, then workers by first task."""
+    first = {}
+    for s in spans:
+        first[s["pid"]] = min(first.get(s["pid"], np.inf), s["start"])
+    workers = sorted((p for p in first if p != main_pid), key=first.get)
+    return {pid: i for i, pid in enumerate([main_pid] + workers)}
+
+
+def chrome_trace(spans, main_pid, name="grid"):
+    """Trace event JSON of *spans*, timestamps in µs since the first span."""
+    t0 = min(s["start"] for s in spans)
+    lanes = lanes_of(spans, main_pid)
+    events = [{"ph": "M", "name": "process_name", "pid": 0, "args": {"name": name}}]
+    for pid, lane in lanes.items():
+        label = "main" if pid == main_pid else f"worker {lane}"
+        events.append(
+            {
+                "ph": "M",
+                "name": "thread_name",
+                "pid": 0,
+                "tid": lane,
+                "args": {"name": f"{label} (pid {pid})"},
+            }
+        )
+    # longer spans first, so viewers nest spans with equal start times right
+    for s in sorted(spans, key=lambda s: (s["start"], s["start"] - s["end"])):
+        events.append(
+            {
+                "ph": "X",
+                "name": s["name"],
+                "ts": (s["start"] - t0) * 1e6,
+                "dur": (s["end"] - s["start"]) * 1e6,
+                "pid": 0,
+                "tid": lanes[s["pid"]],
+                "args": s["args"] or {},
+            }
+        )
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+
+def trace_summary(spans, n_workers, main_pid):
+    """Lines of text on how busy the workers of a traced grid were."""
+    tasks = [s for s in spans if s["name"] == "task"]
+    if not tasks:
+        return ["No tasks were traced"]
+    # configs can be picked up once their submit span ended
+    submitted = {s["args"]["idx"]: s["end"] for s in spans if s["name"] == "submit"}
+    start = min([s["start"] for s in tasks] + list(submitted.values()))
+    end = max(s["end"] for s in tasks)
+    wall = end - start
+    capacity = n_workers * wall
+
+    by_lane = defaultdict(list)
+    for s in tasks:
+        by_lane[s["pid"]].append(s)
+    busy = sum(s["end"] - s["start"] for s in tasks)
+    totals = defaultdict(float)
+    for s in spans:
+        totals[s["name"]] += s["end"] - s["start"]
+
+    # a worker is ready for a task once it was submitted and the worker's
+    # previous task ended, the time until the task starts is dispatch
+    dispatch = []
+    tail = []
+    for lane_tasks in by_lane.values():
+        lane_tasks.sort(key=lambda s: s["start"])
+        prev_end = start
+        for s in lane_tasks:
+            ready = max(submitted.get(s["args"].get("idx"), start), prev_end)
+            dispatch.append(max(s["start"] - ready, 0.0))
+            prev_end = s["end"]
+        tail.append(end - prev_end)
+    # workers that never got a task idled for the whole grid
+    tail += [wall] * max(n_workers - len(by_lane), 0)
+
+    def pct(x):
+        return f"{100 * x / capacity:.1f}%" if capacity > 0 else "-"
+
+    lines = [
+        f"tasks: {len(tasks)} on {len(by_lane)} of {n_workers} workers",
+        f"wall time: {wall:.3f}s",
+        f"utilization (in tasks): {pct(busy)}",
+        f"utilization (in adapter): {pct(totals['adapter'])}",
+        f"dispatch: {sum(dispatch):.3f}s total, {np.mean(dispatch) * 1e3:.2f}ms mean"
+        f" per task ({pct(sum(dispatch))} of worker time)",
+        f"idle at the end (stragglers): {sum(tail):.3f}s ({pct(sum(tail))}),"
+        f" longest {max(tail):.3f}s",
+        "time per span (% of worker time):",
+    ]
+    for name in TASK_SPANS + ["adapter", "flush"]:
+        if name in totals:
+            lines.append(f"  {name}: {totals[name]:.3f}s ({pct(totals[name])})")
+    slowest = sorted(tasks, key=lambda s: s["start"] - s["end"])[:5]
+    lines.append("slowest tasks:")
+    for s in slowest:
+        lines.append(f"  config {s['args'].get('idx')}: {s['end'] - s['start']:.3f}s")
+    return lines
+
+
+def write_trace(trace_dir, out_dir, n_workers, main_pid=None, name="grid"):
+    """Merge the spans in *trace_dir* into trace.json and trace_summary.txt
+    in *out_dir* and remove *trace_dir*. Returns the summary lines."""
+    main_pid = main_pid or os.getpid()
+    spans = read_spans(trace_dir)
+    if not spans:
+        return []
+    os.makedirs(out_dir, exist_ok=True)
+    with open(os.path.join(out_dir, TRACE_FILE), "w") as f:
+        json.dump(chrome_trace(spans, main_pid, name), f)
+    lines = trace_summary(spans, n_workers, main_pid)
+    with open(os.path.join(out_dir, TRACE_SUMMARY_FILE), "w") as f:
+        f.write("\n".join(lines) + "\n")
+    shutil.rmtree(trace_dir, ignore_errors=True)
+    return lines
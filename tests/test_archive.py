@@ -0,0 +1,84 @@
+from sorcerun.archive_utils import (
+    RunArchive,
+    archive_path,
+    compact_grid,
+    iter_archives,
+)
+from sorcerun.metrics_utils import append_metric_log
+from sorcerun.layout_utils import archived_max_run_id
+from sorcerun.globals import COUT_GZ_FILE
+import numpy as np
+import gzip
+import json
+import pytest
+
+
+def make_run(run_dir, grid_id="g", status="COMPLETED", cout=b"hello\n"):
+    run_dir.mkdir(parents=True)
+    (run_dir / "config.json").write_text(json.dumps({"grid_id": grid_id, "lr": 0.1}))
+    (run_dir / "run.json").write_text(
+        json.dumps({"status": status, "experiment": {"name": "e"}})
+    )
+    (run_dir / "info.json").write_text(json.dumps({"note": "x"}))
+    (run_dir / "metrics.json").write_text(
+        json.dumps({"loss": {"steps": [0, 1], "values": [2.0, 1.0]}})
+    )
+    (run_dir / COUT_GZ_FILE).write_bytes(gzip.compress(cout))
+    (run_dir / "model.bin").write_bytes(b"\x00\x01")
+    append_metric_log(run_dir, "acc", [0, 5], [0.5, 0.9], np.array([0.0, 1.0]))
+
+
+@pytest.fixture
+def runs_dir(tmp_path):
+    make_run(tmp_path / "7")
+    make_run(tmp_path / "8", status="RUNNING")
+    make_run(tmp_path / "9", grid_id="other")
+    make_run(tmp_path / "grid-g" / "r1")
+    return tmp_path
+
+
+def test_compact_packs_finished_runs_of_the_grid(runs_dir):
+    assert compact_grid(runs_dir, "g") == 2
+    assert not (runs_dir / "7").exists()
+    assert not (runs_dir / "grid-g").exists()
+    assert (runs_dir / "8").exists() and (runs_dir / "9").exists()
+    assert archived_max_run_id(runs_dir) == 7
+
+    with RunArchive(archive_path(runs_dir, "g")) as archive:
+        assert sorted(archive.run_ids()) == ["7", "grid-g/r1"]
+        config, status = archive.configs()["7"]
+        assert config["lr"] == 0.1 and status == "COMPLETED"
+
+
+def test_keep_leaves_run_dirs(runs_dir):
+    compact_grid(runs_dir, "g", keep=True)
+    assert (runs_dir / "7").exists()
+
+
+def test_load_archived_run(runs_dir):
+    compact_grid(runs_dir, "g")
+    (archive,) = iter_archives(runs_dir, "g")
+    with archive:
+        e = archive.load_expt("7")
+        assert e.id == 7
+        assert e.config["lr"] == 0.1
+        assert e.info["note"] == "x"
+        assert e.captured_out == "hello\n"
+        assert e.metrics["loss"].to_dict() == {0: 2.0, 1: 1.0}
+        assert e.metrics["acc"].to_dict() == {0: 0.5, 5: 0.9}
+        # like incense loading a run directory, info.json is an artifact too
+        assert sorted(e.artifacts) == ["info.json", "model.bin"]
+        assert e.artifacts["model.bin"].file.read() == b"\x00\x01"
+        assert archive.load_expt("grid-g/r1").id == "grid-g/r1"
+
+
+def test_missing_file(runs_dir):
+    compact_grid(runs_dir, "g")
+    with RunArchive(archive_path(runs_dir, "g")) as archive:
+        with pytest.raises(FileNotFoundError):
+            archive.read_file("7", "nope.txt")
+
+
+def test_no_archives(tmp_path):
+    assert list(iter_archives(tmp_path)) == []
+    assert list(iter_archives(tmp_path, "g")) == []
@@ -0,0 +1,101 @@
+from sorcerun.blob_utils import ArtifactUploader, BlobStore, hash_file, use_blob_store
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import os
+import pytest
+
+
+@pytest.fixture
+def store(tmp_path):
+    return BlobStore(str(tmp_path / "blobs"))
+
+
+def write(path, data):
+    path.write_bytes(data)
+    return str(path)
+
+
+def test_put_stores_content_once(tmp_path, store):
+    a = write(tmp_path / "a", b"same")
+    b = write(tmp_path / "b", b"same")
+    digest = store.put(a)
+    assert digest == hashlib.sha256(b"same").hexdigest() == hash_file(a)
+    assert store.put(b) == digest
+    assert os.listdir(os.path.dirname(store.path(digest))) == [digest]
+    assert os.stat(store.path(digest)).st_mode & 0o222 == 0
+
+
+def test_concurrent_puts_leave_one_blob(tmp_path, store):
+    paths = [write(tmp_path / str(i), b"x" * 100000) for i in range(8)]
+    with ThreadPoolExecutor(8) as pool:
+        digests = set(pool.map(store.put, paths))
+    (digest,) = digests
+    blob_dir = os.path.dirname(store.path(digest))
+    assert os.listdir(blob_dir) == [digest]
+    with open(store.path(digest), "rb") as f:
+        assert f.read() == b"x" * 100000
+
+
+def test_failed_copy_leaves_no_blob(tmp_path, store, monkeypatch):
+    src = write(tmp_path / "a", b"data")
+
+    def fail(*args):
+        raise OSError("disk full")
+
+    monkeypatch.setattr("shutil.copyfileobj", fail)
+    with pytest.raises(OSError):
+        store.put(src)
+    digest = hash_file(src)
+    assert os.listdir(os.path.dirname(store.path(digest))) == []
+
+
+def test_link_falls_back_to_symlink(tmp_path, store, monkeypatch):
+    digest = store.put(write(tmp_path / "a", b"data"))
+    store.link(digest, str(tmp_path / "hard"))
+    assert os.stat(tmp_path / "hard").st_nlink == 2
+
+    def no_link(*args):
+        raise OSError("cross-device link")
+
+    monkeypatch.setattr(os, "link", no_link)
+    store.link(digest, str(tmp_path / "hard"))
+    assert os.path.islink(tmp_path / "hard")
+    assert (tmp_path / "hard").read_bytes() == b"data"
+
+
+class Observer:
+    def __init__(self, dir):
+        self.dir = dir
+        self.copied = []
+
+    def save_file(self, filename, target_name=None):
+        self.copied.append(target_name)
+
+
+def test_use_blob_store(tmp_path, store):
+    run_dir = tmp_path / "run"
+    run_dir.mkdir()
+    observer = Observer(str(run_dir))
+    use_blob_store(observer, store)
+    src = write(tmp_path / "model.bin", b"weights")
+    observer.save_file(src, "model.bin")
+    observer.save_file(src, "run.json")
+    assert (run_dir / "model.bin").read_bytes() == b"weights"
+    assert observer.copied == ["run.json"]
+
+
+def test_uploader_keeps_order_and_survives_failures(tmp_path, capsys):
+    added = []
+
+    def add_artifact(filename, name, metadata, content_type):
+        if name == "bad":
+            raise ValueError(name)
+        added.append(name)
+
+    uploader = ArtifactUploader(add_artifact)
+    src = write(tmp_path / "a", b"data")
+    for name in ["1", "bad", "2", "3"]:
+        uploader.submit(src, name)
+    uploader.wait()
+    assert added == ["1", "2", "3"]
+    assert "Failed to add an artifact" in capsys.readouterr().out
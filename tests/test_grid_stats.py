@@ -0,0 +1,107 @@
+from sorcerun.stats_utils import (
+    PREFIX,
+    GridStats,
+    parse_elapsed,
+    parse_openmetrics,
+    status_lines,
+)
+from sorcerun.globals import STATS_FILE
+import pytest
+
+
+def stats(tmp_path, total=4):
+    return GridStats(tmp_path, "g1", total, n_workers=2, rss=lambda: {11: 2**20})
+
+
+def samples_by_name(text):
+    out = {}
+    for name, labels, value in parse_openmetrics(text):
+        out.setdefault(name[len(PREFIX) :], []).append((labels, value))
+    return out
+
+
+def test_render_is_openmetrics(tmp_path):
+    s = stats(tmp_path)
+    s.task_done("a", duration=2.0)
+    text = s.render()
+    lines = text.splitlines()
+    assert lines[-1] == "# EOF" and text.endswith("\n")
+
+    families = {}
+    for line in lines[:-1]:
+        if line.startswith("#"):
+            _, kind, name, rest = line.split(" ", 3)
+            families.setdefault(name, {})[kind] = rest
+        else:
+            # samples follow the metadata of their family
+            name = line.split("{")[0]
+            assert any(name.startswith(f) for f in families)
+            assert 'grid="g1"' in line
+    for name, meta in families.items():
+        assert list(meta)[0] == "TYPE"
+        assert "HELP" in meta
+        if "UNIT" in meta:
+            # the name of a metric with a unit has to end with it
+            assert name.endswith("_" + meta["UNIT"])
+
+
+def test_counts_and_durations(tmp_path):
+    s = stats(tmp_path)
+    with s.task("a"):
+        pass
+    with pytest.raises(ValueError):
+        with s.task("b"):
+            raise ValueError
+    s.task_started("c")
+    m = samples_by_name(s.render())
+    tasks = {labels["state"]: v for labels, v in m["tasks"]}
+    assert tasks == {"completed": 1, "failed": 1, "running": 1, "pending": 1}
+    assert m["size"][0][1] == 4
+    assert m["workers"][0][1] == 2
+    assert m["worker_rss_bytes"] == [({"grid": "g1", "worker": "11"}, 2**20)]
+    assert m["task_duration_seconds_count"][0][1] == 2
+    assert [labels["quantile"] for labels, _ in m["task_duration_seconds"]] == [
+        "0.5",
+        "0.9",
+        "0.99",
+    ]
+
+
+def test_no_durations_are_nan(tmp_path):
+    text = stats(tmp_path).render()
+    m = samples_by_name(text)
+    assert 'task_duration_seconds{grid="g1",quantile="0.5"} NaN' in text
+    assert m["task_duration_seconds_count"][0][1] == 0
+    assert "last_task_duration_seconds" not in m
+
+
+def test_write_and_stop(tmp_path):
+    s = stats(tmp_path, total=1)
+    s.start()
+    s.task_done("a", duration=1.0)
+    s.stop()
+    text = (tmp_path / STATS_FILE).read_text()
+    m = samples_by_name(text)
+    assert m["done"][0][1] == 1
+    assert m["eta_seconds"][0][1] == 0
+    assert not (tmp_path / (STATS_FILE + ".tmp")).exists()
+
+
+def test_status_lines(tmp_path):
+    s = stats(tmp_path)
+    s.task_done("a", duration=3.0)
+    samples = parse_openmetrics(s.render())
+    lines = status_lines(samples)
+    assert lines[0].startswith("1/4 tasks finished (running")
+    assert "completed: 1  failed: 0  running: 0  pending: 3" in lines
+    assert any(line.startswith("last 1 task durations: p50 3s") for line in lines)
+    assert lines[-1] == "  11: 1.0"
+    assert "it may have died" in status_lines(samples, now=s.start_time + 3600)[0]
+
+
+@pytest.mark.parametrize(
+    "elapsed, seconds",
+    [("03:04.5", 184.5), ("01:02:03", 3723), ("1-00:00:01", 86401), ("7", 7)],
+)
+def test_parse_elapsed(elapsed, seconds):
+    assert parse_elapsed(elapsed) == seconds
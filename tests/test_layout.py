@@ -0,0 +1,80 @@
+from sorcerun.layout_utils import (
+    archived_max_run_id,
+    grid_shard,
+    iter_run_dirs,
+    make_sharded_run_dir,
+    run_id_of,
+    run_shard,
+)
+from sorcerun.globals import ARCHIVES_DIR, MAX_RUN_ID_FILE
+import pytest
+
+
+@pytest.fixture
+def runs_dir(tmp_path):
+    """Runs in both layouts, plus what sacred and sorcerun keep next to them."""
+    for run_id in ["1", "2"]:
+        (tmp_path / run_id).mkdir()
+        (tmp_path / run_id / "run.json").write_text("{}")
+    # a flat run whose files are not written yet
+    (tmp_path / "3").mkdir()
+    for shard, name in [("grid-a", "r1"), ("grid-a", "r2"), ("hab12", "r3")]:
+        (tmp_path / shard / name).mkdir(parents=True)
+        (tmp_path / shard / name / "config.json").write_text("{}")
+    (tmp_path / "_sources" / "x").mkdir(parents=True)
+    (tmp_path / ARCHIVES_DIR).mkdir()
+    (tmp_path / "notes.txt").write_text("")
+    return tmp_path
+
+
+def run_ids(runs_dir, run_dirs):
+    return sorted(str(run_id_of(runs_dir, d)) for d in run_dirs)
+
+
+def test_iter_run_dirs_both_layouts(runs_dir):
+    assert run_ids(runs_dir, iter_run_dirs(runs_dir)) == [
+        "1",
+        "2",
+        "3",
+        "grid-a/r1",
+        "grid-a/r2",
+        "hab12/r3",
+    ]
+
+
+def test_iter_run_dirs_of_shards(runs_dir):
+    assert run_ids(runs_dir, iter_run_dirs(runs_dir, shards=["grid-a"])) == [
+        "1",
+        "2",
+        "3",
+        "grid-a/r1",
+        "grid-a/r2",
+    ]
+
+
+def test_run_ids(runs_dir):
+    assert run_id_of(runs_dir, runs_dir / "2") == 2
+    assert run_id_of(runs_dir, runs_dir / "grid-a" / "r1") == "grid-a/r1"
+
+
+def test_shards():
+    assert run_shard({"grid_id": "g1"}) == grid_shard("g1")
+    shard = run_shard({})
+    assert not shard.isdigit()
+    assert shard != run_shard({})
+
+
+def test_make_sharded_run_dir(tmp_path):
+    run_id = make_sharded_run_dir(tmp_path, "grid-a")
+    assert (tmp_path / run_id).is_dir()
+    assert make_sharded_run_dir(tmp_path, "grid-a") != run_id
+    make_sharded_run_dir(tmp_path, "grid-a", name="fixed")
+    with pytest.raises(FileExistsError):
+        make_sharded_run_dir(tmp_path, "grid-a", name="fixed")
+
+
+def test_archived_max_run_id(tmp_path):
+    assert archived_max_run_id(tmp_path) == 0
+    (tmp_path / ARCHIVES_DIR).mkdir()
+    (tmp_path / ARCHIVES_DIR / MAX_RUN_ID_FILE).write_text("42\n")
+    assert archived_max_run_id(tmp_path) == 42
@@ -0,0 +1,123 @@
+from sorcerun.metrics_utils import (
+    SCALAR_CHUNK,
+    Aggregates,
+    Decimate,
+    LTTB,
+    MetricPolicies,
+    MetricPolicy,
+    Reservoir,
+    lttb,
+)
+import numpy as np
+import pytest
+
+
+def test_lttb_keeps_endpoints_and_peaks():
+    x = np.arange(1000)
+    y = np.zeros(1000)
+    y[500] = 10.0
+    xs, ys = lttb(x, y, 20)
+    assert len(xs) == 20
+    assert xs[0] == 0 and xs[-1] == 999
+    assert 500 in xs.tolist()
+    assert np.all(np.diff(xs) > 0)
+
+
+def test_lttb_short_inputs():
+    x, y = np.arange(5), np.arange(5.0)
+    assert lttb(x, y, 10)[0].tolist() == x.tolist()
+    assert lttb(x, y, 2)[0].tolist() == [0, 4]
+
+
+def test_decimate_across_batches():
+    d = Decimate(3)
+    kept = [d.add(np.arange(i, i + 4), np.arange(i, i + 4.0))[0] for i in (0, 4)]
+    assert np.concatenate(kept).tolist() == [0, 3, 6]
+
+
+def test_reservoir_is_uniform_sample():
+    r = Reservoir(50, seed=0)
+    for i in range(0, 1000, 100):
+        steps, values = r.add(np.arange(i, i + 100), np.arange(i, i + 100.0))
+        assert len(steps) == 0
+    steps, values = r.finish()
+    assert len(steps) == 50
+    assert len(set(steps.tolist())) == 50
+    assert np.all(np.diff(steps) > 0)
+    assert steps.tolist() == values.astype(int).tolist()
+    # not just the first values
+    assert steps.max() >= 500
+
+
+def test_reservoir_smaller_than_n():
+    r = Reservoir(10, seed=0)
+    r.add(np.array([2, 1]), np.array([2.0, 1.0]))
+    assert r.finish()[0].tolist() == [1, 2]
+
+
+def test_lttb_sampler_buffer_is_bounded():
+    s = LTTB(10)
+    for i in range(0, 1000, 7):
+        s.add(np.arange(i, i + 7), np.random.default_rng(i).random(7))
+        assert len(s.values) < 2 * s.n
+    steps, _ = s.finish()
+    assert len(steps) == 10
+    assert steps[0] == 0 and steps[-1] == 1000
+
+
+def test_aggregates_match_numpy():
+    values = np.random.default_rng(0).normal(size=100)
+    a = Aggregates()
+    for i in range(0, 100, 30):
+        a.add(np.arange(i, min(i + 30, 100)), values[i : i + 30])
+    out = a.finish()
+    assert out["min"] == values.min()
+    assert out["max"] == values.max()
+    assert out["mean"] == pytest.approx(values.mean())
+    assert out["var"] == pytest.approx(values.var())
+    assert out["last"] == values[-1]
+    assert a.last_step == 99
+
+
+def test_aggregates_reject_unknown_stats():
+    with pytest.raises(ValueError):
+        Aggregates(["median"])
+
+
+def test_policy_aggregate_only_drops_values():
+    p = MetricPolicy({"aggregate": ["min", "max"]})
+    for step in range(10):
+        assert p.add_scalar(step, float(step)) is None
+    out = p.finish("loss")
+    assert set(out) == {"loss.min", "loss.max"}
+    assert out["loss.max"][0].tolist() == [9]
+    assert out["loss.max"][1].tolist() == [9.0]
+
+
+def test_policy_flushes_scalars_in_chunks():
+    p = MetricPolicy({"every": 2})
+    written = [p.add_scalar(step, float(step)) for step in range(SCALAR_CHUNK)]
+    assert all(w is None for w in written[:-1])
+    assert len(written[-1][0]) == SCALAR_CHUNK // 2
+
+
+def test_policy_keeps_scalars_before_arrays():
+    p = MetricPolicy({"every": 1})
+    p.add_scalar(0, 0.0)
+    steps, values = p.add(np.array([1, 2]), np.array([1.0, 2.0]))
+    assert steps.tolist() == [0, 1, 2]
+
+
+@pytest.mark.parametrize(
+    "spec", [{"every": 2, "lttb": 10}, {"bogus": 1}, {"aggregate": ["p50"]}]
+)
+def test_invalid_specs(spec):
+    with pytest.raises(ValueError):
+        MetricPolicies({"loss": spec})
+
+
+def test_policies_match_patterns():
+    policies = MetricPolicies({"train.*": {"every": 10}, "train.loss": {"lttb": 5}})
+    assert isinstance(policies.get("train.acc").sampler, Decimate)
+    assert isinstance(policies.get("train.loss").sampler, LTTB)
+    assert policies.get("val.loss") is None
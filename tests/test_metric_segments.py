@@ -0,0 +1,62 @@
+from sorcerun.metrics_utils import (
+    METRIC_RECORD_DTYPE,
+    append_metric_log,
+    metric_log_path,
+    metric_log_from_bytes,
+    metric_name_of,
+    read_metric_log,
+    read_metric_logs,
+    metric_logs_to_series,
+)
+import datetime
+import numpy as np
+import os
+
+
+def test_round_trip(tmp_path):
+    ts = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+    append_metric_log(tmp_path, "loss", [0, 1], [1.0, 0.5], [ts, ts])
+    append_metric_log(tmp_path, "loss", [2], [0.25], np.array([10.0]))
+
+    records = read_metric_log(metric_log_path(tmp_path, "loss"))
+    assert records["step"].tolist() == [0, 1, 2]
+    assert records["value"].tolist() == [1.0, 0.5, 0.25]
+    assert records["timestamp"].tolist() == [ts.timestamp()] * 2 + [10.0]
+
+
+def test_naive_timestamps_are_utc(tmp_path):
+    ts = datetime.datetime(2024, 1, 1)
+    append_metric_log(tmp_path, "x", [0], [1.0], [ts])
+    records = read_metric_log(metric_log_path(tmp_path, "x"))
+    assert (
+        records["timestamp"][0] == ts.replace(tzinfo=datetime.timezone.utc).timestamp()
+    )
+
+
+def test_partial_record_is_dropped():
+    records = np.zeros(2, dtype=METRIC_RECORD_DTYPE)
+    records["step"] = [3, 4]
+    buf = records.tobytes() + b"\x01\x02\x03"
+    assert metric_log_from_bytes(buf)["step"].tolist() == [3, 4]
+
+
+def test_names_are_quoted(tmp_path):
+    name = "val/acc top-1 %"
+    append_metric_log(tmp_path, name, [0], [1.0], np.array([0.0]))
+    filename = os.path.basename(metric_log_path(tmp_path, name))
+    assert "/" not in filename
+    assert metric_name_of(filename) == name
+    assert metric_name_of("notes.txt") is None
+    assert list(read_metric_logs(tmp_path)) == [name]
+
+
+def test_series_indexed_by_step(tmp_path):
+    append_metric_log(tmp_path, "loss", [5, 10], [2.0, 1.0], np.array([0.0, 1.0]))
+    series = metric_logs_to_series(tmp_path)["loss"]
+    assert series.name == "loss"
+    assert series.index.name == "step"
+    assert series.to_dict() == {5: 2.0, 10: 1.0}
+
+
+def test_no_segments(tmp_path):
+    assert read_metric_logs(tmp_path) == {}
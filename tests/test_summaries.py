@@ -0,0 +1,63 @@
+from sorcerun.summary_utils import (
+    MetricSummaries,
+    append_summary,
+    best_runs,
+    load_summaries,
+)
+import pytest
+
+
+def test_argmin_argmax_across_batches():
+    s = MetricSummaries()
+    s.update("loss", [0, 1, 2], [3.0, 1.0, 2.0])
+    s.update("loss", [10, 11], [0.5, 4.0])
+    out = s.to_dict()["loss"]
+    assert (out["min"], out["argmin"]) == (0.5, 10)
+    assert (out["max"], out["argmax"]) == (4.0, 11)
+    assert (out["first"], out["last"], out["count"]) == (3.0, 4.0, 5)
+    assert out["mean"] == pytest.approx(10.5 / 5)
+
+
+def test_first_extreme_step_wins_ties():
+    s = MetricSummaries()
+    s.update("acc", [0, 1], [1.0, 1.0])
+    s.update("acc", [2], [1.0])
+    out = s.to_dict()["acc"]
+    assert out["argmin"] == 0 and out["argmax"] == 0
+
+
+def test_non_numeric_and_empty_metrics_are_skipped():
+    s = MetricSummaries()
+    s.update("name", [0], ["abc"])
+    s.update("loss", [], [])
+    assert s.to_dict() == {}
+
+
+def row(run_id, value, lr):
+    return {
+        "run_id": run_id,
+        "config": {"lr": lr},
+        "metrics": {"loss": {"last": value}},
+    }
+
+
+def test_best_runs():
+    rows = [
+        row("1", 0.3, 1),
+        row("2", 0.1, 1),
+        row("3", float("nan"), 2),
+        row("4", 0.2, 2),
+    ]
+    assert [r["run_id"] for r in best_runs(rows, "loss")] == ["2", "4", "1"]
+    assert [r["run_id"] for r in best_runs(rows, "loss", maximize=True, top=1)] == ["1"]
+    assert [r["run_id"] for r in best_runs(rows, "loss", by="lr")] == ["2", "4"]
+    assert best_runs(rows, "acc") == []
+
+
+def test_summary_table_skips_cut_lines(tmp_path):
+    path = tmp_path / "grid" / "summaries.jsonl"
+    append_summary(path, row("1", 0.3, 1))
+    with open(path, "a") as f:
+        f.write('{"run_id": "2", "conf')
+    append_summary(path, row("3", 0.1, 1))
+    assert [r["run_id"] for r in load_summaries(path)] == ["1", "3"]